@@ -3,12 +3,15 @@
 Модуль для работы с MongoDB
 Содержит функции для подключения, сохранения и обновления данных
 """
+import functools
 import os
 import re
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional
-from pymongo import MongoClient
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
 from dotenv import load_dotenv
 from urllib.parse import urlparse
 
@@ -20,6 +23,16 @@ load_dotenv(dotenv_path=PROJECT_ROOT / ".env")
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
+# Сколько комплексов копить перед одной пакетной записью в MongoDB
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "10"))
+
+# Записи, ожидающие пакетного сохранения, вместе с меткой вызывающего кода (см. queue_for_mongodb / flush_pending)
+_pending_items: List[Tuple[Dict, Any]] = []
+
+# Итог save_to_mongodb для каждой записи пачки
+SAVE_OK = "saved"  # запись в базе
+SAVE_REJECTED = "rejected"  # запись не принята и не будет принята при повторе (нет URL, ошибка записи документа)
+SAVE_FAILED = "failed"  # не сохранена из-за сбоя подключения или пачки, повтор может пройти
 
 
 def get_mongo_client():
@@ -35,6 +48,7 @@ def get_mongo_client():
         return None
 
 
+@functools.lru_cache(maxsize=4096)
 def extract_slug_from_url(url: Optional[str]) -> Optional[str]:
     """Возвращает slug комплекса из URL."""
     if not url:
@@ -51,6 +65,7 @@ def extract_slug_from_url(url: Optional[str]) -> Optional[str]:
     return None
 
 
+@functools.lru_cache(maxsize=4096)
 def normalize_complex_url(url: str) -> str:
     """
     Нормализует URL комплекса, приводя к единому формату.
@@ -68,10 +83,11 @@ def normalize_complex_name(name: Optional[str]) -> Optional[str]:
     return re.sub(r'\s+', ' ', name).strip().lower()
 
 
-def find_existing_record(collection, url: str, complex_name: Optional[str] = None):
+def find_existing_record(collection, url: str, complex_name: Optional[str] = None, exact_checked: bool = False):
     """
     Ищет существующую запись по URL, учитывая разные варианты доменов.
     Ищет по нормализованному URL и по slug комплекса.
+    exact_checked=True — точное совпадение нормализованного URL уже проверено вызывающим кодом.
     """
     if not url:
         return None
@@ -80,9 +96,10 @@ def find_existing_record(collection, url: str, complex_name: Optional[str] = Non
     normalized_url = normalize_complex_url(url)
     
     # Сначала ищем по точному совпадению нормализованного URL
-    existing = collection.find_one({'url': normalized_url})
-    if existing:
-        return existing
+    if not exact_checked:
+        existing = collection.find_one({'url': normalized_url})
+        if existing:
+            return existing
     
     # Если не нашли, ищем по исходному URL
     if url != normalized_url:
@@ -240,35 +257,59 @@ def compare_and_merge_data(existing_data, new_data):
     return merged, changes
 
 
-def save_to_mongodb(data):
-    """Умное сохранение с поиском по URL и обновлением только изменений"""
+def save_to_mongodb(data) -> List[str]:
+    """
+    Умное сохранение с поиском по URL и обновлением только изменений.
+    Все записи из data уходят в базу одним bulk_write.
+    Возвращает список статусов той же длины, что data: SAVE_OK, SAVE_REJECTED или SAVE_FAILED.
+    """
+    statuses = [SAVE_FAILED] * len(data)
     try:
         client = get_mongo_client()
         if not client:
-            return False
+            return statuses
             
         db = client[DB_NAME]
         collection = db[COLLECTION_NAME]
         
-        for item in data:
+        items = []
+        for position, item in enumerate(data):
             url = item.get('url')
             if not url:
                 print("⚠️ URL не найден в данных, пропускаем")
+                statuses[position] = SAVE_REJECTED
                 continue
             
             # Нормализуем URL перед сохранением
             normalized_url = normalize_complex_url(url)
             item['url'] = normalized_url  # Сохраняем нормализованный URL
             
-            # Ищем существующую запись по URL (с учетом разных вариантов доменов)
             complex_name = item.get('development', {}).get('complex_name')
             normalized_name = None
             if complex_name:
                 normalized_name = normalize_complex_name(complex_name)
                 if normalized_name:
                     item['normalized_complex_name'] = normalized_name
+            items.append((position, item, complex_name, normalized_name))
+        
+        # Записи с совпадающим нормализованным URL забираем одним запросом,
+        # для остальных остается поиск по вариантам URL, slug и названию
+        urls = list({item['url'] for _, item, _, _ in items})
+        existing_by_url = {}
+        if urls:
+            for doc in collection.find({'url': {'$in': urls}}):
+                existing_by_url.setdefault(doc['url'], doc)
+        
+        operations = []
+        # Для каждой операции — позиция ее записи в data
+        operation_positions = []
+        for position, item, complex_name, normalized_name in items:
+            normalized_url = item['url']
             
-            existing = find_existing_record(collection, normalized_url, complex_name)
+            # Ищем существующую запись по URL (с учетом разных вариантов доменов)
+            existing = existing_by_url.get(normalized_url)
+            if existing is None:
+                existing = find_existing_record(collection, normalized_url, complex_name, exact_checked=True)
             
             if existing:
                 existing_url = existing.get('url', '')
@@ -295,32 +336,83 @@ def save_to_mongodb(data):
                         print(f"   - {change}")
                     
                     # Обновляем запись по _id существующей записи
-                    collection.update_one(
-                        {'_id': existing['_id']},
-                        {'$set': merged_data}
-                    )
-                    print(f"✅ Запись обновлена")
+                    operations.append(UpdateOne({'_id': existing['_id']}, {'$set': merged_data}))
+                    operation_positions.append(position)
                 else:
                     # Даже если нет изменений, обновляем URL если он отличается
                     if existing_url != normalized_url:
-                        collection.update_one(
-                            {'_id': existing['_id']},
-                            {'$set': {'url': normalized_url}}
-                        )
-                        print(f"✅ URL обновлен на нормализованный")
+                        operations.append(UpdateOne({'_id': existing['_id']}, {'$set': {'url': normalized_url}}))
+                        operation_positions.append(position)
                     else:
                         print(f"ℹ️ Нет изменений, запись не обновлена")
+                # Повтор того же комплекса в пачке сливается с уже объединенными данными
+                existing_by_url[normalized_url] = merged_data
             else:
                 print(f"➕ Создаем новую запись для: {normalized_url}")
-                # Удаляем _id если он есть
-                if '_id' in item:
-                    del item['_id']
-                collection.insert_one(item)
-                print(f"✅ Новая запись создана")
+                # _id назначаем сами, чтобы повтор комплекса в той же пачке обновил эту запись
+                item['_id'] = ObjectId()
+                operations.append(InsertOne(item))
+                operation_positions.append(position)
+                existing_by_url[normalized_url] = item
+        
+        if operations:
+            try:
+                # ordered=True: операции над одним комплексом должны примениться по порядку
+                result = collection.bulk_write(operations, ordered=True)
+            except BulkWriteError as e:
+                client.close()
+                write_errors = e.details.get('writeErrors') or []
+                if not write_errors:
+                    print(f"❌ Ошибка сохранения в MongoDB: {e}")
+                    return statuses
+                # Операции до первой ошибки применены, ее запись отклонена, остальные не выполнялись
+                rejected_position = operation_positions[write_errors[0]['index']]
+                print(f"❌ MongoDB отклонила запись {rejected_position + 1} из {len(data)}: {write_errors[0].get('errmsg')}")
+                for position in range(rejected_position):
+                    if statuses[position] != SAVE_REJECTED:
+                        statuses[position] = SAVE_OK
+                statuses[rejected_position] = SAVE_REJECTED
+                # Остаток пачки сохраняем заново: он сверяется с базой без отклоненной записи
+                rest = data[rejected_position + 1:]
+                if rest:
+                    statuses[rejected_position + 1:] = save_to_mongodb(rest)
+                return statuses
+            print(f"✅ MongoDB: добавлено {result.inserted_count}, обновлено {result.modified_count}")
         
         client.close()
-        return True
+        return [SAVE_REJECTED if status == SAVE_REJECTED else SAVE_OK for status in statuses]
     except Exception as e:
         print(f"❌ Ошибка сохранения в MongoDB: {e}")
-        return False
+        return statuses
 
+
+def take_pending(force: bool = False) -> List[Tuple[Dict, Any]]:
+    """
+    Забирает из очереди накопленную пачку пар (запись, метка): только полную или (force=True) любую непустую.
+    """
+    if not _pending_items or (not force and len(_pending_items) < MONGO_BATCH_SIZE):
+        return []
+    batch = list(_pending_items)
+    _pending_items.clear()
+    return batch
+
+
+def flush_pending() -> List[Dict]:
+    """
+    Сохраняет накопленные записи одной пачкой.
+    Возвращает записи, которые сохранить не удалось (пустой список при успехе).
+    """
+    items = [item for item, _ in take_pending(force=True)]
+    if not items:
+        return []
+    return [item for item, status in zip(items, save_to_mongodb(items)) if status != SAVE_OK]
+
+
+def queue_for_mongodb(item: Dict, tag: Any = None) -> List[Tuple[Dict, Any]]:
+    """
+    Ставит запись в очередь и возвращает пачку для сохранения, если накопилось MONGO_BATCH_SIZE записей.
+    tag (например, индекс URL) возвращается в пачке рядом с записью, чтобы вызывающий код
+    мог отметить ее сохранение. Саму запись пачки выполняет вызывающий код через save_to_mongodb.
+    """
+    _pending_items.append((item, tag))
+    return take_pending()
@@ -11,24 +11,34 @@
 - Загружает изображения в S3 и сохраняет пути в MongoDB:
   - development.photos - пути к фотографиям ЖК
   - apartment_types.*.apartments.*.photos - пути к фотографиям квартир
-- Результаты пишет в MongoDB и offers_data.json (массив объектов)
+- Результаты пишет в MongoDB; при ошибке записи — в offers_data.jsonl (по объекту на строку)
 - Прогресс хранит в progress_domclick_2.json: {"url_index": i, "offset": n}
 - При ошибках делает до 3 попыток; после 3-й — перезапускает браузер (новый прокси)
   и продолжает с того же места
 """
 import asyncio
+import functools
+import hashlib
 import json
 import os
 import base64
 import logging
-from typing import List, Dict, Any, Tuple, Optional
+import operator
+import random
+from typing import List, Dict, Any, Tuple, Optional, Set, AsyncIterator
 from pathlib import Path
 import aiohttp
 from io import BytesIO
 import sys
 import shutil
+from collections import defaultdict
 from urllib.parse import urlparse, parse_qs, urlencode
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Без orjson отладочный JSONL пишется стандартным json
+
 # Директория текущего скрипта
 PROJECT_ROOT = Path(__file__).resolve().parent
 
@@ -36,18 +46,25 @@ PROJECT_ROOT = Path(__file__).resolve().parent
 UPLOADS_DIR = PROJECT_ROOT / "uploads"
 
 from browser_manager import create_browser, create_browser_page, restart_browser
-from db_manager import save_to_mongodb
+from db_manager import queue_for_mongodb, save_to_mongodb, take_pending, SAVE_OK, SAVE_FAILED
 from resize_img import ImageProcessor
 from s3_service import S3Service
 from watermark_on_save import upload_with_watermark
 
 LINKS_FILE = PROJECT_ROOT / "complex_links.json"
 PROGRESS_FILE = PROJECT_ROOT / "progress_domclick_2.json"
-OUTPUT_FILE = PROJECT_ROOT / "offers_data.json"  # больше не используется как основной, оставим для отладки
+OUTPUT_FILE = PROJECT_ROOT / "offers_data.jsonl"  # больше не используется как основной, оставим для отладки (JSON Lines)
 START_PAUSE_SECONDS = 5  # пауза после открытия URL
 STEP_PAUSE_SECONDS = 5  # пауза между страницами/шагами
 FETCH_OFFERS_MAX_RETRIES = 5
 FIRST_PAGE_FETCH_ATTEMPTS = 5
+OFFERS_PAGE_CONCURRENCY = 4  # сколько страниц API запрашивать одновременно
+OFFERS_PAGE_STAGGER_SECONDS = 0.5  # сдвиг старта между параллельными запросами
+RETRY_BACKOFF_MAX_SECONDS = 30  # потолок паузы между повторными запросами к API
+APARTMENT_PHOTO_CONCURRENCY = 8  # одновременных скачиваний/загрузок фото квартир на ЖК
+URL_WORKERS = int(os.getenv("DOMCLICK_URL_WORKERS", "1"))  # сколько URL обрабатывать параллельно (по браузеру на воркер)
+FINALIZE_CONCURRENCY = 3  # сколько ЖК одновременно догружают фото в фоне, пока парсится следующий URL
+MONGO_WRITE_CONCURRENCY = 1  # одновременных пакетных записей в MongoDB (>1 может задвоить новый ЖК)
 
 # Настройка логгера для ImageProcessor
 logger = logging.getLogger(__name__)
@@ -67,6 +84,123 @@ if not logger.handlers:
 image_processor = ImageProcessor(logger, max_size=(800, 600), max_kb=150)
 
 
+# JS для page.evaluate: собирает URL изображений галереи ЖК на текущей странице
+_JS_GALLERY_IMAGES = r"""
+() => {
+  const complexPhotos = [];
+
+  // Пробуем разные селекторы для галереи
+  let galleryContainer = document.querySelector('[data-e2e-id="complex-header-gallery"]');
+  if (!galleryContainer) {
+    galleryContainer = document.querySelector('[data-e2e-id*="gallery"]');
+  }
+  if (!galleryContainer) {
+    galleryContainer = document.querySelector('.gallery, [class*="gallery"], [class*="Gallery"]');
+  }
+
+  if (!galleryContainer) {
+    return [];
+  }
+
+  // Пробуем разные селекторы для изображений
+  let imageElements = galleryContainer.querySelectorAll('[data-e2e-id^="complex-header-gallery-image__"]');
+  if (imageElements.length === 0) {
+    imageElements = galleryContainer.querySelectorAll('img');
+  }
+
+  const toAbs = (u) => {
+    try { return new URL(u, location.origin).href; } catch { return u || null; }
+  };
+  const pickFromSrcset = (srcset) => {
+    if (!srcset) return null;
+    const first = String(srcset).split(',')[0].trim().split(' ')[0];
+    return first || null;
+  };
+
+  imageElements.forEach((element) => {
+    let img = element;
+    if (element.tagName !== 'IMG') {
+      img = element.querySelector('img');
+    }
+    if (!img) {
+      img = element.querySelector('img.picture-image-object-fit--cover-820-5-0-5.picture-imageFillingContainer-4a2-5-0-5');
+    }
+    if (!img) {
+      img = element.querySelector('img');
+    }
+    if (!img) {
+      return;
+    }
+
+    const candidates = [
+      img.src,
+      img.getAttribute('src'),
+      img.getAttribute('data-src'),
+      img.getAttribute('data-lazy'),
+      img.getAttribute('data-original'),
+      pickFromSrcset(img.getAttribute('srcset'))
+    ];
+
+    candidates
+      .filter(Boolean)
+      .map(toAbs)
+      .filter(Boolean)
+      .forEach((absoluteUrl) => {
+        if (
+          /\.(jpg|jpeg|png|webp)/i.test(absoluteUrl) ||
+          absoluteUrl.includes('img.dmclk.ru') ||
+          absoluteUrl.includes('vitrina')
+        ) {
+          complexPhotos.push(absoluteUrl);
+        }
+      });
+  });
+
+  return complexPhotos;
+}
+"""
+
+# JS для page.evaluate: ищет ссылку на страницу "О ЖК" (от нее строится URL хода строительства)
+_JS_ABOUT_HREF = r"""
+() => {
+  let a = document.querySelector('[data-e2e-id="complex-header-about"]');
+
+  if (!a) {
+    const links = Array.from(document.querySelectorAll('a'));
+    a = links.find(link => {
+      const text = (link.textContent || '').toLowerCase().trim();
+      return text.includes('о жк') || text.includes('о комплексе') || text.includes('подробнее');
+    });
+  }
+  if (!a) {
+    const links = Array.from(document.querySelectorAll('a[href*="about"], a[href*="o-zhk"]'));
+    if (links.length > 0) {
+      a = links[0];
+    }
+  }
+  if (!a) {
+    const currentPath = location.pathname;
+    const basePath = currentPath.split('/').slice(0, -1).join('/');
+    const links = Array.from(document.querySelectorAll(`a[href*="${basePath}/about"], a[href*="${basePath}/o-zhk"]`));
+    if (links.length > 0) {
+      a = links[0];
+    }
+  }
+  if (a) {
+    const href = a.getAttribute('href') || a.href || null;
+    if (href) {
+      try {
+        return new URL(href, location.origin).href;
+      } catch {
+        return href.startsWith('http') ? href : location.origin + (href.startsWith('/') ? href : '/' + href);
+      }
+    }
+  }
+  return null;
+}
+"""
+
+
 def create_complex_directory(complex_id: str) -> Path:
     """
     Создает структуру папок для комплекса.
@@ -82,6 +216,7 @@ def create_complex_directory(complex_id: str) -> Path:
     return complex_dir
 
 
+@functools.lru_cache(maxsize=4096)
 def get_complex_id_from_url(url: str) -> str:
     """
     Извлекает ID комплекса из URL.
@@ -98,10 +233,10 @@ def get_complex_id_from_url(url: str) -> str:
         pass
 
     # Fallback - используем хеш URL
-    import hashlib
     return hashlib.md5(url.encode()).hexdigest()[:10]
 
 
+@functools.lru_cache(maxsize=4096)
 def normalize_complex_url(url: str) -> str:
     """
     Нормализует URL комплекса, приводя к единому формату.
@@ -125,6 +260,16 @@ def normalize_complex_url(url: str) -> str:
     return url
 
 
+@functools.lru_cache(maxsize=2048)
+def _build_hod_url(href: str) -> str:
+    """
+    Строит URL страницы хода строительства из ссылки на ЖК или страницу "О ЖК".
+    """
+    if '/hod-stroitelstva' in href:
+        return href
+    return href + ('hod-stroitelstva' if href.endswith('/') else '/hod-stroitelstva')
+
+
 def is_complex_url(url: str) -> bool:
     """
     Проверяет, похоже ли, что URL указывает напрямую на страницу ЖК.
@@ -180,33 +325,112 @@ def derive_complex_href_from_params(api_params: Dict[str, Any]) -> Optional[str]
     return None
 
 
-async def check_ban_and_restart(page, browser, max_restarts: int = 3) -> Tuple[bool, Any, Any]:
+async def page_is_banned(page) -> bool:
     """
     Проверяет HTML страницы на наличие строки бана "Похоже, ваш запрос выглядит".
-    Если бан обнаружен, перезапускает браузер с новым прокси.
-    Возвращает (was_banned, browser, page) - был ли бан и обновленные browser/page.
     """
     try:
         # Добавляем таймаут для page.content() чтобы избежать зависаний
         html_content = await asyncio.wait_for(page.content(), timeout=10.0)
-        if "Похоже, ваш запрос выглядит" in html_content:
-            logger.warning("  ⚠️ Обнаружен бан! Перезапускаю браузер с новым прокси...")
-            for restart_attempt in range(max_restarts):
-                try:
-                    browser, page, _ = await restart_browser(browser, headless=False)
-                    logger.info(f"  ✓ Браузер перезапущен с новым прокси (попытка {restart_attempt + 1})")
-                    return True, browser, page
-                except Exception as restart_error:
-                    logger.error(f"  ✗ Ошибка перезапуска браузера (попытка {restart_attempt + 1}): {restart_error}")
-                    if restart_attempt < max_restarts - 1:
-                        await asyncio.sleep(2)
-                    else:
-                        logger.error("  ✗ Не удалось перезапустить браузер после всех попыток")
-                        return True, browser, page
+        return "Похоже, ваш запрос выглядит" in html_content
     except Exception as e:
         logger.warning(f"  ⚠️ Ошибка при проверке бана: {e}")
-    
-    return False, browser, page
+        return False
+
+
+async def restart_after_ban(browser, page, max_restarts: int = 3) -> Tuple[Any, Any]:
+    """
+    Перезапускает браузер с новым прокси после бана.
+    Возвращает обновленные browser/page (прежние, если перезапустить не удалось).
+    """
+    logger.warning("  ⚠️ Обнаружен бан! Перезапускаю браузер с новым прокси...")
+    for restart_attempt in range(max_restarts):
+        try:
+            browser, page, _ = await restart_browser(browser, headless=False)
+            logger.info(f"  ✓ Браузер перезапущен с новым прокси (попытка {restart_attempt + 1})")
+            return browser, page
+        except Exception as restart_error:
+            logger.error(f"  ✗ Ошибка перезапуска браузера (попытка {restart_attempt + 1}): {restart_error}")
+            if restart_attempt < max_restarts - 1:
+                await asyncio.sleep(2)
+    logger.error("  ✗ Не удалось перезапустить браузер после всех попыток")
+    return browser, page
+
+
+async def check_ban_and_restart(page, browser, max_restarts: int = 3) -> Tuple[bool, Any, Any]:
+    """
+    Проверяет страницу на бан и при бане перезапускает браузер с новым прокси.
+    Возвращает (was_banned, browser, page) - был ли бан и обновленные browser/page.
+    """
+    if not await page_is_banned(page):
+        return False, browser, page
+    browser, page = await restart_after_ban(browser, page, max_restarts)
+    return True, browser, page
+
+
+def retry_backoff_delay(attempt: int) -> float:
+    """
+    Пауза перед повторной попыткой: экспоненциальный рост с небольшим случайным разбросом.
+    """
+    return min(RETRY_BACKOFF_MAX_SECONDS, 0.5 * 2 ** attempt + random.uniform(0, 0.5))
+
+
+def is_session_closed_error(error: Exception) -> bool:
+    """
+    Проверяет, что ошибка pyppeteer означает закрытую вкладку/сессию браузера.
+    """
+    error_str = str(error).lower()
+    return 'session closed' in error_str or 'target closed' in error_str or 'page closed' in error_str
+
+
+async def close_browser_quietly(browser) -> None:
+    """
+    Закрывает браузер, игнорируя ошибки (браузер может быть уже закрыт).
+    """
+    try:
+        if browser:
+            await browser.close()
+    except Exception:
+        pass
+
+
+async def wait_document_complete(page, timeout_ms: int = 20000) -> None:
+    """
+    Ждет document.readyState === 'complete'; по таймауту просто продолжает.
+    """
+    try:
+        await page.waitForFunction(
+            "() => document.readyState === 'complete'",
+            {"timeout": timeout_ms}
+        )
+    except Exception:
+        pass
+
+
+async def restart_browser_for_url(browser, page, base_url: str, restart_count: int, max_restarts: int) -> Tuple[Any, Any, int, bool]:
+    """
+    Перезапускает браузер с новым прокси и заново открывает base_url.
+    Возвращает (browser, page, restart_count, restarted).
+    Если restarted=False и лимит перезапусков исчерпан — браузер закрыт, URL нужно пропустить;
+    иначе можно повторить попытку.
+    """
+    if restart_count < max_restarts:
+        restart_count += 1
+        try:
+            browser, page, _ = await restart_browser(browser, headless=False)
+            await page.goto(base_url, timeout=60000, waitUntil='load')
+            await wait_document_complete(page)
+            await asyncio.sleep(3)
+            return browser, page, restart_count, True
+        except Exception:
+            pass
+
+    if restart_count >= max_restarts:
+        print(f"  ✗ Достигнут лимит перезапусков браузера, пропускаю URL")
+        await close_browser_quietly(browser)
+    else:
+        await asyncio.sleep(5)
+    return browser, page, restart_count, False
 
 
 async def extract_gallery_images(page) -> List[str]:
@@ -215,80 +439,7 @@ async def extract_gallery_images(page) -> List[str]:
     """
     try:
         # Добавляем таймаут для page.evaluate() чтобы избежать зависаний
-        data = await asyncio.wait_for(page.evaluate(r"""
-        () => {
-          const complexPhotos = [];
-
-          // Пробуем разные селекторы для галереи
-          let galleryContainer = document.querySelector('[data-e2e-id="complex-header-gallery"]');
-          if (!galleryContainer) {
-            galleryContainer = document.querySelector('[data-e2e-id*="gallery"]');
-          }
-          if (!galleryContainer) {
-            galleryContainer = document.querySelector('.gallery, [class*="gallery"], [class*="Gallery"]');
-          }
-
-          if (!galleryContainer) {
-            return [];
-          }
-
-          // Пробуем разные селекторы для изображений
-          let imageElements = galleryContainer.querySelectorAll('[data-e2e-id^="complex-header-gallery-image__"]');
-          if (imageElements.length === 0) {
-            imageElements = galleryContainer.querySelectorAll('img');
-          }
-
-          const toAbs = (u) => {
-            try { return new URL(u, location.origin).href; } catch { return u || null; }
-          };
-          const pickFromSrcset = (srcset) => {
-            if (!srcset) return null;
-            const first = String(srcset).split(',')[0].trim().split(' ')[0];
-            return first || null;
-          };
-
-          imageElements.forEach((element) => {
-            let img = element;
-            if (element.tagName !== 'IMG') {
-              img = element.querySelector('img');
-            }
-            if (!img) {
-              img = element.querySelector('img.picture-image-object-fit--cover-820-5-0-5.picture-imageFillingContainer-4a2-5-0-5');
-            }
-            if (!img) {
-              img = element.querySelector('img');
-            }
-            if (!img) {
-              return;
-            }
-
-            const candidates = [
-              img.src,
-              img.getAttribute('src'),
-              img.getAttribute('data-src'),
-              img.getAttribute('data-lazy'),
-              img.getAttribute('data-original'),
-              pickFromSrcset(img.getAttribute('srcset'))
-            ];
-
-            candidates
-              .filter(Boolean)
-              .map(toAbs)
-              .filter(Boolean)
-              .forEach((absoluteUrl) => {
-                if (
-                  /\.(jpg|jpeg|png|webp)/i.test(absoluteUrl) ||
-                  absoluteUrl.includes('img.dmclk.ru') ||
-                  absoluteUrl.includes('vitrina')
-                ) {
-                  complexPhotos.push(absoluteUrl);
-                }
-              });
-          });
-
-          return complexPhotos;
-        }
-        """), timeout=10.0)
+        data = await asyncio.wait_for(page.evaluate(_JS_GALLERY_IMAGES), timeout=10.0)
         if isinstance(data, list):
             return [str(url) for url in data if isinstance(url, str) and url]
     except asyncio.TimeoutError:
@@ -501,6 +652,71 @@ async def extract_construction_from_domclick(page, hod_url: str) -> Dict[str, An
         return {"construction_stages": []}
 
 
+async def extract_construction_with_backup_tab(browser, page, hod_url: str, timeout: float = 150.0) -> Tuple[Dict[str, Any], bool]:
+    """
+    Запускает extract_construction_from_domclick одновременно в основной и запасной вкладке
+    и возвращает (первый результат с этапами, бан). Бан проверяется на той вкладке, с которой
+    пришел результат, до закрытия запасной вкладки после гонки.
+    """
+    try:
+        backup_page = await create_browser_page(browser)
+    except Exception as tab_error:
+        logger.warning(f"  Не удалось открыть запасную вкладку: {tab_error}")
+        stages_data = await extract_construction_from_domclick(page, hod_url)
+        return stages_data, await page_is_banned(page)
+
+    task_pages = {
+        asyncio.create_task(extract_construction_from_domclick(page, hod_url)): page,
+        asyncio.create_task(extract_construction_from_domclick(backup_page, hod_url)): backup_page,
+    }
+    tasks = set(task_pages)
+    stages_data: Dict[str, Any] = {}
+    result_page = page
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=max(0.0, deadline - loop.time()))
+            if not done:
+                break  # Общий таймаут
+            for task in done:
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                result = task.result()
+                if result and result.get('construction_stages'):
+                    return result, await page_is_banned(task_pages[task])
+                if result:
+                    stages_data, result_page = result, task_pages[task]
+        return stages_data, await page_is_banned(result_page)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await backup_page.close()
+        except Exception:
+            pass
+
+
+def _resize_and_upload(s3: S3Service, raw: bytes, key: str) -> Optional[str]:
+    """
+    Сжимает фото и загружает его в S3 с водяным знаком; возвращает публичный URL или None.
+    Работает синхронно (PIL, cairosvg, boto3), поэтому вызывается через asyncio.to_thread.
+    """
+    try:
+        processed = image_processor.process(BytesIO(raw))
+    except Exception:
+        return None
+    processed.seek(0)
+    data = processed.read()
+    try:
+        return upload_with_watermark(s3, data, key)
+    except Exception:
+        return None
+
+
 async def process_construction_stages_domclick(stages: List[Dict[str, Any]], complex_id: str) -> Dict[str, Any]:
     """Скачивает фото по этапам и загружает в S3, возвращает структуру construction_progress с URL."""
     if not stages:
@@ -528,19 +744,8 @@ async def process_construction_stages_domclick(stages: List[Dict[str, Any]], com
                             raw = await response.read()
                     except Exception:
                         return None
-                    input_bytes = BytesIO(raw)
-                    try:
-                        processed = image_processor.process(input_bytes)
-                    except Exception:
-                        return None
-                    processed.seek(0)
-                    data = processed.read()
                     key = f"complexes/{complex_id}/construction/stage_{stage_num}/photo_{idx + 1}.jpg"
-                    try:
-                        url_public = upload_with_watermark(s3, data, key)
-                        return url_public
-                    except Exception:
-                        return None
+                    return await asyncio.to_thread(_resize_and_upload, s3, raw, key)
             tasks = [work(u, i) for i, u in enumerate(urls)]
             results = await asyncio.gather(*tasks, return_exceptions=True)
             for p in results:
@@ -595,6 +800,75 @@ def save_progress(url_index: int, offset: int, path: str = str(PROGRESS_FILE)) -
     os.replace(tmp_path, path)
 
 
+def append_output_record(record: Dict[str, Any], path: str = str(OUTPUT_FILE)) -> None:
+    """Дописывает одну запись в конец JSONL-файла, не перезаписывая уже сохраненные."""
+    if orjson is not None:
+        line = orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    else:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    with open(path, "ab") as f:
+        f.write(line)
+
+
+def dump_unsaved_items(items: List[Dict[str, Any]], path: str = str(OUTPUT_FILE)) -> None:
+    """
+    Дописывает в JSONL записи, которые не удалось сохранить в MongoDB (для отладки).
+    """
+    if not items:
+        return
+    print(f"Не удалось сохранить в MongoDB {len(items)} записей. Сохраню в {path} для отладки.")
+    for item in items:
+        item.pop('_id', None)
+        append_output_record({
+            "sourceUrl": item.get('development', {}).get('source_url'),
+            "data": item,
+        }, path)
+
+
+# Фоновые записи в MongoDB: синхронный pymongo уходит в поток, парсинг следующего URL не ждет
+_mongo_tasks: Set[asyncio.Task] = set()
+_mongo_semaphore = asyncio.Semaphore(MONGO_WRITE_CONCURRENCY)
+
+
+async def _save_batch_in_background(batch: List[Tuple[Dict[str, Any], int]], progress: Dict[str, Any]) -> None:
+    """
+    Сохраняет пачку (запись, индекс URL) в MongoDB в отдельном потоке; несохраненные записи пишет в JSONL.
+    Прогресс сдвигается по сохраненным и навсегда отклоненным записям: URL записей,
+    не сохраненных из-за сбоя, при обрыве будут пройдены заново.
+    """
+    items = [item for item, _ in batch]
+    async with _mongo_semaphore:
+        try:
+            statuses = await asyncio.to_thread(save_to_mongodb, items)
+        except Exception as e:
+            print(f"Ошибка записи в MongoDB: {e}")
+            statuses = [SAVE_FAILED] * len(items)
+    for (_, url_index), status in zip(batch, statuses):
+        if status != SAVE_FAILED:
+            mark_url_done(progress, url_index)
+    dump_unsaved_items([item for item, status in zip(items, statuses) if status != SAVE_OK])
+
+
+def schedule_mongo_save(batch: List[Tuple[Dict[str, Any], int]], progress: Dict[str, Any]) -> None:
+    """
+    Запускает фоновое сохранение пачки, не блокируя цикл событий.
+    """
+    if not batch:
+        return
+    task = asyncio.create_task(_save_batch_in_background(batch, progress))
+    _mongo_tasks.add(task)
+    task.add_done_callback(_mongo_tasks.discard)
+
+
+async def drain_mongo_writes(progress: Dict[str, Any]) -> None:
+    """
+    Дожидается фоновых записей и сохраняет остаток очереди.
+    """
+    schedule_mongo_save(take_pending(force=True), progress)
+    if _mongo_tasks:
+        await asyncio.gather(*list(_mongo_tasks), return_exceptions=True)
+
+
 def extract_url_params(url: str) -> Dict[str, Any]:
     """
     Извлекает параметры из URL поиска Domclick для формирования API запроса.
@@ -676,7 +950,7 @@ async def fetch_offers_api(page, api_params: Dict[str, Any], offset: int, max_re
             if isinstance(result, dict):
                 if 'error' in result:
                     if attempt < max_retries:
-                        await asyncio.sleep(2 * attempt)
+                        await asyncio.sleep(retry_backoff_delay(attempt))
                         continue
                     return None
                 
@@ -690,24 +964,40 @@ async def fetch_offers_api(page, api_params: Dict[str, Any], offset: int, max_re
                 return result
             else:
                 if attempt < max_retries:
-                    await asyncio.sleep(2 * attempt)
+                    await asyncio.sleep(retry_backoff_delay(attempt))
                     continue
                 return None
         except asyncio.TimeoutError:
             logger.warning(f"  Таймаут при запросе к API (попытка {attempt}/{max_retries})")
             if attempt < max_retries:
-                await asyncio.sleep(2 * attempt)
+                await asyncio.sleep(retry_backoff_delay(attempt))
                 continue
             return None
         except Exception as e:
             if attempt < max_retries:
-                await asyncio.sleep(2 * attempt)
+                await asyncio.sleep(retry_backoff_delay(attempt))
                 continue
             return None
     
     return None
 
 
+async def fetch_offers_pages(page, api_params: Dict[str, Any], offsets: List[int]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Параллельно запрашивает несколько страниц API (со сдвигом старта, чтобы не слать запросы залпом).
+    Возвращает ответы в том же порядке, что и offsets; для неудачных запросов — None.
+    """
+    async def fetch_one(index: int, page_offset: int):
+        await asyncio.sleep(index * OFFERS_PAGE_STAGGER_SECONDS)
+        return await fetch_offers_api(page, api_params, page_offset, max_retries=FETCH_OFFERS_MAX_RETRIES)
+
+    responses = await asyncio.gather(
+        *(fetch_one(i, page_offset) for i, page_offset in enumerate(offsets)),
+        return_exceptions=True
+    )
+    return [r if isinstance(r, dict) else None for r in responses]
+
+
 async def download_and_process_image(session: aiohttp.ClientSession, image_url: str, file_path: Path) -> str:
     """
     Скачивает изображение по URL, обрабатывает его через resize_img.py и сохраняет локально.
@@ -721,7 +1011,7 @@ async def download_and_process_image(session: aiohttp.ClientSession, image_url:
                 # Обрабатываем изображение через resize_img.py
                 input_bytes = BytesIO(image_bytes)
                 try:
-                    processed_bytes = image_processor.process(input_bytes)
+                    processed_bytes = await asyncio.to_thread(image_processor.process, input_bytes)
                 except Exception as process_error:
                     logger.error(f"Ошибка resize_img.py: {process_error}")
                     return None
@@ -776,22 +1066,9 @@ async def process_complex_photos(photo_urls: List[str], complex_id: str) -> List
                 except Exception:
                     return None
 
-                # Обрабатываем через resize
-                input_bytes = BytesIO(raw)
-                try:
-                    processed = image_processor.process(input_bytes)
-                except Exception:
-                    return None
-                processed.seek(0)
-                data = processed.read()
-
-                # Загружаем в S3
+                # Сжимаем и загружаем в S3 в потоке, чтобы не блокировать цикл событий
                 key = f"complexes/{complex_id}/complex_photos/photo_{index + 1}.jpg"
-                try:
-                    url_public = upload_with_watermark(s3, data, key)
-                    return url_public
-                except Exception:
-                    return None
+                return await asyncio.to_thread(_resize_and_upload, s3, raw, key)
 
         tasks = [process_single_photo(url, i) for i, url in enumerate(photo_urls[:8])]  # максимум 8 фото ЖК
         results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -803,140 +1080,144 @@ async def process_complex_photos(photo_urls: List[str], complex_id: str) -> List
     return processed_photos
 
 
-async def process_apartment_photos(apartment_data: Dict[str, Any], complex_id: str, apartment_path: str) -> Dict[str, Any]:
+def _apartment_with_photos(apartment_data: Dict[str, Any], photos: List[str]) -> Dict[str, Any]:
+    """
+    Возвращает данные квартиры с заданным списком URL фотографий.
+    """
+    return {
+        "offer": apartment_data.get("offer"),
+        "photos": photos,
+        "area": apartment_data.get("area", ""),
+        "totalArea": apartment_data.get("totalArea"),
+        "price": apartment_data.get("price", ""),
+        "pricePerSquare": apartment_data.get("pricePerSquare", ""),
+        "completionDate": apartment_data.get("completionDate", ""),
+        "url": apartment_data.get("url", "")
+    }
+
+
+async def _upload_apartment_photos(image_urls: List[str], complex_id: str, apartment_path: str, s3: S3Service,
+                                   session: aiohttp.ClientSession, semaphore: asyncio.Semaphore) -> List[str]:
+    """
+    Скачивает, обрабатывает и загружает в S3 фотографии одной квартиры.
+    """
+    async def process_single_photo(url, index):
+        async with semaphore:
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                    if response.status != 200:
+                        return None
+                    raw = await response.read()
+            except Exception:
+                return None
+
+            key = f"complexes/{complex_id}/apartments/{apartment_path}/photo_{index + 1}.jpg"
+            return await asyncio.to_thread(_resize_and_upload, s3, raw, key)
+
+    tasks = [process_single_photo(url, i) for i, url in enumerate(image_urls[:3])]  # максимум 3 фото на квартиру
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return [result for result in results if isinstance(result, str) and result]
+
+
+async def process_apartment_photos(apartment_data: Dict[str, Any], complex_id: str, apartment_path: str, *,
+                                   s3: Optional[S3Service] = None,
+                                   session: Optional[aiohttp.ClientSession] = None,
+                                   semaphore: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
     """
     Обрабатывает фотографии для одной квартиры и загружает в S3.
     Возвращает данные с URL к файлам.
+    s3, session и semaphore можно передать общими на весь ЖК, иначе создаются свои.
     """
     image_urls = apartment_data.get("images")
     if not image_urls:
         image_urls = apartment_data.get("photos")
     
     if not image_urls:
-        return {
-            "offer": apartment_data.get("offer"),
-            "photos": [],
-            "area": apartment_data.get("area", ""),
-            "totalArea": apartment_data.get("totalArea"),
-            "price": apartment_data.get("price", ""),
-            "pricePerSquare": apartment_data.get("pricePerSquare", ""),
-            "completionDate": apartment_data.get("completionDate", ""),
-            "url": apartment_data.get("url", "")
-        }
-
-    processed_images = []
-    try:
-        s3 = S3Service()
-    except Exception as s3_error:
-        logger.error(f"Ошибка инициализации S3Service для фотографий квартир: {s3_error}")
-        import traceback
-        logger.error(f"Полный traceback:\n{traceback.format_exc()}")
-        return {
-            "offer": apartment_data.get("offer"),
-            "photos": [],
-            "area": apartment_data.get("area", ""),
-            "totalArea": apartment_data.get("totalArea"),
-            "price": apartment_data.get("price", ""),
-            "pricePerSquare": apartment_data.get("pricePerSquare", ""),
-            "completionDate": apartment_data.get("completionDate", ""),
-            "url": apartment_data.get("url", "")
-        }
+        return _apartment_with_photos(apartment_data, [])
 
-    async with aiohttp.ClientSession() as session:
-        # Обрабатываем до 3 фотографий параллельно для квартир
+    if s3 is None:
+        try:
+            s3 = S3Service()
+        except Exception as s3_error:
+            logger.error(f"Ошибка инициализации S3Service для фотографий квартир: {s3_error}")
+            import traceback
+            logger.error(f"Полный traceback:\n{traceback.format_exc()}")
+            return _apartment_with_photos(apartment_data, [])
+
+    # Обрабатываем до 3 фотографий параллельно для квартиры, если не задан общий лимит
+    if semaphore is None:
         semaphore = asyncio.Semaphore(3)
 
-        async def process_single_photo(url, index):
-            async with semaphore:
-                try:
-                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                        if response.status != 200:
-                            return None
-                        raw = await response.read()
-                except Exception:
-                    return None
-
-                input_bytes = BytesIO(raw)
-                try:
-                    processed = image_processor.process(input_bytes)
-                except Exception:
-                    return None
-                processed.seek(0)
-                data = processed.read()
-
-                key = f"complexes/{complex_id}/apartments/{apartment_path}/photo_{index + 1}.jpg"
-                try:
-                    url_public = upload_with_watermark(s3, data, key)
-                    return url_public
-                except Exception:
-                    return None
-
-        tasks = [process_single_photo(url, i) for i, url in enumerate(image_urls[:3])]  # максимум 3 фото на квартиру
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        for result in results:
-            if isinstance(result, str) and result:
-                processed_images.append(result)
+    if session is None:
+        async with aiohttp.ClientSession() as own_session:
+            processed_images = await _upload_apartment_photos(image_urls, complex_id, apartment_path, s3, own_session, semaphore)
+    else:
+        processed_images = await _upload_apartment_photos(image_urls, complex_id, apartment_path, s3, session, semaphore)
 
     # Возвращаем данные квартиры с URL к файлам
-    result = {
-        "offer": apartment_data.get("offer"),
-        "photos": processed_images,
-        "area": apartment_data.get("area", ""),
-        "totalArea": apartment_data.get("totalArea"),
-        "price": apartment_data.get("price", ""),
-        "pricePerSquare": apartment_data.get("pricePerSquare", ""),
-        "completionDate": apartment_data.get("completionDate", ""),
-        "url": apartment_data.get("url", "")
-    }
-    return result
+    return _apartment_with_photos(apartment_data, processed_images)
 
 
-async def process_all_apartment_types(apartment_types: Dict[str, Any], complex_id: str) -> Dict[str, Any]:
+async def process_all_apartment_types(apartment_types: Dict[str, Any], complex_id: str) -> AsyncIterator[Tuple[str, Any]]:
     """
     Обрабатывает все фотографии во всех типах квартир и загружает в S3.
+    Асинхронный генератор: отдает (тип квартир, данные с URL фото) по мере готовности группы,
+    чтобы вызывающий код сразу перекладывал их в итоговую запись без промежуточного словаря.
+    Квартиры обрабатываются одновременно с общим S3-клиентом, HTTP-сессией и лимитом загрузок.
     """
     if not apartment_types:
-        return apartment_types
-
-    processed_types = {}
-
-    for apartment_type, type_data in apartment_types.items():
-        # Обрабатываем разные структуры данных
-        if isinstance(type_data, list):
-            # Если type_data - это список квартир напрямую
-            apartments = type_data
-        elif isinstance(type_data, dict) and "apartments" in type_data:
-            # Если type_data - это словарь с ключом "apartments"
-            apartments = type_data.get("apartments", [])
-        else:
-            # Если неизвестная структура, пропускаем
-            processed_types[apartment_type] = type_data
-            continue
+        return
 
-        processed_apartments = []
-        apartment_type_normalized = apartment_type.replace('-', '_').replace('комн', 'komn')
+    try:
+        s3 = S3Service()
+    except Exception as s3_error:
+        logger.error(f"Ошибка инициализации S3Service для фотографий квартир: {s3_error}")
+        import traceback
+        logger.error(f"Полный traceback:\n{traceback.format_exc()}")
+        s3 = None
 
-        for i, apartment in enumerate(apartments):
-            if isinstance(apartment, dict):
-                apartment_path = f"{apartment_type_normalized}/apartment_{i + 1}"
-                processed_apartment = await process_apartment_photos(apartment, complex_id, apartment_path)
-                processed_apartments.append(processed_apartment)
+    # Общий лимит одновременных скачиваний/загрузок фото на весь ЖК
+    semaphore = asyncio.Semaphore(APARTMENT_PHOTO_CONCURRENCY)
+
+    async with aiohttp.ClientSession() as session:
+        for apartment_type, type_data in apartment_types.items():
+            # Обрабатываем разные структуры данных
+            if isinstance(type_data, list):
+                # Если type_data - это список квартир напрямую
+                apartments = type_data
+            elif isinstance(type_data, dict) and "apartments" in type_data:
+                # Если type_data - это словарь с ключом "apartments"
+                apartments = type_data.get("apartments", [])
             else:
-                processed_apartments.append(apartment)
+                # Если неизвестная структура, пропускаем
+                yield apartment_type, type_data
+                continue
 
-        # Правильно формируем результат в зависимости от исходной структуры
-        if isinstance(type_data, list):
-            # Если исходные данные были списком, возвращаем список
-            processed_types[apartment_type] = processed_apartments
-        else:
-            # Если исходные данные были словарем, возвращаем словарь
-            processed_types[apartment_type] = {
-                **type_data,
-                "apartments": processed_apartments
-            }
+            apartment_type_normalized = apartment_type.replace('-', '_').replace('комн', 'komn')
 
-    return processed_types
+            async def process_one(i, apartment):
+                if not isinstance(apartment, dict):
+                    return apartment
+                if s3 is None:
+                    return _apartment_with_photos(apartment, [])
+                apartment_path = f"{apartment_type_normalized}/apartment_{i + 1}"
+                return await process_apartment_photos(apartment, complex_id, apartment_path,
+                                                      s3=s3, session=session, semaphore=semaphore)
+
+            processed_apartments = list(await asyncio.gather(
+                *(process_one(i, apartment) for i, apartment in enumerate(apartments))
+            ))
+
+            # Правильно формируем результат в зависимости от исходной структуры
+            if isinstance(type_data, list):
+                # Если исходные данные были списком, возвращаем список
+                yield apartment_type, processed_apartments
+            else:
+                # Если исходные данные были словарем, возвращаем словарь
+                yield apartment_type, {
+                    **type_data,
+                    "apartments": processed_apartments
+                }
 
 
 def normalize_room_from_api(rooms: int) -> str:
@@ -948,41 +1229,180 @@ def normalize_room_from_api(rooms: int) -> str:
     return f'{rooms}-комн'
 
 
-def process_api_response(api_data: Dict[str, Any]) -> Dict[str, Any]:
+# Готовые подписи для типичного числа комнат, чтобы не собирать строку на каждую квартиру
+_ROOM_LABELS = {rooms: normalize_room_from_api(rooms) for rooms in range(11)}
+
+
+# Хост, относительно которого API отдает пути к фотографиям квартир
+_IMG_PREFIX = "https://img.dmclk.ru"
+# Сайт, относительно которого API отдает пути к объявлениям
+_SITE_PREFIX = "https://ufa.domclick.ru"
+
+# Поля API, в которых может лежать значение (по приоритету)
+_VALUE_KEYS = ('value', 'text', 'formatted')
+
+
+def _first_present(d: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    """Возвращает первое непустое значение по ключам из keys или None."""
+    for k in keys:
+        v = d.get(k)
+        if v:
+            return v
+    return None
+
+
+def extract_card_from_item(item: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
     """
-    Обрабатывает ответ API и преобразует в нужный формат.
-    Возвращает словарь с offers (группированные по комнатам), address, complexName, complexHref.
+    Извлекает карточку квартиры из одного элемента ответа API.
+    Возвращает (ключ группы по комнатам, карточка) или None, если в элементе нет generalInfo.
     """
-    if not api_data or 'items' not in api_data:
-        return {
-            'offers': {},
-            'address': None,
-            'complexName': None,
-            'complexHref': None
-        }
+    general_info = item.get('generalInfo', {})
+    if not general_info:
+        return None
+
+    rooms = general_info.get('rooms', 0)
+    room_key = _ROOM_LABELS.get(rooms) or normalize_room_from_api(rooms)
     
-    items = api_data.get('items', [])
+    # Формируем название квартиры
+    area = general_info.get('area')
+    min_floor = general_info.get('minFloor')
+    max_floor = general_info.get('maxFloor')
     
-    if not items:
-        return {
-            'offers': {},
-            'address': None,
-            'complexName': None,
-            'complexHref': None
-        }
+    # Название группы совпадает с началом заголовка ("Студия" / "N-комн"),
+    # поэтому заголовок собирается конкатенацией без промежуточного списка
+    if min_floor is None or max_floor is None:
+        floor_part = ''
+    elif min_floor == max_floor:
+        floor_part = f', {min_floor} этаж'
+    else:
+        floor_part = f', {min_floor}-{max_floor} этаж'
+    
+    title = room_key + (f', {area} м²' if area else '') + floor_part
+    
+    # Извлекаем фотографии
+    image_urls = []
+    
+    for photo in item.get('photos') or ():
+        if not isinstance(photo, dict):
+            continue
+        photo_url = photo.get('url', '')
+        if photo_url:
+            # Формируем полный URL: https://img.dmclk.ru/ + путь
+            if photo_url[0] == '/':
+                image_urls.append(_IMG_PREFIX + photo_url)
+            elif photo_url.startswith('http'):
+                image_urls.append(photo_url)
+            else:
+                image_urls.append(_IMG_PREFIX + '/' + photo_url)
+    
+    # Извлекаем дополнительные поля из API
+    # Цена
+    price_info = item.get('price', {})
+    if isinstance(price_info, dict):
+        price = _first_present(price_info, _VALUE_KEYS)
+    elif price_info:
+        price = price_info
+    else:
+        price = None
+    # Значения из text/formatted уже строки - str() нужен только для чисел
+    price_str = price if isinstance(price, str) else (str(price) if price else '')
+    
+    # Цена за м² - вычисляем из price / area
+    price_per_square = None
+    if price and area:
+        try:
+            area_num = float(area)
+            if area_num > 0:
+                price_per_square = round(float(price) / area_num, 2)
+        except (ValueError, TypeError):
+            pass
+    
+    # Если не удалось вычислить, пробуем найти в API
+    if not price_per_square:
+        price_per_square_info = item.get('pricePerSquare', {})
+        if isinstance(price_per_square_info, dict):
+            price_per_square = _first_present(price_per_square_info, _VALUE_KEYS)
+        elif price_per_square_info:
+            price_per_square = price_per_square_info
+    
+    price_per_square_str = (
+        price_per_square if isinstance(price_per_square, str)
+        else (str(price_per_square) if price_per_square else '')
+    )
+    
+    # Дата сдачи - формируем из complex.building.endBuildQuarter и endBuildYear
+    completion_date_str = ''
+    complex_data = item.get('complex', {})
+    building_data = complex_data.get('building', {}) if isinstance(complex_data, dict) else {}
+    
+    if building_data:
+        end_build_quarter = building_data.get('endBuildQuarter')
+        end_build_year = building_data.get('endBuildYear')
+        
+        if end_build_quarter and end_build_year:
+            completion_date_str = f"{end_build_quarter} квартал {end_build_year}"
+        elif end_build_year:
+            completion_date_str = str(end_build_year)
     
-    # Извлекаем данные из первого элемента
-    first_item = items[0]
+    # Если не удалось сформировать из building, пробуем найти в API
+    if not completion_date_str:
+        completion_date = item.get('completionDate', '')
+        if isinstance(completion_date, dict):
+            completion_date = _first_present(completion_date, _VALUE_KEYS)
+        completion_date_str = (
+            completion_date if isinstance(completion_date, str)
+            else (str(completion_date) if completion_date else '')
+        )
     
+    # URL объявления - используем path из API
+    apartment_url = item.get('path', '') or item.get('url', '') or item.get('urlPath', '') or item.get('href', '')
+    if apartment_url and not apartment_url.startswith('http'):
+        apartment_url = _SITE_PREFIX + apartment_url if apartment_url[0] == '/' else _SITE_PREFIX + '/' + apartment_url
+    apartment_url_str = apartment_url if apartment_url else ''
+    
+    # Площадь как строка и число
+    area_str = area if isinstance(area, str) else (str(area) if area else '')
+    total_area = float(area) if area else None
+    
+    # Карточка намеренно остается dict: дальше ее читают через .get() и проверяют
+    # isinstance(..., dict) в process_all_apartment_types и при логировании
+    card = {
+        'offer': title,
+        'photos': image_urls,  # Используем 'photos' для совместимости с MongoDB схемой
+        'area': area_str,  # Площадь как строка
+        'totalArea': total_area,  # Площадь как число
+        'price': price_str,  # Цена
+        'pricePerSquare': price_per_square_str,  # Цена за м²
+        'completionDate': completion_date_str,  # Дата сдачи
+        'url': apartment_url_str  # URL объявления
+    }
+
+    return room_key, card
+
+
+# Кеш полей ЖК (адрес, название, ссылка, координаты) по id комплекса, очищается в начале каждого URL
+_COMPLEX_HEADER_CACHE: Dict[Any, Dict[str, Any]] = {}
+
+
+def extract_complex_header(first_item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Извлекает поля ЖК из первого элемента ответа API.
+    Для уже встречавшегося id комплекса возвращает сохраненный результат.
+    """
+    complex_data = first_item.get('complex', {})
+    complex_id = complex_data.get('id')
+    if complex_id is not None:
+        cached = _COMPLEX_HEADER_CACHE.get(complex_id)
+        if cached is not None:
+            return cached
+
     address = first_item.get('address', {}).get('displayName')
     location_data = first_item.get('location', {}) or {}
     latitude = location_data.get('lat')
     longitude = location_data.get('lon')
     
-    complex_data = first_item.get('complex', {})
     complex_name = complex_data.get('name')
     complex_slug = complex_data.get('slug')
-    complex_id = complex_data.get('id')
     
     # Формируем ссылку на комплекс
     complex_href = None
@@ -990,139 +1410,69 @@ def process_api_response(api_data: Dict[str, Any]) -> Dict[str, Any]:
         complex_href = f"https://ufa.domclick.ru/complexes/{complex_slug}"
     elif complex_id:
         complex_href = f"https://ufa.domclick.ru/complexes/{complex_id}"
+
+    header = {
+        'address': address,
+        'complexName': complex_name,
+        'complexHref': complex_href,
+        'latitude': latitude,
+        'longitude': longitude,
+    }
+    if complex_id is not None:
+        _COMPLEX_HEADER_CACHE[complex_id] = header
+    return header
+
+
+def process_api_response(api_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Обрабатывает ответ API и преобразует в нужный формат.
+    Возвращает словарь с offers (группированные по комнатам), address, complexName, complexHref.
+    """
+    if not api_data or 'items' not in api_data:
+        return {
+            'offers': {},
+            'address': None,
+            'complexName': None,
+            'complexHref': None
+        }
     
-    # Группируем квартиры по количеству комнат
-    offers = {}
-    skipped_count = 0
+    items = api_data.get('items', [])
+    
+    if not items:
+        return {
+            'offers': {},
+            'address': None,
+            'complexName': None,
+            'complexHref': None
+        }
+    
+    # Не-словари в items встречаются редко — отсеиваем их один раз до основного цикла
     total_items = len(items)
+    items = [item for item in items if isinstance(item, dict)]
+    skipped_count = total_items - len(items)
     
-    for idx, item in enumerate(items):
-        if not isinstance(item, dict):
-            skipped_count += 1
-            continue
-            
-        general_info = item.get('generalInfo', {})
-        if not general_info:
+    if not items:
+        logger.warning(f"  Пропущено {skipped_count} из {total_items} элементов")
+        return {
+            'offers': {},
+            'address': None,
+            'complexName': None,
+            'complexHref': None
+        }
+    
+    # Данные ЖК одинаковы на всех страницах одного комплекса — берем из кеша по id
+    header = extract_complex_header(items[0])
+    
+    # Группируем квартиры по количеству комнат
+    offers = defaultdict(list)
+    
+    for item in items:
+        extracted = extract_card_from_item(item)
+        if extracted is None:
             skipped_count += 1
             continue
-            
-        rooms = general_info.get('rooms', 0)
-        room_key = normalize_room_from_api(rooms)
-        
-        # Формируем название квартиры
-        area = general_info.get('area')
-        min_floor = general_info.get('minFloor')
-        max_floor = general_info.get('maxFloor')
-        
-        title_parts = []
-        if rooms == 0:
-            title_parts.append('Студия')
-        else:
-            title_parts.append(f'{rooms}-комн')
-        if area:
-            title_parts.append(f'{area} м²')
-        if min_floor is not None and max_floor is not None:
-            if min_floor == max_floor:
-                title_parts.append(f'{min_floor} этаж')
-            else:
-                title_parts.append(f'{min_floor}-{max_floor} этаж')
-        
-        title = ', '.join(title_parts) if title_parts else 'Квартира'
-        
-        # Извлекаем фотографии
-        photos = item.get('photos', [])
-        image_urls = []
-        
-        for photo_idx, photo in enumerate(photos):
-            if not isinstance(photo, dict):
-                continue
-            photo_url = photo.get('url', '')
-            if photo_url:
-                # Формируем полный URL: https://img.dmclk.ru/ + путь
-                if photo_url.startswith('/'):
-                    full_url = f"https://img.dmclk.ru{photo_url}"
-                elif photo_url.startswith('http'):
-                    full_url = photo_url
-                else:
-                    full_url = f"https://img.dmclk.ru/{photo_url}"
-                image_urls.append(full_url)
-        
-        # Извлекаем дополнительные поля из API
-        # Цена
-        price_info = item.get('price', {})
-        if isinstance(price_info, dict):
-            price = price_info.get('value') or price_info.get('text') or price_info.get('formatted')
-        elif price_info:
-            price = price_info
-        else:
-            price = None
-        price_str = str(price) if price else ''
-        
-        # Цена за м² - вычисляем из price / area
-        price_per_square = None
-        if price and area:
-            try:
-                price_num = float(price) if isinstance(price, (int, float, str)) else None
-                area_num = float(area) if isinstance(area, (int, float, str)) else None
-                if price_num and area_num and area_num > 0:
-                    price_per_square = round(price_num / area_num, 2)
-            except (ValueError, TypeError):
-                pass
-        
-        # Если не удалось вычислить, пробуем найти в API
-        if not price_per_square:
-            price_per_square_info = item.get('pricePerSquare', {})
-            if isinstance(price_per_square_info, dict):
-                price_per_square = price_per_square_info.get('value') or price_per_square_info.get('text') or price_per_square_info.get('formatted')
-            elif price_per_square_info:
-                price_per_square = price_per_square_info
-        
-        price_per_square_str = str(price_per_square) if price_per_square else ''
-        
-        # Дата сдачи - формируем из complex.building.endBuildQuarter и endBuildYear
-        completion_date_str = ''
-        complex_data = item.get('complex', {})
-        building_data = complex_data.get('building', {}) if isinstance(complex_data, dict) else {}
-        
-        if building_data:
-            end_build_quarter = building_data.get('endBuildQuarter')
-            end_build_year = building_data.get('endBuildYear')
-            
-            if end_build_quarter and end_build_year:
-                completion_date_str = f"{end_build_quarter} квартал {end_build_year}"
-            elif end_build_year:
-                completion_date_str = str(end_build_year)
-        
-        # Если не удалось сформировать из building, пробуем найти в API
-        if not completion_date_str:
-            completion_date = item.get('completionDate', '')
-            if isinstance(completion_date, dict):
-                completion_date = completion_date.get('value', '') or completion_date.get('text', '') or completion_date.get('formatted', '')
-            completion_date_str = str(completion_date) if completion_date else ''
-        
-        # URL объявления - используем path из API
-        apartment_url = item.get('path', '') or item.get('url', '') or item.get('urlPath', '') or item.get('href', '')
-        if apartment_url and not apartment_url.startswith('http'):
-            apartment_url = f"https://ufa.domclick.ru{apartment_url}" if apartment_url.startswith('/') else f"https://ufa.domclick.ru/{apartment_url}"
-        apartment_url_str = apartment_url if apartment_url else ''
-        
-        # Площадь как строка и число
-        area_str = str(area) if area else ''
-        total_area = float(area) if area else None
-        
-        card = {
-            'offer': title,
-            'photos': image_urls,  # Используем 'photos' для совместимости с MongoDB схемой
-            'area': area_str,  # Площадь как строка
-            'totalArea': total_area,  # Площадь как число
-            'price': price_str,  # Цена
-            'pricePerSquare': price_per_square_str,  # Цена за м²
-            'completionDate': completion_date_str,  # Дата сдачи
-            'url': apartment_url_str  # URL объявления
-        }
-        
-        if room_key not in offers:
-            offers[room_key] = []
+
+        room_key, card = extracted
         offers[room_key].append(card)
     
     processed_count = sum(len(cards) for cards in offers.values())
@@ -1130,15 +1480,68 @@ def process_api_response(api_data: Dict[str, Any]) -> Dict[str, Any]:
         logger.warning(f"  Пропущено {skipped_count} из {total_items} элементов")
     
     return {
-        'offers': offers,
-        'address': address,
-        'complexName': complex_name,
-        'complexHref': complex_href,
-        'latitude': latitude,
-        'longitude': longitude,
+        'offers': dict(offers),
+        **header,
+    }
+
+
+def merge_offer_groups(aggregated_offers: Dict[str, List[Dict[str, Any]]], offers: Dict[str, List[Dict[str, Any]]]) -> None:
+    """
+    Добавляет карточки очередной страницы API к уже собранным группам (на месте).
+    """
+    for group, cards in offers.items():
+        # Набор групп почти всегда известен с первой страницы — обычно это один get + extend
+        target = aggregated_offers.get(group)
+        if target is None:
+            aggregated_offers[group] = list(cards)
+        else:
+            target.extend(cards)
+
+
+# Поля карточки и значения по умолчанию для формата apartment_types
+_CARD_DEFAULTS = {
+    "offer": None, "photos": None, "area": "", "totalArea": None,
+    "price": "", "pricePerSquare": "", "completionDate": "", "url": "",
+}
+_CARD_FIELDS = operator.itemgetter(*_CARD_DEFAULTS)
+
+
+def _card_to_apartment(card: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Переводит карточку квартиры в формат apartment_types для MongoDB.
+    Карточки из extract_card_from_item содержат все поля — их достаем одним itemgetter,
+    неполные карточки дополняются значениями по умолчанию.
+    """
+    try:
+        offer, photos, area, total_area, price, price_per_square, completion_date, url = _CARD_FIELDS(card)
+    except KeyError:
+        offer, photos, area, total_area, price, price_per_square, completion_date, url = _CARD_FIELDS({**_CARD_DEFAULTS, **card})
+    return {
+        "title": offer,
+        "photos": photos or [],
+        "area": area,
+        "totalArea": total_area,
+        "price": price,
+        "pricePerSquare": price_per_square,
+        "completionDate": completion_date,
+        "url": url
     }
 
 
+def _to_apartment_type(type_data: Any) -> Any:
+    """
+    Переводит данные одного типа квартир (список карточек или {"apartments": [...]}) в формат MongoDB.
+    Неизвестная структура возвращается как есть.
+    """
+    if isinstance(type_data, list):
+        source = type_data
+    elif isinstance(type_data, dict) and "apartments" in type_data:
+        source = type_data["apartments"]
+    else:
+        return type_data
+    return {"apartments": [_card_to_apartment(card) for card in source]}
+
+
 def log_apartment_photo_parsing(offers: Dict[str, List[Dict[str, Any]]], *, base_url: str, offset: int) -> None:
     """
     Логирует краткую информацию о собранных квартирах (только важные данные).
@@ -1146,623 +1549,534 @@ def log_apartment_photo_parsing(offers: Dict[str, List[Dict[str, Any]]], *, base
     if not offers:
         return
     
-    total_apartments = sum(len(cards) if isinstance(cards, list) else 0 for cards in offers.values())
-    total_photos = 0
-    for cards in offers.values():
-        if isinstance(cards, list):
-            for card in cards:
-                if isinstance(card, dict):
-                    images = card.get("photos") or card.get("images") or []
-                    total_photos += len(images)
+    total_apartments = sum(len(cards) for cards in offers.values() if isinstance(cards, list))
+    total_photos = sum(
+        len(card.get("photos") or card.get("images") or ())
+        for cards in offers.values() if isinstance(cards, list)
+        for card in cards if isinstance(card, dict)
+    )
     
     logger.info(f"  Собрано квартир: {total_apartments}, групп: {len(offers)}, фото: {total_photos}")
 
 
-async def run() -> None:
-    urls = load_links(str(LINKS_FILE))
-    if not urls:
-        print("Файл со ссылками пуст или отсутствует:", LINKS_FILE)
-        return
-
-    url_index, offset = load_progress(str(PROGRESS_FILE))
-    url_index = max(0, min(url_index, len(urls)))
-    print(f"Старт: url_index={url_index}, offset={offset}, всего URL: {len(urls)}")
+async def finalize_complex(*, base_url: str, complex_id: str, complex_gallery_images: List[str],
+                           aggregated_offers: Dict[str, Any], construction_stages: List[Dict[str, Any]],
+                           header: Dict[str, Any], url_index: int, progress: Dict[str, Any]) -> None:
+    """
+    Загружает фото ЖК, квартир и хода строительства в S3, собирает запись и ставит ее в очередь MongoDB.
+    Страница браузера здесь не нужна, поэтому функция выполняется в фоне параллельно со следующим URL.
+    URL отмечается завершенным после записи комплекса в MongoDB: при обрыве до нее он будет пройден заново.
+    """
+    try:
+        # Обрабатываем фотографии ЖК и загружаем в S3
+        complex_photos_urls = []
+        if complex_gallery_images:
+            try:
+                complex_photos_urls = await process_complex_photos(complex_gallery_images, complex_id)
+                logger.info(f"  Фото ЖК загружены: {len(complex_photos_urls)} файлов")
+            except Exception as e:
+                logger.error(f"Ошибка при обработке фотографий ЖК: {e}")
+                complex_photos_urls = []
+        else:
+            logger.info("  Галерея ЖК пуста — ничего не загружаю")
 
-    results: List[Dict[str, Any]] = []
-    if os.path.exists(str(OUTPUT_FILE)):
-        try:
-            with open(str(OUTPUT_FILE), 'r', encoding='utf-8') as f:
-                old = json.load(f)
-                if isinstance(old, list):
-                    results = old
-        except Exception:
-            pass
+        # Обрабатываем фотографии всех квартир и загружаем в S3
+        # Группы с загруженными фото сразу перекладываются в формат apartment_types для MongoDB
+        apartment_types: Dict[str, Any] = {}
+        if aggregated_offers:
+            try:
+                async for group, type_data in process_all_apartment_types(aggregated_offers, complex_id):
+                    apartment_types[group] = _to_apartment_type(type_data)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке фотографий квартир: {e}")
+                import traceback
+                logger.error(f"Полный traceback:\n{traceback.format_exc()}")
+                # Необработанные группы сохраняем с исходными ссылками на фото
+                for group, type_data in aggregated_offers.items():
+                    if group not in apartment_types:
+                        apartment_types[group] = _to_apartment_type(type_data)
+
+        construction_progress_data = None
+        if construction_stages:
+            try:
+                construction_progress_data = await process_construction_stages_domclick(construction_stages, complex_id)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке фото хода строительства: {e}")
+
+        complex_href = header.get("complexHref")
+        complex_url = normalize_complex_url(complex_href) if complex_href else None
+        if not complex_url:
+            complex_url = base_url
+
+        db_item = {
+            "latitude": header.get("latitude"),
+            "longitude": header.get("longitude"),
+            "url": complex_url,
+            "development": {
+                "complex_name": header.get("complexName"),
+                "address": header.get("address"),
+                "source_url": base_url,
+                "photos": complex_photos_urls or [],
+            },
+            "apartment_types": apartment_types,
+        }
 
-    # Создаем браузер с повторными попытками в случае ошибки прокси
-    browser = None
-    page = None
-    max_init_attempts = 5
+        if construction_progress_data:
+            db_item.setdefault('development', {})['construction_progress'] = construction_progress_data
 
-    for init_attempt in range(max_init_attempts):
         try:
-            browser, proxy_url = await create_browser(headless=False)
-            print(f"Попытка {init_attempt + 1}/{max_init_attempts}: Создан браузер с прокси {proxy_url}")
-            page = await create_browser_page(browser)
-            print("✓ Браузер и страница успешно инициализированы")
-            break
-        except Exception as init_error:
-            print(f"✗ Ошибка инициализации браузера (попытка {init_attempt + 1}/{max_init_attempts}): {init_error}")
-            if browser:
-                try:
-                    await browser.close()
-                except:
-                    pass
-            if init_attempt < max_init_attempts - 1:
-                await asyncio.sleep(2)
-            else:
-                print("Не удалось создать браузер после всех попыток. Завершение работы.")
-                return
+            # Запись копится и уходит в MongoDB пачкой в фоне; остаток сохраняется в finally
+            schedule_mongo_save(queue_for_mongodb(db_item, url_index), progress)
+        except Exception as e:
+            print(f"Ошибка записи в MongoDB: {e}. Сохраню в {str(OUTPUT_FILE)} для отладки.")
+            record = {
+                "sourceUrl": base_url,
+                "data": {
+                    "address": header.get("address"),
+                    "complexName": header.get("complexName"),
+                    "complexHref": complex_href,
+                    "offers": apartment_types,
+                    "complexPhotosUrls": complex_photos_urls
+                }
+            }
+            append_output_record(record, str(OUTPUT_FILE))
+    except Exception as e:
+        logger.error(f"Ошибка фоновой обработки {base_url}: {e}")
 
-    try:
-        while url_index < len(urls):
-            try:
-                base_url = urls[url_index]
-                print(f"→ URL [{url_index + 1}/{len(urls)}]: {base_url}")
-
-                if offset % 20 != 0:
-                    offset = (offset // 20) * 20
-
-                # Извлекаем параметры из URL
-                api_params = extract_url_params(base_url)
-                complex_only_mode = False
-                normalized_complex_url = None
-
-                if not api_params:
-                    if is_complex_url(base_url):
-                        complex_only_mode = True
-                        normalized_complex_url = normalize_complex_url(base_url)
-                        logger.info(f"→ URL без параметров, обрабатываю как страницу ЖК: {normalized_complex_url}")
-                    else:
-                        print(f"Не удалось извлечь параметры из URL: {base_url}. Пропускаю.")
-                        url_index += 1
-                        offset = 0
-                        save_progress(url_index, offset, str(PROGRESS_FILE))
-                        continue
 
-                complex_href_from_params = derive_complex_href_from_params(api_params)
+# Фоновые задачи finalize_complex: не больше FINALIZE_CONCURRENCY ЖК одновременно
+_finalize_tasks: Set[asyncio.Task] = set()
+_finalize_semaphore = asyncio.Semaphore(FINALIZE_CONCURRENCY)
 
-                aggregated_address = None
-                aggregated_complex_name = None
-                aggregated_complex_href = None
-                aggregated_latitude = None
-                aggregated_longitude = None
-                aggregated_offers: Dict[str, Any] = {}
 
-                # Открываем страницу из файла для установки cookies и контекста браузера
-                try:
-                    # Используем 'load' вместо 'networkidle0' чтобы избежать зависаний на аналитике/рекламе
-                    await page.goto(base_url, timeout=60000, waitUntil='load')
-                    await asyncio.sleep(3)
-                    # Проверяем на бан и перезапускаем браузер при необходимости
-                    was_banned, browser, page = await check_ban_and_restart(page, browser)
-                    if was_banned:
-                        # После перезапуска нужно снова открыть страницу
-                        await page.goto(base_url, timeout=60000, waitUntil='load')
-                        try:
-                            await page.waitForFunction(
-                                "() => document.readyState === 'complete'",
-                                {"timeout": 20000}
-                            )
-                        except Exception:
-                            pass  # Продолжаем даже если readyState не complete
-                        await asyncio.sleep(3)
-                except Exception as goto_error:
-                    logger.warning(f"  Предупреждение при открытии страницы: {goto_error}")
-                    # Пробуем продолжить без открытия страницы
+async def schedule_finalize(coro) -> None:
+    """
+    Запускает обработку ЖК в фоне; если в работе уже FINALIZE_CONCURRENCY задач, ждет освобождения.
+    """
+    await _finalize_semaphore.acquire()
+    task = asyncio.create_task(coro)
+    _finalize_tasks.add(task)
 
-                if not complex_only_mode:
-                    # Делаем первый запрос для определения общего количества результатов
-                    attempts = 0
-                    browser_restart_count = 0
-                    max_browser_restarts = 2  # Максимум 2 перезапуска браузера на URL
-                    first_api_response = None
+    def _on_done(t: asyncio.Task) -> None:
+        _finalize_tasks.discard(t)
+        _finalize_semaphore.release()
 
-                    while attempts < FIRST_PAGE_FETCH_ATTEMPTS and browser_restart_count < max_browser_restarts:
-                        try:
-                            # Проверяем, что браузер и страница еще живы
-                            page_closed = False
-                            try:
-                                if page and not page.isClosed():
-                                    try:
-                                        ready_state = await asyncio.wait_for(page.evaluate("() => document.readyState"), timeout=5.0)
-                                    except asyncio.TimeoutError:
-                                        ready_state = 'loading'
-                                    if ready_state != 'complete':
-                                        try:
-                                            await page.waitForFunction(
-                                                "() => document.readyState === 'complete'",
-                                                {"timeout": 20000}
-                                            )
-                                        except Exception:
-                                            pass
-                                        await asyncio.sleep(2)
-                                else:
-                                    page_closed = True
-                            except Exception as check_error:
-                                error_str = str(check_error).lower()
-                                if 'session closed' in error_str or 'target closed' in error_str or 'page closed' in error_str:
-                                    page_closed = True
-                                else:
-                                    try:
-                                        await page.goto(base_url, timeout=60000, waitUntil='load')
-                                        try:
-                                            await page.waitForFunction(
-                                                "() => document.readyState === 'complete'",
-                                                {"timeout": 20000}
-                                            )
-                                        except Exception:
-                                            pass
-                                        await asyncio.sleep(3)
-                                    except Exception:
-                                        page_closed = True
-
-                            # Если страница закрыта, перезапускаем браузер
-                            if page_closed:
-                                if browser_restart_count >= max_browser_restarts:
-                                    print(f"  ✗ Достигнут лимит перезапусков браузера, пропускаю URL")
-                                    try:
-                                        if browser:
-                                            await browser.close()
-                                    except Exception:
-                                        pass
-                                    first_api_response = None
-                                    break
-
-                                browser_restart_count += 1
-                                try:
-                                    browser, page, _ = await restart_browser(browser, headless=False)
-                                    await page.goto(base_url, timeout=60000, waitUntil='load')
-                                    try:
-                                        await page.waitForFunction(
-                                            "() => document.readyState === 'complete'",
-                                            {"timeout": 20000}
-                                        )
-                                    except Exception:
-                                        pass
-                                    await asyncio.sleep(3)
-                                    attempts = 0
-                                except Exception as restart_error:
-                                    if browser_restart_count >= max_browser_restarts:
-                                        print(f"  ✗ Достигнут лимит перезапусков браузера, пропускаю URL")
-                                        try:
-                                            if browser:
-                                                await browser.close()
-                                        except Exception:
-                                            pass
-                                        first_api_response = None
-                                        break
-                                    await asyncio.sleep(5)
-                                    continue
-
-                            first_api_response = await fetch_offers_api(page, api_params, 0, max_retries=FETCH_OFFERS_MAX_RETRIES)
-                            if first_api_response and 'items' in first_api_response:
-                                break
-                            attempts += 1
-                            if attempts < FIRST_PAGE_FETCH_ATTEMPTS:
-                                await asyncio.sleep(2)
-                        except Exception as e:
-                            error_str = str(e).lower()
-                            attempts += 1
-
-                            # Если ошибка связана с закрытой сессией, перезапускаем браузер
-                            if 'session closed' in error_str or 'target closed' in error_str or 'page closed' in error_str:
-                                if browser_restart_count >= max_browser_restarts:
-                                    print(f"  ✗ Достигнут лимит перезапусков браузера, пропускаю URL")
-                                    try:
-                                        if browser:
-                                            await browser.close()
-                                    except Exception:
-                                        pass
-                                    first_api_response = None
-                                    break
-
-                                browser_restart_count += 1
-                                try:
-                                    browser, page, _ = await restart_browser(browser, headless=False)
-                                    await page.goto(base_url, timeout=60000, waitUntil='load')
-                                    try:
-                                        await page.waitForFunction(
-                                            "() => document.readyState === 'complete'",
-                                            {"timeout": 20000}
-                                        )
-                                    except Exception:
-                                        pass
-                                    await asyncio.sleep(3)
-                                    attempts = 0
-                                except Exception:
-                                    if browser_restart_count >= max_browser_restarts:
-                                        print(f"  ✗ Достигнут лимит перезапусков браузера, пропускаю URL")
-                                        try:
-                                            if browser:
-                                                await browser.close()
-                                        except Exception:
-                                            pass
-                                        first_api_response = None
-                                        break
-                                    await asyncio.sleep(5)
-                                    continue
-                            elif attempts >= FIRST_PAGE_FETCH_ATTEMPTS:
-                                if browser_restart_count < max_browser_restarts:
-                                    browser_restart_count += 1
-                                    try:
-                                        browser, page, _ = await restart_browser(browser, headless=False)
-                                        attempts = 0
-                                    except Exception:
-                                        try:
-                                            if browser:
-                                                await browser.close()
-                                        except Exception:
-                                            pass
-                                        first_api_response = None
-                                        break
-                                else:
-                                    try:
-                                        if browser:
-                                            await browser.close()
-                                    except Exception:
-                                        pass
-                                    first_api_response = None
-                                    break
-                            else:
-                                await asyncio.sleep(2)
-
-                    if not first_api_response:
-                        print(f"  ✗ Не удалось получить данные из API, пропускаю URL")
-                        url_index += 1
-                        offset = 0
-                        save_progress(url_index, offset, str(PROGRESS_FILE))
-                        continue
+    task.add_done_callback(_on_done)
 
-                    # Определяем общее количество результатов и страниц
-                    total = first_api_response.get('total', 0)
-                    items_count = len(first_api_response.get('items', []))
-                    limit = int(api_params.get('limit', 20))
-
-                    # Если total=0, но есть items, используем количество items как индикатор
-                    if total == 0 and items_count > 0:
-                        total = items_count + 1  # Чтобы цикл выполнился хотя бы один раз
-
-                    total_pages = max(1, (total + limit - 1) // limit) if total > 0 else 1
-                    print(f"  Всего результатов: {total}, страниц: {total_pages}")
-
-                    # Обрабатываем первый ответ
-                    first_data = process_api_response(first_api_response)
-                    aggregated_address = first_data.get('address')
-                    aggregated_complex_name = first_data.get('complexName')
-                    aggregated_complex_href = first_data.get('complexHref') or complex_href_from_params
-                    aggregated_latitude = first_data.get('latitude')
-                    aggregated_longitude = first_data.get('longitude')
-                    aggregated_offers = first_data.get('offers', {})
-
-                    # Обрабатываем остальные страницы
-                    current_offset = limit
-                    # Если total был установлен искусственно (из-за total=0), используем другой подход
-                    if total == items_count + 1:
-                        # Запрашиваем пока есть данные
-                        while True:
-                            api_response = await fetch_offers_api(page, api_params, current_offset, max_retries=FETCH_OFFERS_MAX_RETRIES)
-
-                            if api_response and 'items' in api_response:
-                                response_items = api_response.get('items', [])
-                                if not response_items:
-                                    break
-
-                                data = process_api_response(api_response)
-                                offers = data.get('offers', {})
-
-                                # Объединяем группы офферов
-                                for group, cards in offers.items():
-                                    if group not in aggregated_offers:
-                                        aggregated_offers[group] = []
-                                    aggregated_offers[group].extend(cards)
-
-                                offset = current_offset + limit
-                                save_progress(url_index, offset, str(PROGRESS_FILE))
-
-                                # Если получили меньше limit элементов, значит это последняя страница
-                                if len(response_items) < limit:
-                                    break
-                            else:
-                                break
 
-                            await asyncio.sleep(3)
-                            current_offset += limit
-                    else:
-                        # Обычный случай: total известен
-                        while current_offset < total:
-                            api_response = await fetch_offers_api(page, api_params, current_offset, max_retries=FETCH_OFFERS_MAX_RETRIES)
-
-                            if api_response and 'items' in api_response:
-                                data = process_api_response(api_response)
-                                offers = data.get('offers', {})
+async def drain_finalize_tasks() -> None:
+    """
+    Дожидается всех фоновых задач finalize_complex.
+    """
+    if _finalize_tasks:
+        await asyncio.gather(*list(_finalize_tasks), return_exceptions=True)
 
-                                # Объединяем группы офферов
-                                for group, cards in offers.items():
-                                    if group not in aggregated_offers:
-                                        aggregated_offers[group] = []
-                                    aggregated_offers[group].extend(cards)
 
-                                offset = current_offset + limit
-                                save_progress(url_index, offset, str(PROGRESS_FILE))
+async def process_url(browser, page, base_url: str, url_index: int, progress: Dict[str, Any]) -> Tuple[Any, Any]:
+    """
+    Собирает данные одного URL (офферы, галерея, ход строительства) и ставит фоновую обработку ЖК.
+    Возвращает (browser, page): при бане или ошибках браузер может быть перезапущен.
+    """
+    # Шапка ЖК переиспользуется только между страницами выдачи одного URL
+    _COMPLEX_HEADER_CACHE.clear()
 
-                            if current_offset + limit < total:
-                                await asyncio.sleep(3)
+    # Извлекаем параметры из URL
+    api_params = extract_url_params(base_url)
+    complex_only_mode = False
+    normalized_complex_url = None
 
-                            current_offset += limit
-                else:
-                    aggregated_complex_href = normalized_complex_url or base_url
+    if not api_params:
+        if is_complex_url(base_url):
+            complex_only_mode = True
+            normalized_complex_url = normalize_complex_url(base_url)
+            logger.info(f"→ URL без параметров, обрабатываю как страницу ЖК: {normalized_complex_url}")
+        else:
+            print(f"Не удалось извлечь параметры из URL: {base_url}. Пропускаю.")
+            mark_url_done(progress, url_index)
+            return browser, page
 
-                # Попытаемся собрать галерею ЖК с текущей страницы до переходов
-                complex_gallery_images: List[str] = await extract_gallery_images(page)
-                if complex_gallery_images:
-                    logger.info(f"  Галерея (текущая страница): найдено {len(complex_gallery_images)} исходных фото")
-                else:
-                    logger.info("  На текущей странице галерея не найдена")
+    complex_href_from_params = derive_complex_href_from_params(api_params)
 
-                # Для получения фотографий ЖК и ссылки на ход строительства нужно открыть страницу комплекса
-                aggregated_hod_url: str = None
-                construction_progress_data: Dict[str, Any] = None
+    aggregated_address = None
+    aggregated_complex_name = None
+    aggregated_complex_href = None
+    aggregated_latitude = None
+    aggregated_longitude = None
+    aggregated_offers: Dict[str, Any] = {}
 
-                if aggregated_complex_href:
-                    try:
-                        await page.goto(aggregated_complex_href, timeout=60000, waitUntil='load')
-                        await asyncio.sleep(2)
-                        # Проверяем на бан и перезапускаем браузер при необходимости
-                        was_banned, browser, page = await check_ban_and_restart(page, browser)
-                        if was_banned:
-                            # После перезапуска нужно снова открыть страницу
-                            await page.goto(aggregated_complex_href, timeout=60000, waitUntil='load')
+    # Открываем страницу из файла для установки cookies и контекста браузера
+    try:
+        # Используем 'load' вместо 'networkidle0' чтобы избежать зависаний на аналитике/рекламе
+        await page.goto(base_url, timeout=60000, waitUntil='load')
+        await asyncio.sleep(3)
+        # Проверяем на бан и перезапускаем браузер при необходимости
+        was_banned, browser, page = await check_ban_and_restart(page, browser)
+        if was_banned:
+            # После перезапуска нужно снова открыть страницу
+            await page.goto(base_url, timeout=60000, waitUntil='load')
+            await wait_document_complete(page)  # Продолжаем даже если readyState не complete
+            await asyncio.sleep(3)
+    except Exception as goto_error:
+        logger.warning(f"  Предупреждение при открытии страницы: {goto_error}")
+        # Пробуем продолжить без открытия страницы
+
+    if not complex_only_mode:
+        # Делаем первый запрос для определения общего количества результатов
+        attempts = 0
+        browser_restart_count = 0
+        max_browser_restarts = 2  # Максимум 2 перезапуска браузера на URL
+        first_api_response = None
+
+        while attempts < FIRST_PAGE_FETCH_ATTEMPTS and browser_restart_count < max_browser_restarts:
+            try:
+                # Проверяем, что браузер и страница еще живы
+                page_closed = False
+                try:
+                    if page and not page.isClosed():
+                        try:
+                            ready_state = await asyncio.wait_for(page.evaluate("() => document.readyState"), timeout=5.0)
+                        except asyncio.TimeoutError:
+                            ready_state = 'loading'
+                        if ready_state != 'complete':
+                            await wait_document_complete(page)
                             await asyncio.sleep(2)
+                    else:
+                        page_closed = True
+                except Exception as check_error:
+                    if is_session_closed_error(check_error):
+                        page_closed = True
+                    else:
                         try:
-                            await page.waitForSelector('[data-e2e-id="complex-header-gallery"]', {"timeout": 10000})
+                            await page.goto(base_url, timeout=60000, waitUntil='load')
+                            await wait_document_complete(page)
+                            await asyncio.sleep(3)
                         except Exception:
-                            logger.warning("  Галерея не появилась за 10 секунд, продолжаю")
-                        await asyncio.sleep(3)
-
-                        if not complex_gallery_images:
-                            complex_gallery_images = await extract_gallery_images(page)
-                            if complex_gallery_images:
-                                logger.info(f"  Галерея ЖК: найдено {len(complex_gallery_images)} исходных фото")
-                            else:
-                                logger.info("  Галерея ЖК на странице комплекса не найдена")
+                            page_closed = True
+
+                # Если страница закрыта, перезапускаем браузер
+                if page_closed:
+                    browser, page, browser_restart_count, restarted = await restart_browser_for_url(
+                        browser, page, base_url, browser_restart_count, max_browser_restarts
+                    )
+                    if not restarted:
+                        if browser_restart_count >= max_browser_restarts:
+                            first_api_response = None
+                            break
+                        continue
+                    attempts = 0
 
-                        # Сохраняем ссылку на страницу "О ЖК" для хода строительства
+                first_api_response = await fetch_offers_api(page, api_params, 0, max_retries=FETCH_OFFERS_MAX_RETRIES)
+                if first_api_response and 'items' in first_api_response:
+                    break
+                attempts += 1
+                if attempts < FIRST_PAGE_FETCH_ATTEMPTS:
+                    await asyncio.sleep(retry_backoff_delay(attempts))
+            except Exception as e:
+                attempts += 1
+
+                # Если ошибка связана с закрытой сессией, перезапускаем браузер
+                if is_session_closed_error(e):
+                    browser, page, browser_restart_count, restarted = await restart_browser_for_url(
+                        browser, page, base_url, browser_restart_count, max_browser_restarts
+                    )
+                    if not restarted:
+                        if browser_restart_count >= max_browser_restarts:
+                            first_api_response = None
+                            break
+                        continue
+                    attempts = 0
+                elif attempts >= FIRST_PAGE_FETCH_ATTEMPTS:
+                    if browser_restart_count < max_browser_restarts:
+                        browser_restart_count += 1
                         try:
-                            about_href = await asyncio.wait_for(page.evaluate(r"""
-                            () => {
-                              let a = document.querySelector('[data-e2e-id="complex-header-about"]');
-
-                              if (!a) {
-                                const links = Array.from(document.querySelectorAll('a'));
-                                a = links.find(link => {
-                                  const text = (link.textContent || '').toLowerCase().trim();
-                                  return text.includes('о жк') || text.includes('о комплексе') || text.includes('подробнее');
-                                });
-                              }
-                              if (!a) {
-                                const links = Array.from(document.querySelectorAll('a[href*="about"], a[href*="o-zhk"]'));
-                                if (links.length > 0) {
-                                  a = links[0];
-                                }
-                              }
-                              if (!a) {
-                                const currentPath = location.pathname;
-                                const basePath = currentPath.split('/').slice(0, -1).join('/');
-                                const links = Array.from(document.querySelectorAll(`a[href*="${basePath}/about"], a[href*="${basePath}/o-zhk"]`));
-                                if (links.length > 0) {
-                                  a = links[0];
-                                }
-                              }
-                              if (a) {
-                                const href = a.getAttribute('href') || a.href || null;
-                                if (href) {
-                                  try {
-                                    return new URL(href, location.origin).href;
-                                  } catch {
-                                    return href.startsWith('http') ? href : location.origin + (href.startsWith('/') ? href : '/' + href);
-                                  }
-                                }
-                              }
-                              return null;
-                            }
-                            """), timeout=10.0)
-                            if about_href:
-                                if '/hod-stroitelstva' in about_href:
-                                    aggregated_hod_url = about_href
-                                elif about_href.endswith('/'):
-                                    aggregated_hod_url = about_href + 'hod-stroitelstva'
-                                else:
-                                    aggregated_hod_url = about_href + '/hod-stroitelstva'
-                            else:
-                                if aggregated_complex_href:
-                                    if '/hod-stroitelstva' in aggregated_complex_href:
-                                        aggregated_hod_url = aggregated_complex_href
-                                    elif aggregated_complex_href.endswith('/'):
-                                        aggregated_hod_url = aggregated_complex_href + 'hod-stroitelstva'
-                                    else:
-                                        aggregated_hod_url = aggregated_complex_href + '/hod-stroitelstva'
-                        except asyncio.TimeoutError:
-                            if aggregated_complex_href:
-                                if '/hod-stroitelstva' in aggregated_complex_href:
-                                    aggregated_hod_url = aggregated_complex_href
-                                elif aggregated_complex_href.endswith('/'):
-                                    aggregated_hod_url = aggregated_complex_href + 'hod-stroitelstva'
-                                else:
-                                    aggregated_hod_url = aggregated_complex_href + '/hod-stroitelstva'
+                            browser, page, _ = await restart_browser(browser, headless=False)
+                            attempts = 0
                         except Exception:
-                            if aggregated_complex_href:
-                                if '/hod-stroitelstva' in aggregated_complex_href:
-                                    aggregated_hod_url = aggregated_complex_href
-                                elif aggregated_complex_href.endswith('/'):
-                                    aggregated_hod_url = aggregated_complex_href + 'hod-stroitelstva'
-                                else:
-                                    aggregated_hod_url = aggregated_complex_href + '/hod-stroitelstva'
-                    except Exception:
-                        pass
+                            await close_browser_quietly(browser)
+                            first_api_response = None
+                            break
+                    else:
+                        await close_browser_quietly(browser)
+                        first_api_response = None
+                        break
+                else:
+                    await asyncio.sleep(retry_backoff_delay(attempts))
+
+        if not first_api_response:
+            print(f"  ✗ Не удалось получить данные из API, пропускаю URL")
+            mark_url_done(progress, url_index)
+            return browser, page
+
+        # Определяем общее количество результатов и страниц
+        total = first_api_response.get('total', 0)
+        items_count = len(first_api_response.get('items', []))
+        limit = int(api_params.get('limit', 20))
+
+        # Если total=0, но есть items, используем количество items как индикатор
+        if total == 0 and items_count > 0:
+            total = items_count + 1  # Чтобы цикл выполнился хотя бы один раз
+
+        total_pages = max(1, (total + limit - 1) // limit) if total > 0 else 1
+        print(f"  Всего результатов: {total}, страниц: {total_pages}")
+
+        # Обрабатываем первый ответ
+        first_data = process_api_response(first_api_response)
+        aggregated_address = first_data.get('address')
+        aggregated_complex_name = first_data.get('complexName')
+        aggregated_complex_href = first_data.get('complexHref') or complex_href_from_params
+        aggregated_latitude = first_data.get('latitude')
+        aggregated_longitude = first_data.get('longitude')
+        aggregated_offers = first_data.get('offers', {})
+
+        # Обрабатываем остальные страницы
+        current_offset = limit
+        # Первая страница неполная — других страниц нет, лишние запросы не делаем
+        if items_count >= limit:
+            # Если total был установлен искусственно (из-за total=0), используем другой подход
+            if total == items_count + 1:
+                # Запрашиваем пока есть данные
+                while True:
+                    api_response = await fetch_offers_api(page, api_params, current_offset, max_retries=FETCH_OFFERS_MAX_RETRIES)
+
+                    if api_response and 'items' in api_response:
+                        response_items = api_response.get('items', [])
+                        if not response_items:
+                            break
+
+                        data = process_api_response(api_response)
+                        merge_offer_groups(aggregated_offers, data.get('offers', {}))
+
+                        offset = current_offset + limit
+                        save_page_progress(progress, url_index, offset)
+
+                        # Если получили меньше limit элементов, значит это последняя страница
+                        if len(response_items) < limit:
+                            break
+                    else:
+                        break
 
-                # Получаем ID комплекса для формирования ключей S3
-                complex_id = get_complex_id_from_url(aggregated_complex_href or base_url)
+                    await asyncio.sleep(3)
+                    current_offset += limit
+            else:
+                # Обычный случай: total известен — страницы запрашиваем пачками параллельно
+                page_offsets = list(range(current_offset, total, limit))
+                reached_end = False
+                for wave_start in range(0, len(page_offsets), OFFERS_PAGE_CONCURRENCY):
+                    wave_offsets = page_offsets[wave_start:wave_start + OFFERS_PAGE_CONCURRENCY]
+                    wave_responses = await fetch_offers_pages(page, api_params, wave_offsets)
+
+                    # Ответы разбираем строго по порядку offset, чтобы прогресс оставался монотонным
+                    for page_offset, api_response in zip(wave_offsets, wave_responses):
+                        if not (api_response and 'items' in api_response):
+                            continue
+                        response_items = api_response.get('items', [])
+                        # Пустая страница — данных дальше нет, не тратим запросы на хвост
+                        if not response_items:
+                            reached_end = True
+                            break
+
+                        data = process_api_response(api_response)
+                        merge_offer_groups(aggregated_offers, data.get('offers', {}))
+
+                        offset = page_offset + limit
+                        save_page_progress(progress, url_index, offset)
+
+                        # Неполная страница — она последняя, даже если total больше
+                        if len(response_items) < limit:
+                            reached_end = True
+                            break
+
+                    if reached_end:
+                        break
+                    if wave_start + OFFERS_PAGE_CONCURRENCY < len(page_offsets):
+                        await asyncio.sleep(3)
+    else:
+        aggregated_complex_href = normalized_complex_url or base_url
 
-                # Обрабатываем фотографии ЖК и загружаем в S3
-                complex_photos_urls = []
+    # Попытаемся собрать галерею ЖК с текущей страницы до переходов
+    complex_gallery_images: List[str] = await extract_gallery_images(page)
+    if complex_gallery_images:
+        logger.info(f"  Галерея (текущая страница): найдено {len(complex_gallery_images)} исходных фото")
+    else:
+        logger.info("  На текущей странице галерея не найдена")
+
+    # Для получения фотографий ЖК и ссылки на ход строительства нужно открыть страницу комплекса
+    aggregated_hod_url: str = None
+
+    if aggregated_complex_href:
+        try:
+            await page.goto(aggregated_complex_href, timeout=60000, waitUntil='load')
+            await asyncio.sleep(2)
+            # Проверяем на бан и перезапускаем браузер при необходимости
+            was_banned, browser, page = await check_ban_and_restart(page, browser)
+            if was_banned:
+                # После перезапуска нужно снова открыть страницу
+                await page.goto(aggregated_complex_href, timeout=60000, waitUntil='load')
+                await asyncio.sleep(2)
+            try:
+                await page.waitForSelector('[data-e2e-id="complex-header-gallery"]', {"timeout": 10000})
+            except Exception:
+                logger.warning("  Галерея не появилась за 10 секунд, продолжаю")
+            await asyncio.sleep(3)
+
+            if not complex_gallery_images:
+                complex_gallery_images = await extract_gallery_images(page)
                 if complex_gallery_images:
-                    try:
-                        complex_photos_urls = await process_complex_photos(complex_gallery_images, complex_id)
-                        logger.info(f"  Фото ЖК загружены: {len(complex_photos_urls)} файлов")
-                    except Exception as e:
-                        logger.error(f"Ошибка при обработке фотографий ЖК: {e}")
-                        complex_photos_urls = []
+                    logger.info(f"  Галерея ЖК: найдено {len(complex_gallery_images)} исходных фото")
                 else:
-                    logger.info("  Галерея ЖК пуста — ничего не загружаю")
+                    logger.info("  Галерея ЖК на странице комплекса не найдена")
 
-                # Обрабатываем фотографии всех квартир и загружаем в S3
-                processed_apartment_types = aggregated_offers or {}
-                if aggregated_offers:
+            # Сохраняем ссылку на страницу "О ЖК" для хода строительства
+            try:
+                about_href = await asyncio.wait_for(page.evaluate(_JS_ABOUT_HREF), timeout=10.0)
+            except Exception:
+                about_href = None  # Таймаут или ошибка JS — берем ссылку на сам ЖК
+            hod_base_href = about_href or aggregated_complex_href
+            if hod_base_href:
+                aggregated_hod_url = _build_hod_url(hod_base_href)
+        except Exception:
+            pass
+
+    # Получаем ID комплекса для формирования ключей S3
+    complex_id = get_complex_id_from_url(aggregated_complex_href or base_url)
+
+    # После сбора всех офферов: если есть hod_url — переходим и собираем ход строительства.
+    # При ошибках (прокси/соединение) — перезапускаем браузер и пробуем ещё раз.
+    # Здесь только работа со страницей; фото этапов загружаются в finalize_complex.
+    construction_stages: List[Dict[str, Any]] = []
+    if aggregated_hod_url:
+        max_attempts_hod = 3
+        attempt_hod = 0
+        while attempt_hod < max_attempts_hod and not construction_stages:
+            attempt_hod += 1
+            try:
+                # Бан проверяется на вкладке, с которой пришел результат
+                stages_data, was_banned = await extract_construction_with_backup_tab(browser, page, aggregated_hod_url)
+                if was_banned:
+                    browser, page = await restart_after_ban(browser, page)
+                    # После перезапуска нужно снова открыть страницу
+                    stages_data = await extract_construction_from_domclick(page, aggregated_hod_url)
+                if stages_data and stages_data.get('construction_stages'):
+                    construction_stages = stages_data['construction_stages']
+                    break
+                else:
+                    if attempt_hod < max_attempts_hod:
+                        try:
+                            browser, page, _ = await restart_browser(browser, headless=False)
+                        except Exception:
+                            try:
+                                if browser:
+                                    await browser.close()
+                            except Exception:
+                                pass
+                            browser = None
+                            page = None
+            except Exception:
+                if attempt_hod < max_attempts_hod:
                     try:
-                        processed_apartment_types = await process_all_apartment_types(aggregated_offers, complex_id)
-                    except Exception as e:
-                        logger.error(f"Ошибка при обработке фотографий квартир: {e}")
-                        import traceback
-                        logger.error(f"Полный traceback:\n{traceback.format_exc()}")
-                        processed_apartment_types = aggregated_offers
-
-                # После сбора всех офферов: если есть hod_url — переходим и собираем ход строительства.
-                # При ошибках (прокси/соединение) — перезапускаем браузер и пробуем ещё раз.
-                if aggregated_hod_url:
-                    complex_id = get_complex_id_from_url(aggregated_complex_href or base_url)
-                    max_attempts_hod = 3
-                    attempt_hod = 0
-                    while attempt_hod < max_attempts_hod and not construction_progress_data:
-                        attempt_hod += 1
+                        browser, page, _ = await restart_browser(browser, headless=False)
+                    except Exception:
                         try:
-                            stages_data = await extract_construction_from_domclick(page, aggregated_hod_url)
-                            # Проверяем на бан после перехода на страницу хода строительства
-                            was_banned, browser, page = await check_ban_and_restart(page, browser)
-                            if was_banned:
-                                # После перезапуска нужно снова открыть страницу
-                                stages_data = await extract_construction_from_domclick(page, aggregated_hod_url)
-                            if stages_data and stages_data.get('construction_stages'):
-                                construction_progress_data = await process_construction_stages_domclick(stages_data['construction_stages'], complex_id)
-                                break
-                            else:
-                                if attempt_hod < max_attempts_hod:
-                                    try:
-                                        browser, page, _ = await restart_browser(browser, headless=False)
-                                    except Exception:
-                                        try:
-                                            if browser:
-                                                await browser.close()
-                                        except Exception:
-                                            pass
-                                        browser = None
-                                        page = None
+                            if browser:
+                                await browser.close()
                         except Exception:
-                            if attempt_hod < max_attempts_hod:
-                                try:
-                                    browser, page, _ = await restart_browser(browser, headless=False)
-                                except Exception:
-                                    try:
-                                        if browser:
-                                            await browser.close()
-                                    except Exception:
-                                        pass
-                                    browser = None
-                                    page = None
-
-                # формируем запись под Mongo-схему после обработки фото
-                apartment_types_data = processed_apartment_types or aggregated_offers or {}
-
-                apartment_types: Dict[str, Any] = {}
-                for group, cards in apartment_types_data.items():
-                    if isinstance(cards, list):
-                        apartment_types[group] = {
-                            "apartments": [
-                                {
-                                    "title": c.get("offer"),
-                                    "photos": c.get("photos") or [],
-                                    "area": c.get("area", ""),
-                                    "totalArea": c.get("totalArea"),
-                                    "price": c.get("price", ""),
-                                    "pricePerSquare": c.get("pricePerSquare", ""),
-                                    "completionDate": c.get("completionDate", ""),
-                                    "url": c.get("url", "")
-                                }
-                                for c in cards
-                            ]
-                        }
-                    elif isinstance(cards, dict) and "apartments" in cards:
-                        apartment_list = cards["apartments"]
-                        apartment_types[group] = {
-                            "apartments": [
-                                {
-                                    "title": c.get("offer"),
-                                    "photos": c.get("photos") or [],
-                                    "area": c.get("area", ""),
-                                    "totalArea": c.get("totalArea"),
-                                    "price": c.get("price", ""),
-                                    "pricePerSquare": c.get("pricePerSquare", ""),
-                                    "completionDate": c.get("completionDate", ""),
-                                    "url": c.get("url", "")
-                                }
-                                for c in apartment_list
-                            ]
-                        }
-                    else:
-                        apartment_types[group] = cards
-
-                complex_url = normalize_complex_url(aggregated_complex_href) if aggregated_complex_href else None
-                if not complex_url:
-                    complex_url = base_url
-
-                db_item = {
-                    "latitude": aggregated_latitude,
-                    "longitude": aggregated_longitude,
-                    "url": complex_url,
-                    "development": {
-                        "complex_name": aggregated_complex_name,
-                        "address": aggregated_address,
-                        "source_url": base_url,
-                        "photos": complex_photos_urls or [],
-                    },
-                    "apartment_types": apartment_types,
-                }
+                            pass
+                        browser = None
+                        page = None
+
+    # Загрузка фото в S3 и сохранение идут в фоне, браузер сразу переходит к следующему URL
+    await schedule_finalize(finalize_complex(
+        base_url=base_url,
+        complex_id=complex_id,
+        complex_gallery_images=complex_gallery_images,
+        aggregated_offers=aggregated_offers,
+        construction_stages=construction_stages,
+        header={
+            "address": aggregated_address,
+            "complexName": aggregated_complex_name,
+            "complexHref": aggregated_complex_href,
+            "latitude": aggregated_latitude,
+            "longitude": aggregated_longitude,
+        },
+        url_index=url_index,
+        progress=progress,
+    ))
+
+    return browser, page
+
+
+# Состояние прогресса для нескольких воркеров: next_index — первый незавершенный URL,
+# done — завершенные URL дальше него. Функции ниже не содержат await, поэтому lock не нужен.
+def save_page_progress(progress: Dict[str, Any], url_index: int, offset: int) -> None:
+    """
+    Сохраняет offset внутри URL, только если это первый незавершенный URL.
+    """
+    if url_index == progress["next_index"]:
+        save_progress(url_index, offset, str(PROGRESS_FILE))
+
+
+def mark_url_done(progress: Dict[str, Any], url_index: int) -> None:
+    """
+    Отмечает URL завершенным и сдвигает сохраненный прогресс на первый незавершенный URL.
+    Для URL с собранными данными вызывается после записи в MongoDB, для пропущенных — из process_url/url_worker.
+    """
+    done = progress["done"]
+    done.add(url_index)
+    while progress["next_index"] in done:
+        done.discard(progress["next_index"])
+        progress["next_index"] += 1
+    save_progress(progress["next_index"], 0, str(PROGRESS_FILE))
 
-                if construction_progress_data:
-                    db_item.setdefault('development', {})['construction_progress'] = construction_progress_data
 
+async def launch_browser_with_retries(max_init_attempts: int = 5) -> Tuple[Any, Any]:
+    """
+    Создает браузер и страницу с повторными попытками в случае ошибки прокси.
+    Возвращает (None, None), если все попытки неудачны.
+    """
+    browser = None
+    for init_attempt in range(max_init_attempts):
+        try:
+            browser, proxy_url = await create_browser(headless=False)
+            print(f"Попытка {init_attempt + 1}/{max_init_attempts}: Создан браузер с прокси {proxy_url}")
+            page = await create_browser_page(browser)
+            print("✓ Браузер и страница успешно инициализированы")
+            return browser, page
+        except Exception as init_error:
+            print(f"✗ Ошибка инициализации браузера (попытка {init_attempt + 1}/{max_init_attempts}): {init_error}")
+            if browser:
                 try:
-                    save_to_mongodb([db_item])
-                except Exception as e:
-                    print(f"Ошибка записи в MongoDB: {e}. Сохраню в {str(OUTPUT_FILE)} для отладки.")
-                    results.append({
-                        "sourceUrl": base_url,
-                        "data": {
-                            "address": aggregated_address,
-                            "complexName": aggregated_complex_name,
-                            "complexHref": aggregated_complex_href,
-                            "offers": processed_apartment_types,
-                            "complexPhotosUrls": complex_photos_urls
-                        }
-                    })
-                    with open(str(OUTPUT_FILE), 'w', encoding='utf-8') as f:
-                        json.dump(results, f, ensure_ascii=False, indent=2)
-
-                url_index += 1
-                offset = 0
-                save_progress(url_index, offset, str(PROGRESS_FILE))
+                    await browser.close()
+                except:
+                    pass
+                browser = None
+            if init_attempt < max_init_attempts - 1:
+                await asyncio.sleep(2)
+    print("Не удалось создать браузер после всех попыток.")
+    return None, None
+
 
+async def url_worker(urls: List[str], queue: asyncio.Queue, progress: Dict[str, Any]) -> None:
+    """
+    Берет индексы URL из общей очереди и обрабатывает их в своем браузере.
+    """
+    browser, page = await launch_browser_with_retries()
+    if browser is None:
+        return
+
+    try:
+        while True:
+            try:
+                url_index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            base_url = urls[url_index]
+            print(f"→ URL [{url_index + 1}/{len(urls)}]: {base_url}")
+
+            try:
+                browser, page = await process_url(browser, page, base_url, url_index, progress)
             except Exception as url_error:
                 print(f"  ✗ Критическая ошибка при обработке URL: {url_error}")
+                mark_url_done(progress, url_index)
                 # Закрываем браузер при критической ошибке
                 try:
                     if browser:
@@ -1774,17 +2088,42 @@ async def run() -> None:
                     browser, proxy_url = await create_browser(headless=False)
                     page = await create_browser_page(browser)
                 except Exception:
-                    print("  ✗ Не удалось создать новый браузер, завершаю работу")
-                    break
-                url_index += 1
-                offset = 0
-                save_progress(url_index, offset, str(PROGRESS_FILE))
-
+                    browser = None
+                    print("  ✗ Не удалось создать новый браузер, завершаю работу воркера")
+                    return
     finally:
         try:
             await browser.close()
         except Exception:
             pass  # Игнорируем ошибки закрытия браузера
 
+
+async def run() -> None:
+    urls = load_links(str(LINKS_FILE))
+    if not urls:
+        print("Файл со ссылками пуст или отсутствует:", LINKS_FILE)
+        return
+
+    url_index, offset = load_progress(str(PROGRESS_FILE))
+    url_index = max(0, min(url_index, len(urls)))
+    print(f"Старт: url_index={url_index}, offset={offset}, всего URL: {len(urls)}")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(url_index, len(urls)):
+        queue.put_nowait(index)
+    progress: Dict[str, Any] = {"next_index": url_index, "done": set()}
+
+    # Каждый воркер работает в своем браузере со своим прокси: перезапуск после бана
+    # в одном воркере не обрывает вкладки остальных
+    workers_count = max(1, min(URL_WORKERS, queue.qsize()))
+    if workers_count > 1:
+        print(f"Параллельных воркеров: {workers_count}")
+
+    try:
+        await asyncio.gather(*(url_worker(urls, queue, progress) for _ in range(workers_count)))
+    finally:
+        await drain_finalize_tasks()
+        await drain_mongo_writes(progress)
+
 if __name__ == "__main__":
     asyncio.run(run())
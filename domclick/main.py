@@ -1,41 +1,50 @@
 #!/usr/bin/env python3
 """
-Единый запуск: сначала domclick_1.py (сбор ссылок), пауза 10с, затем domclick_2.py (сбор карточек).
+Единый запуск: сначала domclick_1 (сбор ссылок), затем domclick_2 (сбор карточек).
+Оба этапа выполняются в одном процессе и одном цикле событий asyncio.
 """
-import subprocess
-import sys
-import time
+import asyncio
+import importlib
+import os
+import traceback
 from pathlib import Path
 
 
 PROJECT_ROOT = Path(__file__).resolve().parent
-PYTHON = sys.executable or "python3"
 
 
-def run_script(path: Path) -> int:
-    print(f"Запуск: {path}", flush=True)
-    # Добавляем -u для отключения буферизации Python
-    # stdout=None и stderr=None означают прямой вывод в консоль
-    proc = subprocess.run([PYTHON, "-u", str(path)], cwd=str(PROJECT_ROOT))
-    print(f"Завершён: {path} (код {proc.returncode})", flush=True)
-    return proc.returncode
-
-
-def main() -> None:
-    first = PROJECT_ROOT / "domclick_1.py"
-    second = PROJECT_ROOT / "domclick_2.py"
-
-    code1 = run_script(first)
-    if code1 != 0:
+async def run_stage(name: str, module_name: str) -> bool:
+    """
+    Импортирует модуль этапа и выполняет его корутину run().
+    Возвращает True, если этап завершился без исключений.
+    """
+    print(f"Запуск: {name}", flush=True)
+    try:
+        module = importlib.import_module(module_name)
+        await module.run()
+    except Exception as e:
+        print(f"Завершён с ошибкой: {name} ({e})", flush=True)
+        traceback.print_exc()
+        return False
+    print(f"Завершён: {name}", flush=True)
+    return True
+
+
+async def run_all() -> None:
+    ok1 = await run_stage("domclick_1.py", "domclick_1")
+    if not ok1:
         print("Внимание: domclick_1.py завершился с ошибкой. Продолжаю запуск domclick_2.py.", flush=True)
 
-    print("\nПауза 10 секунд перед запуском второго скрипта...", flush=True)
-    time.sleep(10)
-
-    code2 = run_script(second)
-    if code2 != 0:
+    ok2 = await run_stage("domclick_2.py", "domclick_2")
+    if not ok2:
         print("domclick_2.py завершился с ошибкой.", flush=True)
 
+
+def main() -> None:
+    # Скрипты этапов ищут относительные файлы (например, pic-logo.svg) в своей папке
+    os.chdir(PROJECT_ROOT)
+    asyncio.run(run_all())
+
     # Удаляем временные файлы
     temp_files = ["complex_links.json", "progress_domclick_2.json"]
     for file_name in temp_files:
@@ -52,5 +61,3 @@ def main() -> None:
 
 if __name__ == "__main__":
     main()
-
-
@@ -32,10 +32,16 @@ class ImageProcessor:
     def resize_and_compress(self, input_bytes):
         try:
             img = Image.open(input_bytes)
+            img.load()
         except Exception as e:
             self.logger.error(f"Проблема открытия изображения: {e}")
             return None
 
+        # Метаданные исходника не нужны: выбрасываем их сразу после декодирования,
+        # чтобы они не тянулись через convert/thumbnail в итоговый JPEG
+        img.info.pop('exif', None)
+        img.info.pop('icc_profile', None)
+
         # print("\nИсходные данные:")
         self.print_image_metadata(img)
 
@@ -51,7 +57,7 @@ class ImageProcessor:
         quality = 95
         while quality >= 10:
             buffer = BytesIO()
-            img.save(buffer, format='JPEG', quality=quality)
+            img.save(buffer, format='JPEG', quality=quality, exif=b'')
             size_kb = buffer.tell() / 1024
             if size_kb <= self.max_kb:
                 # print(f"\n✅ Сжатие успешно ({size_kb:.2f} КБ, качество: {quality})")
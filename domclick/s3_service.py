@@ -50,7 +50,11 @@ class S3Service:
         return f"{self.public_base}/{key}"
 
     def upload_bytes(self, data: bytes, key: str, content_type: Optional[str] = "image/jpeg") -> str:
-        """Загружает байты в S3 по ключу и возвращает публичный URL."""
+        """Загружает байты в S3 по ключу и возвращает публичный URL.
+
+        Байты идут из парсера прямо в хранилище одним put_object, без промежуточного
+        сервиса, поэтому presigned-URL не сократили бы число передач.
+        """
         key = key.lstrip("/")
         extra_args = {"ContentType": content_type}
         self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=data, **extra_args)
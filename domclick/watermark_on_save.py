@@ -1,8 +1,8 @@
+import functools
 import io
 import logging
-import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional, Union
 
 from PIL import Image
 try:
@@ -30,10 +30,31 @@ def ensure_svg_to_png(svg_path: Path, scale_width_px: int) -> Image.Image:
     return Image.open(io.BytesIO(png_bytes)).convert("RGBA")
 
 
+@functools.lru_cache(maxsize=64)
+def _prepared_logo(svg_path: str, width_px: int, opacity: float) -> Image.Image:
+    """Растеризует логотип с прозрачностью один раз на (путь, ширина, прозрачность).
+
+    Результат только читается: alpha_composite не меняет накладываемое изображение.
+    """
+    logo_rgba = ensure_svg_to_png(Path(svg_path), width_px)
+
+    if opacity < 0:
+        opacity = 0
+    if opacity > 1:
+        opacity = 1
+    if logo_rgba.mode != "RGBA":
+        logo_rgba = logo_rgba.convert("RGBA")
+    r, g, b, a = logo_rgba.split()
+    a = a.point(lambda p: int(p * opacity))
+    logo_rgba = Image.merge("RGBA", (r, g, b, a))
+    logo_rgba.load()
+    return logo_rgba
+
+
 def apply_watermark(
-    photo_path: Path,
+    photo_path: Union[Path, BinaryIO],
     svg_logo_path: Path,
-    output_path: Path,
+    output_path: Union[Path, BinaryIO],
     relative_width: float = 0.2,
     opacity: float = 0.6,
     margin_px: int = 24,
@@ -51,17 +72,7 @@ def apply_watermark(
     else:
         target_logo_width = max(1, int(base.width * relative_width))
 
-    logo_rgba = ensure_svg_to_png(svg_logo_path, target_logo_width)
-
-    if opacity < 0:
-        opacity = 0
-    if opacity > 1:
-        opacity = 1
-    if logo_rgba.mode != "RGBA":
-        logo_rgba = logo_rgba.convert("RGBA")
-    r, g, b, a = logo_rgba.split()
-    a = a.point(lambda p: int(p * opacity))
-    logo_rgba = Image.merge("RGBA", (r, g, b, a))
+    logo_rgba = _prepared_logo(str(svg_logo_path), target_logo_width, opacity)
 
     if position == "center":
         x = (base.width - logo_rgba.width) // 2
@@ -74,7 +85,9 @@ def apply_watermark(
     composed.alpha_composite(logo_rgba, dest=(max(0, x), max(0, y)))
 
     rgb = composed.convert("RGB")
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Вместо путей можно передать файловые объекты (например, BytesIO) — тогда все идет в памяти
+    if isinstance(output_path, Path):
+        output_path.parent.mkdir(parents=True, exist_ok=True)
     rgb.save(output_path, format="JPEG", quality=92)
 
 
@@ -87,41 +100,19 @@ def _watermark_bytes(
     position: str = "center",
     margin: int = 24,
 ) -> bytes:
-    # Используем временную директорию, которая работает на всех платформах
-    temp_dir = Path(tempfile.gettempdir())
-    tmp_in = temp_dir / "domclick_wm_in.jpg"
-    tmp_out = temp_dir / "domclick_wm_out.jpg"
-    
-    try:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            fmt = "PNG" if img.mode in ("RGBA", "LA") else "JPEG"
-            img.convert("RGBA" if fmt == "PNG" else "RGB").save(tmp_in, format=fmt)
-
-        apply_watermark(
-            photo_path=tmp_in,
-            svg_logo_path=logo_path,
-            output_path=tmp_out,
-            relative_width=rel_width,
-            opacity=opacity,
-            margin_px=margin,
-            position=position,
-            full_coverage=full,
-        )
-
-        with open(tmp_out, "rb") as f:
-            return f.read()
-    finally:
-        # Удаляем временные файлы после использования
-        try:
-            if tmp_in.exists():
-                tmp_in.unlink()
-        except Exception:
-            pass
-        try:
-            if tmp_out.exists():
-                tmp_out.unlink()
-        except Exception:
-            pass
+    """Накладывает водяной знак в памяти, без временных файлов: вызовы из разных потоков не мешают друг другу."""
+    output = io.BytesIO()
+    apply_watermark(
+        photo_path=io.BytesIO(image_bytes),
+        svg_logo_path=logo_path,
+        output_path=output,
+        relative_width=rel_width,
+        opacity=opacity,
+        margin_px=margin,
+        position=position,
+        full_coverage=full,
+    )
+    return output.getvalue()
 
 
 def upload_with_watermark(
@@ -2,6 +2,7 @@
 Модуль для работы с браузером через Pyppeteer
 """
 import asyncio
+import functools
 import time
 import random
 import os
@@ -15,19 +16,31 @@ EXECUTABLE_PATH = "/usr/bin/google-chrome-stable"
 PROXY_HOST = "192.168.0.148"
 PORTS = [3128, 3129, 3130, 3131, 3132, 3133, 3134, 3135, 3136]
 
+# Фолбэк: Chrome user-agent
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36'
+
+
+@functools.lru_cache(maxsize=1)
+def _load_user_agents():
+    """
+    Читает user-agent'ы из файла один раз за процесс.
+    При ошибке бросает исключение: lru_cache его не запоминает, и следующий вызов прочитает файл заново.
+    """
+    with open("useragets.txt", encoding='utf-8') as f:
+        user_agents = tuple(line.strip() for line in f if line.strip())
+    if not user_agents:
+        raise Exception('useragets.txt пустой!')
+    return user_agents
+
+
 def get_random_user_agent():
-    """Читает user-agent'ы из файла и возвращает случайный"""
+    """Возвращает случайный user-agent из useragets.txt"""
     try:
-        # Используем абсолютный путь относительно текущего скрипта
-        with open("useragets.txt", encoding='utf-8') as f:
-            user_agents = [line.strip() for line in f if line.strip()]
-        if not user_agents:
-            raise Exception('useragets.txt пустой!')
-        return random.choice(user_agents)
+        user_agents = _load_user_agents()
     except Exception as e:
         print(f"Ошибка при чтении useragets.txt: {e}")
-        # Фолбэк: Chrome user-agent
-        return 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36'
+        return DEFAULT_USER_AGENT
+    return random.choice(user_agents)
 
 
 def random_sleep(min_seconds=1, max_seconds=3):
@@ -37,6 +50,13 @@ def random_sleep(min_seconds=1, max_seconds=3):
     time.sleep(duration)
 
 
+async def random_sleep_async(min_seconds=1, max_seconds=3):
+    """Async-вариант random_sleep: не блокирует цикл событий на время паузы"""
+    duration = random.uniform(min_seconds, max_seconds)
+    print(f"Waiting for {duration:.2f} seconds...")
+    await asyncio.sleep(duration)
+
+
 async def setup_stealth_browser():
     """Create a highly stealthed browser to avoid fingerprinting"""
 
@@ -124,6 +144,9 @@ async def setup_stealth_browser():
     # Set default timeouts (in milliseconds)
     page.setDefaultNavigationTimeout(60000)  # 60 seconds
 
+    # Запоминаем прокси браузера: прямые HTTP-запросы с его cookies должны идти с того же IP
+    browser.proxy_server = proxy_server
+
     return browser, page
 
 
@@ -174,7 +197,7 @@ async def create_new_tab(browser, url=None):
         try:
             await page.goto(url, {'waitUntil': 'networkidle2', 'timeout': 90000})
             # Дополнительная задержка для стабилизации страницы
-            random_sleep(3, 5)
+            await random_sleep_async(3, 5)
             print(f"URL загружен успешно: {url}")
         except Exception as e:
             print(f"Ошибка при загрузке URL {url}: {e}")
@@ -1,9 +1,13 @@
+import functools
+import hashlib
 import os
 import re
+import unicodedata
 from pathlib import Path
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
-from typing import Dict, Any, Optional
+import bson
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 
 # Директория текущего скрипта
@@ -16,76 +20,93 @@ COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 MONGO_URI = os.getenv("MONGO_URI")
 
 
+# Таблица транслитерации для str.translate (значения могут быть из нескольких букв).
+# Все ключи — одиночные символы, поэтому translate заменяет их за один проход без поиска совпадений.
+_TRANSLIT_TABLE = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'G', 'Д': 'D', 'Е': 'E', 'Ё': 'Yo',
+    'Ж': 'Zh', 'З': 'Z', 'И': 'I', 'Й': 'Y', 'К': 'K', 'Л': 'L', 'М': 'M',
+    'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R', 'С': 'S', 'Т': 'T', 'У': 'U',
+    'Ф': 'F', 'Х': 'H', 'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Sch',
+    'Ъ': '', 'Ы': 'Y', 'Ь': '', 'Э': 'E', 'Ю': 'Yu', 'Я': 'Ya'
+})
+
+
 def transliterate_russian_to_latin(text: str) -> str:
     """Транслитерирует русский текст в латиницу"""
-    translit_dict = {
-        'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
-        'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
-        'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
-        'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
-        'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
-        'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'G', 'Д': 'D', 'Е': 'E', 'Ё': 'Yo',
-        'Ж': 'Zh', 'З': 'Z', 'И': 'I', 'Й': 'Y', 'К': 'K', 'Л': 'L', 'М': 'M',
-        'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R', 'С': 'S', 'Т': 'T', 'У': 'U',
-        'Ф': 'F', 'Х': 'H', 'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Sch',
-        'Ъ': '', 'Ы': 'Y', 'Ь': '', 'Э': 'E', 'Ю': 'Yu', 'Я': 'Ya'
-    }
-    
-    result = ""
-    for char in text:
-        result += translit_dict.get(char, char)
-    return result
+    return text.translate(_TRANSLIT_TABLE)
+
+
+# Общие слова, которые убираются из названия ЖК (но НЕ значимые слова типа "village", "park")
+COMMON_WORDS = ['жк', 'жилой', 'комплекс', 'дома', 'квартиры', 'поселок',
+                'литер', 'литера', 'секции', 'этап', 'очередь',
+                'клубный', 'микрорайон', 'красочный',
+                'апартаментов', 'апартаменты', 'высотных', 'экогород',
+                'клубная', 'резиденция', 'группа', 'компаний', 'комплекса']
 
+# Значимые слова, которые НЕ должны удаляться
+SIGNIFICANT_WORDS = frozenset({'village', 'виллидж', 'park', 'парк', 'city', 'сити',
+                               'town', 'таун', 'garden', 'гарден', 'house', 'хаус',
+                               'collection', 'коллекшн', 'квартал', 'premiere', 'премьер',
+                               'умный', 'smart', 'дом', 'the', 'prime'})
 
+# Служебные слова (номера литеров/секций/этапов), которые выкидываются после разбиения на слова
+SERVICE_WORDS = frozenset({'литер', 'литера', 'секции', 'секция', 'этап', 'очередь', 'паркинг'})
+
+# Общие слова, которые действительно удаляются (значимые исключены заранее, а не при каждом вызове)
+REMOVABLE_WORDS = tuple(word for word in COMMON_WORDS if word not in SIGNIFICANT_WORDS)
+
+# Регулярные выражения normalize_name компилируются один раз при импорте
+_PAREN_RE = re.compile(r'\([^)]*\)')
+_NONWORD_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+_COMMON_WORDS_RE = re.compile(r'\b(?:' + '|'.join(map(re.escape, REMOVABLE_WORDS)) + r')\b')
+
+
+@functools.lru_cache(maxsize=8192)
 def normalize_name(name: str) -> str:
-    """Нормализует название ЖК для поиска с поддержкой транслитерации"""
+    """
+    Нормализует название ЖК для поиска с поддержкой транслитерации.
+    Функция чистая, поэтому результат кэшируется: повторы названий не гоняют регулярки заново.
+    """
     if not name:
         return ""
     
+    # Составные символы (например, "и" + комбинируемая бреве вместо "й") приводим к NFC,
+    # иначе комбинируемые знаки вырезаются регуляркой ниже. Для обычных строк проверка быстрая, без копирования
+    if not unicodedata.is_normalized('NFC', name):
+        name = unicodedata.normalize('NFC', name)
+    
     # Приводим к нижнему регистру
     normalized = name.lower()
     
     # Убираем содержимое в скобках (часто там транслитерации)
-    normalized = re.sub(r'\([^)]*\)', '', normalized)
+    normalized = _PAREN_RE.sub('', normalized)
     
     # Убираем лишние символы и пробелы
-    normalized = re.sub(r'[^\w\s]', '', normalized)
-    normalized = re.sub(r'\s+', ' ', normalized).strip()
-    
-    # Убираем общие слова (но НЕ убираем значимые слова типа "village", "park")
-    common_words = ['жк', 'жилой', 'комплекс', 'дома', 'квартиры', 'поселок',
-                   'литер', 'литера', 'секции', 'этап', 'очередь',
-                   'клубный', 'микрорайон', 'красочный',
-                   'апартаментов', 'апартаменты', 'высотных', 'экогород',
-                   'клубная', 'резиденция', 'группа', 'компаний', 'комплекса']
+    normalized = _NONWORD_RE.sub('', normalized)
+    normalized = _WS_RE.sub(' ', normalized).strip()
     
-    # Значимые слова, которые НЕ должны удаляться
-    significant_words = {'village', 'виллидж', 'park', 'парк', 'city', 'сити', 
-                        'town', 'таун', 'garden', 'гарден', 'house', 'хаус',
-                        'collection', 'коллекшн', 'квартал', 'premiere', 'премьер',
-                        'умный', 'smart', 'дом', 'the', 'prime'}
-    
-    for word in common_words:
-        # Убираем слово только если оно отдельное (не часть другого слова) и не значимое
-        if word not in significant_words:
-            normalized = re.sub(r'\b' + word + r'\b', '', normalized)
+    # Убираем общие слова одним проходом (только отдельные слова, значимые не трогаем)
+    normalized = _COMMON_WORDS_RE.sub('', normalized)
     
     # Убираем отдельно стоящие цифры и короткие буквы (номера литеров, этапов, секций)
     # Но оставляем цифры, которые являются частью названия (8 марта, 535)
-    words = normalized.split()
-    filtered_words = []
-    for i, word in enumerate(words):
-        # Пропускаем слова, которые являются номерами литеров/секций/этапов
-        if (word.isdigit() or  # Одиночные цифры
-            (len(word) <= 3 and word.isalpha() and word not in significant_words) or  # Короткие буквы
-            word in ['литер', 'литера', 'секции', 'секция', 'этап', 'очередь', 'паркинг']):  # Служебные слова
-            continue
-        filtered_words.append(word)
+    # Пропускаем служебные слова, одиночные цифры и короткие буквы (кроме значимых слов)
+    filtered_words = [
+        word for word in normalized.split()
+        if not (word in SERVICE_WORDS or word.isdigit()
+                or (len(word) <= 3 and word not in SIGNIFICANT_WORDS and word.isalpha()))
+    ]
     
     normalized = ' '.join(filtered_words)
     
     # Убираем лишние пробелы после удаления слов
-    normalized = re.sub(r'\s+', ' ', normalized).strip()
+    normalized = _WS_RE.sub(' ', normalized).strip()
     
     # Транслитерируем русский текст в латиницу для лучшего сопоставления
     transliterated = transliterate_russian_to_latin(normalized)
@@ -97,14 +118,66 @@ def normalize_name(name: str) -> str:
         return normalized
 
 
+# Один клиент MongoDB на процесс: повторные вызовы get_collection() используют его пул соединений
+_client: Optional[MongoClient] = None
+_collection = None
+
+
 def get_collection():
     """Подключается к существующей коллекции MongoDB.
-    Возвращает объект коллекции.
+    Возвращает объект коллекции (клиент создается один раз на процесс).
     """
-    client = MongoClient(MONGO_URI, appname="domrf-parser")
-    db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
-    return collection
+    global _client, _collection
+    if _collection is None:
+        _client = MongoClient(MONGO_URI, appname="domrf-parser", maxPoolSize=50, minPoolSize=5)
+        db = _client[DB_NAME]
+        _collection = db[COLLECTION_NAME]
+        ensure_indexes(_collection)
+    return _collection
+
+
+def ensure_indexes(collection) -> None:
+    """Создает индексы для поиска по objId и normalized_name (если их еще нет).
+    Без них find_one/update_one в upsert_object_smart сканируют всю коллекцию.
+    Индекс по названию составной: условие objId $ne при поиске дубликатов проверяется по ключам индекса.
+    """
+    try:
+        collection.create_index([('objId', 1)], unique=True)
+    except PyMongoError as e:
+        # Например, в коллекции уже есть дубликаты objId — работаем без уникальности
+        print(f"⚠️  Не удалось создать уникальный индекс по objId: {e}")
+        try:
+            collection.create_index([('objId', 1)])
+        except PyMongoError:
+            pass
+    try:
+        collection.create_index([('normalized_name', 1), ('objId', 1)])
+    except PyMongoError as e:
+        print(f"⚠️  Не удалось создать индекс по normalized_name: {e}")
+        return
+    # Прежний одиночный индекс по названию покрывается составным и только замедляет запись
+    try:
+        if 'normalized_name_1' in collection.index_information():
+            collection.drop_index('normalized_name_1')
+    except PyMongoError as e:
+        print(f"⚠️  Не удалось удалить старый индекс normalized_name_1: {e}")
+
+
+# Поля, которые не участвуют в хэше содержимого: сам хэш и время извлечения (меняется при каждом запуске)
+_HASH_EXCLUDED_KEYS = frozenset({'_content_hash', 'details_extracted_at'})
+
+
+def content_hash(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Считает хэш содержимого объекта по его BSON-представлению.
+    Совпадение с сохраненным _content_hash означает, что повторно собраны те же данные.
+    Возвращает None, если данные не удалось сериализовать.
+    """
+    try:
+        payload = bson.encode({k: v for k, v in data.items() if k not in _HASH_EXCLUDED_KEYS})
+    except Exception:
+        return None
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
 
 
 def compare_and_merge_data(existing_data: Dict[str, Any], new_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -123,45 +196,61 @@ def compare_and_merge_data(existing_data: Dict[str, Any], new_data: Dict[str, An
     Returns:
         Объединенные данные
     """
-    merged = existing_data.copy()
+    # Частый случай при повторном парсинге: данные не изменились.
+    # Сравнение словарей целиком идет в C и дешевле обхода ниже.
+    if new_data == existing_data:
+        return existing_data
 
-    for key, new_value in new_data.items():
-        # Если ключа не было в старых данных - добавляем
-        if key not in existing_data:
-            merged[key] = new_value
-            continue
+    # Обход вложенных словарей без рекурсии: кадр стека — [старый, новый, итератор по новому,
+    # копия старого (создается только при первом отличии), родительский ключ].
+    # Неизмененные поддеревья не копируются и возвращаются как есть.
+    stack = [[existing_data, new_data, iter(new_data.items()), None, None]]
+    while True:
+        frame = stack[-1]
+        old_dict = frame[0]
+        descended = False
 
-        old_value = existing_data[key]
+        for key, new_value in frame[2]:
+            # Если ключа не было в старых данных - добавляем
+            if key not in old_dict:
+                value = new_value
+            else:
+                old_value = old_dict[key]
 
-        # Проверяем, является ли новое значение "пустым"
-        is_empty_new = (
-                new_value is None or
-                (isinstance(new_value, (list, dict, str)) and not new_value)
-        )
+                # Если новое значение пустое - оставляем старое
+                if new_value is None or (isinstance(new_value, (list, dict, str)) and not new_value):
+                    continue
 
-        # Если новое значение пустое - оставляем старое
-        if is_empty_new:
-            merged[key] = old_value
-            continue
+                if isinstance(new_value, dict) and isinstance(old_value, dict):
+                    # Спускаемся во вложенный словарь, только если он отличается
+                    if new_value != old_value:
+                        stack.append([old_value, new_value, iter(new_value.items()), None, key])
+                        descended = True
+                        break
+                    continue
 
-        # Если новое значение не пустое и отличается от старого - обновляем
-        if isinstance(new_value, dict) and isinstance(old_value, dict):
-            # Рекурсивно сравниваем словари
-            merged[key] = compare_and_merge_data(old_value, new_value)
-        elif isinstance(new_value, list) and isinstance(old_value, list):
-            # Для списков: если новый список не пустой и отличается - заменяем
-            if new_value != old_value:
-                merged[key] = new_value
-            else:
-                merged[key] = old_value
-        else:
-            # Для примитивных типов: если отличается - обновляем
-            if new_value != old_value:
-                merged[key] = new_value
-            else:
-                merged[key] = old_value
+                # Для списков и примитивов: если отличается - обновляем
+                if new_value == old_value:
+                    continue
+                value = new_value
+
+            if frame[3] is None:
+                frame[3] = old_dict.copy()
+            frame[3][key] = value
 
-    return merged
+        if descended:
+            continue
+
+        # Словарь пройден целиком: результат — копия с изменениями или исходный словарь
+        stack.pop()
+        result = frame[3] if frame[3] is not None else old_dict
+        if not stack:
+            return result
+        if result is not old_dict:
+            parent = stack[-1]
+            if parent[3] is None:
+                parent[3] = parent[0].copy()
+            parent[3][frame[4]] = result
 
 
 def check_duplicate_by_name(collection, obj_id: str, obj_commerc_nm: str) -> bool:
@@ -221,59 +310,155 @@ def upsert_object_smart(collection, obj_id: str, new_data: Dict[str, Any]) -> bo
     Returns:
         True если данные были обновлены, False если произошла ошибка
     """
-    try:
-        # Получаем название ЖК из новых данных
-        obj_commerc_nm = new_data.get('objCommercNm')
+    return upsert_object_smart_batch(collection, [(obj_id, new_data)]).get(obj_id, False)
+
+
+def upsert_object_smart_batch(collection, items: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, bool]:
+    """
+    Пакетный вариант upsert_object_smart с той же логикой для каждого объекта.
+    
+    Вместо 2-3 запросов на объект делает на весь пакет не больше двух find и один bulk_write:
+    сначала владельцы названий (для проверки дубликатов), затем одним запросом по objId
+    существующие записи, их сохраненный _content_hash сразу показывает, изменились ли данные.
+    Дубликаты и слияние данных определяются локально, в том числе между объектами внутри пакета.
+    
+    Args:
+        collection: Коллекция MongoDB
+        items: Список пар (objId, новые данные)
         
-        # Добавляем нормализованное название в данные
+    Returns:
+        Словарь objId -> True если данные сохранены (или не изменились), False при дубликате/ошибке
+    """
+    results: Dict[str, bool] = {}
+    if not items:
+        return results
+
+    # Нормализованные названия и хэши содержимого считаем до обращения к базе
+    for _, new_data in items:
+        obj_commerc_nm = new_data.get('objCommercNm')
         if obj_commerc_nm:
-            normalized_name = normalize_name(obj_commerc_nm)
-            new_data['normalized_name'] = normalized_name
-            
-            # Проверяем дубликаты по нормализованному названию
-            existing_by_normalized = collection.find_one({
-                'normalized_name': normalized_name,
-                'objId': {'$ne': obj_id}
-            })
-            
-            if existing_by_normalized:
-                print(f"⚠️  Найден дубликат по нормализованному названию '{normalized_name}' (objId: {existing_by_normalized.get('objId')}, название: '{existing_by_normalized.get('objCommercNm')}'). Пропускаем сохранение объекта {obj_id} ('{obj_commerc_nm}')")
-                return False
+            new_data['normalized_name'] = normalize_name(obj_commerc_nm)
+        new_hash = content_hash(new_data)
+        if new_hash is not None:
+            new_data['_content_hash'] = new_hash
 
-        # Ищем существующую запись по objId
-        existing_record = collection.find_one({'objId': obj_id})
+    try:
+        normalized_names = {new_data['normalized_name'] for _, new_data in items if new_data.get('objCommercNm')}
 
-        if existing_record is None:
-            # Записи нет - создаем новую
-            print(f"📝 Создаем новую запись для объекта {obj_id} ('{obj_commerc_nm}')")
-            collection.insert_one(new_data)
-            return True
+        # Владельцы нормализованных названий: normalized_name -> (objId, objCommercNm)
+        name_owners: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        if normalized_names:
+            cursor = collection.find(
+                {'normalized_name': {'$in': list(normalized_names)}},
+                {'objId': 1, 'normalized_name': 1, 'objCommercNm': 1, '_id': 0}
+            )
+            for record in cursor:
+                name_owners.setdefault(record['normalized_name'], []).append(
+                    (record.get('objId'), record.get('objCommercNm'))
+                )
 
-        # Запись найдена - сравниваем и объединяем данные
-        print(f"🔄 Обновляем существующую запись для объекта {obj_id}")
+        # Существующие записи (без _id — для корректного сравнения) одним запросом;
+        # объекты, название которых в базе занято другим objId не из этого пакета, не сохраняются и не читаются
+        batch_ids = {obj_id for obj_id, _ in items}
+        obj_ids = list({
+            obj_id for obj_id, new_data in items
+            if not (new_data.get('objCommercNm') and any(
+                owner[0] != obj_id and owner[0] not in batch_ids
+                for owner in name_owners.get(new_data['normalized_name'], ())
+            ))
+        })
+        existing_by_id: Dict[str, Dict[str, Any]] = {}
+        if obj_ids:
+            for record in collection.find({'objId': {'$in': obj_ids}}, {'_id': 0}):
+                existing_by_id.setdefault(record['objId'], record)
+    except Exception as e:
+        print(f"❌ Ошибка при чтении существующих записей из MongoDB: {e}")
+        return {obj_id: False for obj_id, _ in items}
 
-        # Убираем _id из existing_record для корректного сравнения
-        existing_data = {k: v for k, v in existing_record.items() if k != '_id'}
+    operations = []
+    op_obj_ids = []
+    pending: Dict[str, Dict[str, Any]] = {}
+    # Названия, которые заняли или освободили объекты этого пакета, еще не записанные в базу
+    pending_names = set()
+    # Объекты, проверку названия которых можно сделать только после записи предыдущих
+    rest_items: List[Tuple[str, Dict[str, Any]]] = []
 
-        # Объединяем данные
-        merged_data = compare_and_merge_data(existing_data, new_data)
+    for index, (obj_id, new_data) in enumerate(items):
+        obj_commerc_nm = new_data.get('objCommercNm')
 
-        # Проверяем, изменились ли данные
-        if merged_data == existing_data:
+        # Проверяем дубликаты по нормализованному названию
+        # (для любого непустого названия, даже если оно нормализуется в пустую строку)
+        if obj_commerc_nm:
+            normalized_name = new_data['normalized_name']
+            owners = [owner for owner in name_owners.get(normalized_name, ()) if owner[0] != obj_id]
+            # Название затронуто еще не записанной операцией пакета: владелец зависит от ее успеха,
+            # поэтому сначала записываем пакет до этого места, а остаток проверяем по базе
+            if normalized_name in pending_names or any(owner[0] in pending for owner in owners):
+                rest_items = items[index:]
+                break
+            if owners:
+                duplicate = owners[0]
+                print(f"⚠️  Найден дубликат по нормализованному названию '{normalized_name}' (objId: {duplicate[0]}, название: '{duplicate[1]}'). Пропускаем сохранение объекта {obj_id} ('{obj_commerc_nm}')")
+                results[obj_id] = False
+                continue
+
+        previous = pending.get(obj_id)
+        existing_data = previous if previous is not None else existing_by_id.get(obj_id)
+        stored_hash = existing_data.get('_content_hash') if existing_data is not None else None
+
+        # Те же данные, что и при прошлом сохранении: слияние и запись не нужны
+        new_hash = new_data.get('_content_hash')
+        if new_hash is not None and new_hash == stored_hash:
             print(f"ℹ️  Данные для объекта {obj_id} не изменились")
-            return True
+            results[obj_id] = True
+            continue
 
-        # Обновляем запись
-        result = collection.update_one(
-            {'objId': obj_id},
-            {'$set': merged_data}
-        )
+        if existing_data is None:
+            # Записи нет - создаем новую
+            print(f"📝 Создаем новую запись для объекта {obj_id} ('{obj_commerc_nm}')")
+            merged_data = new_data
+        else:
+            # Запись найдена - сравниваем и объединяем данные
+            print(f"🔄 Обновляем существующую запись для объекта {obj_id}")
+            merged_data = compare_and_merge_data(existing_data, new_data)
 
-        if result.modified_count > 0:
-            print(f"✅ Данные для объекта {obj_id} обновлены")
+            # Проверяем, изменились ли данные
+            if merged_data == existing_data:
+                print(f"ℹ️  Данные для объекта {obj_id} не изменились")
+                results[obj_id] = True
+                continue
 
-        return True
+        # Запись может занять новое название и освободить прежнее
+        for name in (merged_data.get('normalized_name'), existing_data.get('normalized_name') if existing_data else None):
+            if name is not None:
+                pending_names.add(name)
+        # Неупорядоченный bulk_write не гарантирует порядок операций: на объект остается одна,
+        # с данными, уже слитыми с предыдущими записями пакета
+        if obj_id in pending:
+            operations[op_obj_ids.index(obj_id)] = UpdateOne({'objId': obj_id}, {'$set': merged_data}, upsert=True)
+        else:
+            operations.append(UpdateOne({'objId': obj_id}, {'$set': merged_data}, upsert=True))
+            op_obj_ids.append(obj_id)
+        pending[obj_id] = merged_data
+        results[obj_id] = True
 
-    except Exception as e:
-        print(f"❌ Ошибка при сохранении данных для объекта {obj_id}: {e}")
-        return False
+    failed_ids = set()
+    if operations:
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                obj_id = op_obj_ids[error['index']]
+                print(f"❌ Ошибка при сохранении данных для объекта {obj_id}: {error.get('errmsg')}")
+                failed_ids.add(obj_id)
+        except Exception as e:
+            print(f"❌ Ошибка при пакетном сохранении {len(operations)} объектов: {e}")
+            failed_ids.update(op_obj_ids)
+        for obj_id in failed_ids:
+            results[obj_id] = False
+
+    # Остаток пакета проверяется заново, уже по владельцам названий из базы
+    if rest_items:
+        results.update(upsert_object_smart_batch(collection, rest_items))
+
+    return results
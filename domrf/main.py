@@ -1,12 +1,18 @@
+import asyncio
 import sys
 import time
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None  # Без uvloop работает стандартный цикл событий asyncio
 
-def run_stage(stage_name: str, func) -> bool:
+
+async def run_stage(stage_name: str, coro) -> bool:
     print(f"\n===== Начало этапа: {stage_name} =====", flush=True)
     start = time.time()
     try:
-        func()
+        await coro
         elapsed = time.time() - start
         print(f"===== Этап '{stage_name}' завершён за {elapsed:.2f} c =====\n", flush=True)
         return True
@@ -16,17 +22,59 @@ def run_stage(stage_name: str, func) -> bool:
         return False
 
 
-def main():
-    # Этап 1: сбор списка домов (создаёт domrf_houses.json)
-    from parse_domrf_1 import main as stage1_main
-    ok1 = run_stage("Сбор списка домов (parse_domrf_1)", stage1_main)
+async def run_stages():
+    """
+    Запускает оба этапа одновременно: дома, собранные этапом 1, сразу передаются
+    через очередь этапу 2, не дожидаясь окончания сбора всего списка.
+    """
+    from parse_domrf_1 import main_async as stage1_main
+    from parse_domrf_2 import process_objects as stage2_main, load_input_objects, INPUT_JSON
 
-    if not ok1:
-        print("Предыдущий этап завершился ошибкой. Продолжаем со вторым этапом по вашему запросу...", flush=True)
+    houses_queue = asyncio.Queue()
+    enqueued = 0
+
+    def enqueue_houses(batch):
+        nonlocal enqueued
+        for house in batch:
+            houses_queue.put_nowait(house)
+        enqueued += len(batch)
+
+    async def stage1():
+        stage1_ok = False
+        try:
+            # Этап 1: сбор списка домов (дописывает domrf_houses.ndjson)
+            await stage1_main(on_batch=enqueue_houses)
+            stage1_ok = True
+        finally:
+            # Если этап 1 упал или ничего не прислал, этап 2 продолжает по ранее сохраненному
+            # списку домов (повторы и уже обработанные дома этап 2 пропускает сам)
+            if not stage1_ok or not enqueued:
+                try:
+                    saved_houses = load_input_objects()
+                    enqueue_houses(saved_houses)
+                    print(f"Этап 2 продолжит по сохраненному списку: {len(saved_houses)} домов из {INPUT_JSON}", flush=True)
+                except FileNotFoundError:
+                    print(f"Сохраненного списка домов нет: {INPUT_JSON} не найден", flush=True)
+                except Exception as e:
+                    print(f"Ошибка при чтении {INPUT_JSON}: {e}", flush=True)
+            # Маркер конца очереди: этап 2 доработает полученные дома и завершится
+            houses_queue.put_nowait(None)
 
     # Этап 2: сбор деталей по домам и сохранение в MongoDB
-    from parse_domrf_2 import main as stage2_main
-    ok2 = run_stage("Сбор деталей и запись в MongoDB (parse_domrf_2)", stage2_main)
+    return await asyncio.gather(
+        run_stage("Сбор списка домов (parse_domrf_1)", stage1()),
+        run_stage("Сбор деталей и запись в MongoDB (parse_domrf_2)", stage2_main(houses_queue)),
+    )
+
+
+def main():
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    ok1, ok2 = asyncio.run(run_stages())
+
+    if not ok1:
+        print("Этап сбора списка домов завершился ошибкой; второй этап обработал дома, полученные до ошибки, "
+              "и ранее сохраненный список домов.", flush=True)
 
     from pathlib import Path
     PROJECT_ROOT = Path(__file__).resolve().parent
@@ -5,8 +5,19 @@ import json
 import os
 import sys
 from pathlib import Path
+import aiohttp
 from browser_manager import setup_stealth_browser
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Без orjson прогресс и дома пишутся стандартным json
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None  # Без uvloop работает стандартный цикл событий asyncio
+
 # Директория текущего скрипта
 PROJECT_ROOT = Path(__file__).resolve().parent
 
@@ -27,12 +38,83 @@ PARAMS = {
 }
 
 PROGRESS_FILE = PROJECT_ROOT / 'domrf_api_progress.json'
-JSON_OUTPUT_FILE = PROJECT_ROOT / 'domrf_houses.json'
+PROGRESS_SAVE_INTERVAL = 5  # не чаще раза в 5 секунд, последняя пачка сохраняется принудительно
+_last_progress_save = 0.0
+# Дома пишутся построчно (NDJSON): одна JSON-запись на строку, файл только дополняется
+JSON_OUTPUT_FILE = PROJECT_ROOT / 'domrf_houses.ndjson'
 
 # Настройки повторных попыток
 MAX_RETRIES = 10  # Максимальное количество повторных попыток
-RETRY_DELAY = 120  # Задержка между попытками в секундах (10 минут)
-RETRY_DELAY_INCREMENT = 60  # Увеличение задержки с каждой попыткой (1 минута)
+RETRY_DELAY = 120  # Базовая задержка между попытками в секундах (удваивается с каждой попыткой)
+RETRY_DELAY_MAX = 600  # Потолок задержки между попытками (10 минут)
+RETRY_BACKOFF_MAX_SECONDS = 30  # потолок паузы между повторными запросами одной страницы API
+
+API_CONCURRENCY = int(os.getenv("DOMRF_API_CONCURRENCY", "4"))  # сколько страниц API запрашивать одновременно
+
+
+API_HEADERS = {
+    'accept': 'application/json, text/plain, */*',
+    'authorization': 'Basic MTpxd2U=',
+}
+
+
+async def create_api_session(page):
+    """
+    Создает HTTP-сессию для прямых запросов к API с cookies и user-agent страницы браузера.
+    Браузер нужен только для прохождения антибот-проверки на странице каталога.
+    """
+    cookies = {cookie['name']: cookie['value'] for cookie in await page.cookies()}
+    user_agent = await page.evaluate('() => navigator.userAgent')
+    headers = {**API_HEADERS, 'user-agent': user_agent, 'referer': page.url}
+    return aiohttp.ClientSession(headers=headers, cookies=cookies, timeout=aiohttp.ClientTimeout(total=60))
+
+
+async def fetch_api_direct(session, params, proxy=None):
+    """Запрашивает страницу API напрямую, минуя JS-мост браузера. Возвращает None, если ответ не JSON/не 200."""
+    async with session.get(API_URL, params=params, proxy=proxy) as resp:
+        if resp.status != 200:
+            print(f"Прямой запрос к API вернул HTTP {resp.status}")
+            return None
+        try:
+            return await resp.json(content_type=None)
+        except ValueError:
+            return None
+
+
+async def fetch_api_page(api, page, params):
+    """
+    Запрашивает страницу API: напрямую через api['session'], а при отказе — через браузер.
+    После первого отказа прямых запросов api['session'] закрывается и сбрасывается в None.
+    """
+    session = api['session']
+    if session is not None:
+        data = None
+        try:
+            data = await fetch_api_direct(session, params, api['proxy'])
+        except Exception as e:
+            print(f"Ошибка прямого запроса к API: {e}")
+        if data:
+            return data
+        # Параллельные запросы могли уже переключиться на браузер
+        if api['session'] is session:
+            print("Прямой запрос к API не прошел, дальше запрашиваем через браузер")
+            api['session'] = None
+            await session.close()
+    return await fetch_api_in_browser(page, params)
+
+
+def get_total_count(data):
+    """Общее число домов из ответа API, если API его сообщает, иначе None."""
+    payload = data.get('data')
+    total = payload.get('total') if isinstance(payload, dict) else data.get('total')
+    return total if isinstance(total, int) else None
+
+
+def retry_backoff_delay(attempt: int) -> float:
+    """
+    Пауза перед повторной попыткой: экспоненциальный рост с небольшим случайным разбросом.
+    """
+    return min(RETRY_BACKOFF_MAX_SECONDS, 0.5 * 2 ** attempt + random.uniform(0, 0.5))
 
 
 async def fetch_api_in_browser(page, params):
@@ -42,8 +124,8 @@ async def fetch_api_in_browser(page, params):
         async () => {{
             const resp = await fetch("{url}", {{
                 headers: {{
-                    'accept': 'application/json, text/plain, */*',
-                    'authorization': 'Basic MTpxd2U=',
+                    'accept': '{API_HEADERS['accept']}',
+                    'authorization': '{API_HEADERS['authorization']}',
                 }}
             }});
             if (!resp.ok) return null;
@@ -57,8 +139,9 @@ def load_progress():
     """Загружает сохраненный прогресс из файла"""
     if os.path.exists(PROGRESS_FILE):
         try:
-            with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                progress = json.load(f)
+            with open(PROGRESS_FILE, 'rb') as f:
+                raw = f.read()
+                progress = orjson.loads(raw) if orjson is not None else json.loads(raw)
                 print(f"Загружен прогресс: offset={progress['offset']}, {len(progress['houses'])} домов уже собрано")
                 return progress
         except Exception as e:
@@ -66,22 +149,43 @@ def load_progress():
     return {'offset': 0, 'houses': []}
 
 
-def save_progress(offset, houses):
-    """Сохраняет текущий прогресс в файл"""
+def save_progress(offset, houses, force=False):
+    """
+    Сохраняет текущий прогресс в файл не чаще раза в PROGRESS_SAVE_INTERVAL секунд (force — сохранить сразу).
+    Файл пишется во временный и подменяется через os.replace, поэтому при падении не остается обрезанным.
+    """
+    global _last_progress_save
+    now = time.monotonic()
+    if not force and now - _last_progress_save < PROGRESS_SAVE_INTERVAL:
+        return
     try:
         progress = {'offset': offset, 'houses': houses}
-        with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(progress, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            data = orjson.dumps(progress, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            data = json.dumps(progress, ensure_ascii=False).encode('utf-8')
+        tmp_file = PROGRESS_FILE.with_suffix('.tmp')
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, PROGRESS_FILE)
+        _last_progress_save = now
         print(f"Прогресс сохранен: offset={offset}, всего домов: {len(houses)}")
     except Exception as e:
         print(f"Ошибка при сохранении прогресса: {e}")
 
 
-async def fetch_all_houses():
+async def fetch_all_houses(on_batch=None):
+    """
+    Собирает все дома через API.
+    on_batch — необязательный колбэк: получает каждую новую пачку домов
+    (и дома из сохраненного прогресса), чтобы следующий этап мог начать работу сразу.
+    """
     # Загружаем сохраненный прогресс
     progress = load_progress()
     houses = progress['houses']
     start_offset = progress['offset']
+    if on_batch and houses:
+        on_batch(list(houses))
 
     retry_count = 0
 
@@ -89,6 +193,7 @@ async def fetch_all_houses():
         print(f"\n🔄 Попытка {retry_count + 1} из {MAX_RETRIES}")
 
         browser = None
+        api = {'session': None, 'proxy': None}
         try:
             # Используем функцию из open_browser.py для создания браузера и страницы
             # (прокси настроено внутри open_browser.py)
@@ -160,52 +265,87 @@ async def fetch_all_houses():
                     await browser.close()
                 continue
 
+            # API запрашиваем напрямую с cookies браузера; при отказе переходим на fetch внутри страницы
+            api['proxy'] = getattr(browser, 'proxy_server', None)
+            try:
+                api['session'] = await create_api_session(page1)
+            except Exception as e:
+                print(f"Не удалось подготовить прямые запросы к API, используем браузер: {e}")
+
             offset = start_offset  # Начинаем с сохраненного offset
             limit = int(PARAMS['limit'])  # Преобразуем строку в число
             page_count = 0
             api_errors = 0
             max_api_errors = 3  # Максимальное количество ошибок API подряд
+            total = None  # Общее число домов становится известно из первого ответа API
 
             while True:
-                params = PARAMS.copy()
-                params['offset'] = offset
-                try:
-                    data = await fetch_api_in_browser(page1, params)
+                # Пока общее число неизвестно, берем одну страницу; дальше — окно из нескольких страниц сразу.
+                # Результаты окна разбираются по порядку, поэтому прогресс (offset) всегда непрерывный
+                if total is None:
+                    offsets = [offset]
+                else:
+                    offsets = list(range(offset, min(total, offset + limit * API_CONCURRENCY), limit)) or [offset]
+
+                results = await asyncio.gather(
+                    *(fetch_api_page(api, page1, {**PARAMS, 'offset': page_offset}) for page_offset in offsets),
+                    return_exceptions=True
+                )
+
+                finished = False
+                failed = False
+                for page_offset, data in zip(offsets, results):
+                    if isinstance(data, BaseException):
+                        api_errors += 1
+                        print(f"Ошибка при запросе API на offset={page_offset} (попытка {api_errors}/{max_api_errors}): {data}")
+                        failed = True
+                        break
                     api_errors = 0  # Сбрасываем счетчик ошибок при успешном запросе
-                except Exception as e:
-                    api_errors += 1
-                    print(f"Ошибка при запросе API (попытка {api_errors}/{max_api_errors}): {e}")
 
-                    if api_errors >= max_api_errors:
-                        print(
-                            f"Достигнуто максимальное количество ошибок API подряд ({max_api_errors}). Сохраняем прогресс и выходим.")
+                    if not data:
+                        print(f"Ошибка или пустой ответ на offset={page_offset}")
+                        finished = True
                         break
-                    else:
-                        # Небольшая пауза перед повторной попыткой
-                        await asyncio.sleep(random.uniform(2, 5))
-                        continue
 
-                if not data:
-                    print(f"Ошибка или пустой ответ на offset={offset}")
-                    break
+                    if total is None:
+                        total = get_total_count(data)
 
-                batch = data.get('data', {}).get('list', []) or data.get('houses', [])
-                if not batch:
-                    break
+                    batch = data.get('data', {}).get('list', []) or data.get('houses', [])
+                    if not batch:
+                        finished = True
+                        break
 
-                for house in batch:
                     # Сохраняем все данные дома, не фильтруем по полям
-                    houses.append(house)
+                    houses.extend(batch)
 
-                print(f"Fetched {len(batch)} houses (offset={offset})")
-                page_count += 1
+                    print(f"Fetched {len(batch)} houses (offset={page_offset})")
+                    page_count += 1
+                    if on_batch:
+                        on_batch(batch)
 
-                # Сохраняем прогресс после каждой пачки данных
-                save_progress(offset + limit, houses)
+                    # Сохраняем прогресс после каждой пачки данных
+                    offset = page_offset + limit
+                    save_progress(offset, houses)
+
+                if finished:
+                    break
+                if failed:
+                    if api_errors >= max_api_errors:
+                        print(
+                            f"Достигнуто максимальное количество ошибок API подряд ({max_api_errors}). Сохраняем прогресс и выходим.")
+                        break
+                    # Повторяем только с неудачной страницы, с растущей паузой
+                    await asyncio.sleep(retry_backoff_delay(api_errors))
+                    continue
 
-                offset += limit
                 await asyncio.sleep(random.uniform(0.5, 1.5))  # Случайная пауза между запросами
 
+            # Прогресс мог не записаться из-за ограничения частоты — сохраняем последнее состояние
+            if page_count:
+                save_progress(offset, houses, force=True)
+
+            if api['session'] is not None:
+                await api['session'].close()
             if browser:
                 await browser.close()
 
@@ -218,6 +358,8 @@ async def fetch_all_houses():
                 print("🔌 Обнаружена ошибка прокси! Перезапускаем с новым прокси...")
                 await asyncio.sleep(2)
 
+            if api['session'] is not None and not api['session'].closed:
+                await api['session'].close()
             if browser:
                 try:
                     await browser.close()
@@ -232,7 +374,8 @@ async def fetch_all_houses():
         else:
             retry_count += 1
             if retry_count < MAX_RETRIES:
-                delay = RETRY_DELAY + (retry_count - 1) * RETRY_DELAY_INCREMENT
+                # Экспоненциальная задержка со случайным разбросом, чтобы перезапуски не шли в такт
+                delay = int(min(RETRY_DELAY_MAX, RETRY_DELAY * 2 ** (retry_count - 1)) * random.uniform(0.5, 1.0))
                 print(f"❌ Не удалось получить данные. Ожидание {delay} секунд перед следующей попыткой...")
                 print(f"⏰ Следующая попытка через {delay // 60} минут {delay % 60} секунд")
                 await asyncio.sleep(delay)
@@ -243,37 +386,26 @@ async def fetch_all_houses():
 
 
 def save_houses_to_json(houses, filename):
-    """Сохраняет данные домов в JSON файл"""
+    """
+    Дописывает данные домов в NDJSON файл (одна запись на строку).
+    Существующий файл не читается и не перезаписывается — запись только в конец.
+    """
     try:
-        # Если файл уже существует, загружаем существующие данные
-        existing_houses = []
-        if os.path.exists(filename):
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                    if isinstance(existing_data, list):
-                        existing_houses = existing_data
-                    else:
-                        existing_houses = [existing_data]
-            except Exception as e:
-                print(f"Ошибка при чтении существующего файла {filename}: {e}")
-                existing_houses = []
-
-        # Объединяем существующие данные с новыми
-        all_houses = existing_houses + houses
-
-        # Сохраняем все данные в JSON файл
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(all_houses, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            lines = (orjson.dumps(house, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE) for house in houses)
+        else:
+            lines = ((json.dumps(house, ensure_ascii=False) + '\n').encode('utf-8') for house in houses)
+        with open(filename, 'ab') as f:
+            f.writelines(lines)
 
-        print(f"Добавлено {len(houses)} домов в {filename}. Всего в файле: {len(all_houses)} записей")
+        print(f"Добавлено {len(houses)} домов в {filename}")
 
     except Exception as e:
         print(f"Ошибка при сохранении в JSON файл {filename}: {e}")
 
 
-async def main_async():
-    houses = await fetch_all_houses()
+async def main_async(on_batch=None):
+    houses = await fetch_all_houses(on_batch)
     save_houses_to_json(houses, JSON_OUTPUT_FILE)
 
     # После успешного сохранения в JSON, можно удалить файл прогресса
@@ -286,7 +418,9 @@ async def main_async():
 
 
 def main():
-    asyncio.get_event_loop().run_until_complete(main_async())
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(main_async())
 
 
 if __name__ == '__main__':
@@ -1,12 +1,16 @@
 import asyncio
+import concurrent.futures
+import multiprocessing
 import time
 import json
 import random
 import os
+import re
 import sys
 import logging
 from io import BytesIO
 from pathlib import Path
+from urllib.parse import urlencode
 from browser_manager import setup_stealth_browser
 from db_config import get_collection, upsert_object_smart, check_duplicate_by_name
 import aiohttp
@@ -14,28 +18,180 @@ from resize_img import ImageProcessor
 from s3_service import S3Service
 from watermark_on_save import upload_with_watermark
 
+try:
+    import aiodns  # noqa: F401  (нужен для aiohttp.AsyncResolver)
+except ImportError:
+    aiodns = None  # Без aiodns используется стандартный резолвер aiohttp (getaddrinfo в потоке)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Без orjson прогресс и ошибочные объекты пишутся стандартным json
+
 # Директория текущего скрипта
 PROJECT_ROOT = Path(__file__).resolve().parent
 
 # Файлы для работы
-INPUT_JSON = PROJECT_ROOT / 'domrf_houses.json'
+INPUT_JSON = PROJECT_ROOT / 'domrf_houses.ndjson'
 PROGRESS_FILE = PROJECT_ROOT / 'object_details_progress.json'
+PROCESSED_LOG_FILE = PROJECT_ROOT / 'object_details_processed.ndjson'  # id обработанных и ошибочных объектов после последнего снимка
 ERROR_OBJECTS_FILE = PROJECT_ROOT / 'error_objects.json'
-UPLOADS_DIR = PROJECT_ROOT / 'uploads'
+
+# Признаки ошибки прокси/соединения в тексте исключения (один проход regex вместо поиска подстрок по списку)
+_CONNECTION_ERROR_RE = re.compile(
+    r"ERR_PROXY_CONNECTION_FAILED|ERR_CONNECTION_(?:CLOSED|REFUSED|RESET|ABORTED)|PROXY|CONNECTION_CLOSED"
+)
+# При загрузке страницы объекта сетевыми считаются также таймауты и ошибки навигации
+_PAGE_NETWORK_ERROR_RE = re.compile(
+    r"ERR_PROXY_CONNECTION_FAILED|ERR_CONNECTION_(?:CLOSED|REFUSED|RESET|ABORTED)|ERR_TUNNEL_CONNECTION_FAILED"
+    r"|ERR_EMPTY_RESPONSE|net::ERR_|PROXY|CONNECTION_CLOSED|timeout|Navigation"
+)
 
 # Настройки повторных попыток
 MAX_RETRIES = 3
 RETRY_DELAY = 5
+
+# Полный снимок прогресса пишется раз в N обработанных объектов, между снимками id дописываются в лог
+PROGRESS_SNAPSHOT_INTERVAL = 500
+_ids_since_snapshot = 0
+# Ошибочные id, уже записанные в снимок или лог
+_logged_failed_ids = set()
+
+PHOTO_CONCURRENCY = int(os.getenv("PHOTO_CONCURRENCY", "16"))  # сколько фото скачивать/загружать одновременно
+RESIZE_WORKERS = int(os.getenv("RESIZE_WORKERS", str(os.cpu_count() or 1)))  # процессов для сжатия фото
+FLATS_CONCURRENCY = int(os.getenv("DOMRF_FLATS_CONCURRENCY", "2"))  # сколько типов квартир запрашивать одновременно
+MAX_PHOTO_BYTES = 10 * 1024 * 1024  # фото больше этого размера не скачиваем
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 image_processor = ImageProcessor(logger, max_size=(800, 600), max_kb=150)
 
+# Одна HTTP-сессия и один клиент S3 на весь запуск: keep-alive соединения и botocore-клиент переиспользуются
+_http_session = None
+_s3_service = None
+# Пул процессов для PIL: сжатие фото не блокирует цикл событий и идет на всех ядрах
+_resize_pool = None
+# Пул потоков для водяного знака и синхронной загрузки в S3 (boto3)
+_upload_pool = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Возвращает общую HTTP-сессию для скачивания фото (создается при первом вызове)."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        # Асинхронный DNS (c-ares) без потоков + кэш DNS на 5 минут
+        resolver = aiohttp.AsyncResolver() if aiodns is not None else None
+        connector = aiohttp.TCPConnector(resolver=resolver, use_dns_cache=True, ttl_dns_cache=300,
+                                         limit=max(32, PHOTO_CONCURRENCY), limit_per_host=PHOTO_CONCURRENCY,
+                                         keepalive_timeout=30)
+        _http_session = aiohttp.ClientSession(connector=connector)
+    return _http_session
+
+
+def get_s3_service() -> S3Service:
+    """Возвращает общий S3Service (создается при первом вызове)."""
+    global _s3_service
+    if _s3_service is None:
+        _s3_service = S3Service()
+    return _s3_service
+
+
+def get_resize_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Возвращает пул процессов для сжатия фото (создается при первом вызове).
+    Процессы запускаются через spawn: к этому моменту уже работают потоки загрузки и botocore,
+    а fork с живыми потоками может унаследовать захваченные ими блокировки и зависнуть.
+    """
+    global _resize_pool
+    if _resize_pool is None:
+        _resize_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=RESIZE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _resize_pool
+
+
+def shutdown_resize_pool() -> None:
+    """Останавливает пул процессов сжатия фото в конце работы."""
+    global _resize_pool
+    if _resize_pool is not None:
+        _resize_pool.shutdown()
+        _resize_pool = None
+
+
+def get_upload_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Возвращает пул потоков для наложения водяного знака и загрузки в S3 (создается при первом вызове).
+    boto3 синхронный, поэтому загрузки идут в потоках и не блокируют цикл событий.
+    """
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = concurrent.futures.ThreadPoolExecutor(max_workers=PHOTO_CONCURRENCY, thread_name_prefix="s3-upload")
+    return _upload_pool
+
+
+def shutdown_upload_pool() -> None:
+    """Останавливает пул потоков загрузки в S3 в конце работы."""
+    global _upload_pool
+    if _upload_pool is not None:
+        _upload_pool.shutdown()
+        _upload_pool = None
+
+
+def resize_image_bytes(image_bytes: bytes) -> bytes:
+    """
+    Сжимает фото и обновляет метаданные. Выполняется в процессе пула,
+    поэтому принимает и возвращает bytes (их дешево передавать между процессами).
+    """
+    return image_processor.process(BytesIO(image_bytes)).getvalue()
+
+
+# Маркеры SOF (кадр JPEG), в которых записаны размеры; C4/C8/CC — не кадры
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(image_bytes: bytes):
+    """
+    Возвращает (ширина, высота) JPEG по заголовку без декодирования
+    или None, если это не JPEG или заголовок не разобран.
+    """
+    if image_bytes[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    length = len(image_bytes)
+    while pos + 4 <= length:
+        if image_bytes[pos] != 0xFF:
+            return None
+        marker = image_bytes[pos + 1]
+        if marker == 0xFF:  # заполняющий байт
+            pos += 1
+            continue
+        segment_length = int.from_bytes(image_bytes[pos + 2:pos + 4], 'big')
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > length:
+                return None
+            height = int.from_bytes(image_bytes[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(image_bytes[pos + 7:pos + 9], 'big')
+            return width, height
+        pos += 2 + segment_length
+    return None
+
 
-def create_object_directory(obj_id: str) -> Path:
-    base_dir = UPLOADS_DIR / 'objects' / str(obj_id)
-    (base_dir / 'gallery').mkdir(parents=True, exist_ok=True)
-    (base_dir / 'construction').mkdir(parents=True, exist_ok=True)
-    return base_dir
+def needs_resize(image_bytes: bytes) -> bool:
+    """Нужно ли сжимать фото: небольшие JPEG в пределах max_size/max_kb пропускаем без перекодирования."""
+    if len(image_bytes) > image_processor.max_kb * 1024:
+        return True
+    size = jpeg_size(image_bytes)
+    if size is None:
+        return True
+    max_width, max_height = image_processor.max_size
+    return not (0 < size[0] <= max_width and 0 < size[1] <= max_height)
+
+
+async def close_http_session() -> None:
+    """Закрывает общую HTTP-сессию в конце работы."""
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
 
 
 async def download_and_process_image(session: aiohttp.ClientSession, image_url: str, s3_key: str, s3: S3Service) -> str:
@@ -45,45 +201,85 @@ async def download_and_process_image(session: aiohttp.ClientSession, image_url:
             if response.status != 200:
                 logger.warning(f"HTTP {response.status} для {image_url}")
                 return None
+            # Страницы ошибок/капчи вместо фото не читаем и не отдаем в PIL
+            if not response.content_type.startswith('image/'):
+                logger.warning(f"Не изображение ({response.content_type}) для {image_url}")
+                return None
+            if response.content_length is not None and response.content_length > MAX_PHOTO_BYTES:
+                logger.warning(f"Слишком большое фото ({response.content_length} байт) для {image_url}")
+                return None
+            # Читаем целиком в bytes: в пул процессов передаются именно bytes,
+            # а BytesIO поверх bytes в процессе сжатия не копирует буфер
             image_bytes = await response.read()
-            processed = image_processor.process(BytesIO(image_bytes))
-            processed.seek(0)
-            data = processed.read()
-            # Загружаем в S3 c добавлением водяного знака
-            return upload_with_watermark(s3, data, s3_key)
+        # Соединение уже вернулось в пул; сжатие идет в отдельном процессе.
+        # Небольшие JPEG сразу идут на водяной знак: он все равно перекодирует фото
+        # (и не сохраняет EXIF), так что повторное сжатие ничего бы не дало
+        loop = asyncio.get_running_loop()
+        if needs_resize(image_bytes):
+            data = await loop.run_in_executor(get_resize_pool(), resize_image_bytes, image_bytes)
+        else:
+            data = image_bytes
+        # Загружаем в S3 c добавлением водяного знака (в потоке, чтобы не блокировать цикл событий)
+        return await loop.run_in_executor(get_upload_pool(), upload_with_watermark, s3, data, s3_key)
     except Exception as e:
         logger.error(f"Ошибка скачивания/обработки {image_url}: {e}")
         return None
 
 
-async def process_photo_list(photo_urls, s3_key_prefix: str, prefix: str, limit: int = None):
-    """Загружает список фото в S3. Возвращает список публичных URL."""
+async def process_photo_list(photo_urls, s3_key_prefix: str, prefix: str, limit: int = None,
+                             concurrency: int = PHOTO_CONCURRENCY, sem: asyncio.Semaphore = None):
+    """
+    Загружает список фото в S3 (не больше concurrency одновременно). Возвращает список публичных URL.
+    Если передан sem, ограничение общее с другими списками, загружаемыми параллельно.
+    """
+    # Убираем повторы (с сохранением порядка), пустые и data:-ссылки до запуска скачиваний,
+    # чтобы лимит считался по уникальным фото
+    photo_urls = list(dict.fromkeys(
+        url for url in photo_urls or ()
+        if isinstance(url, str) and url and not url.startswith('data:')
+    ))
     if not photo_urls:
         return []
     if limit is not None:
-        photo_urls = list(photo_urls)[:limit]
+        photo_urls = photo_urls[:limit]
     results = []
-    s3 = S3Service()
-    async with aiohttp.ClientSession() as session:
-        sem = asyncio.Semaphore(5)
-        async def work(url, idx):
-            async with sem:
-                s3_key = f"{s3_key_prefix}/{prefix}_{idx + 1}.jpg"
-                return await download_and_process_image(session, url, s3_key, s3)
-        tasks = [work(u, i) for i, u in enumerate(photo_urls)]
-        saved = await asyncio.gather(*tasks, return_exceptions=True)
-        for p in saved:
-            if isinstance(p, str) and p:
-                results.append(p)
+    s3 = get_s3_service()
+    session = await get_http_session()
+    if sem is None:
+        sem = asyncio.Semaphore(concurrency)
+    async def work(url, idx):
+        async with sem:
+            s3_key = f"{s3_key_prefix}/{prefix}_{idx + 1}.jpg"
+            return await download_and_process_image(session, url, s3_key, s3)
+    tasks = [work(u, i) for i, u in enumerate(photo_urls)]
+    saved = await asyncio.gather(*tasks, return_exceptions=True)
+    for p in saved:
+        if isinstance(p, str) and p:
+            results.append(p)
     return results
 
 
+async def process_photo_lists(jobs, concurrency: int = PHOTO_CONCURRENCY):
+    """
+    Загружает несколько списков фото (галерея, этапы строительства) одновременно
+    с общим ограничением concurrency. jobs — список (photo_urls, s3_key_prefix, limit).
+    Возвращает списки публичных URL в порядке jobs.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(
+        process_photo_list(photo_urls, s3_key_prefix, 'photo', limit=limit, sem=sem)
+        for photo_urls, s3_key_prefix, limit in jobs
+    ))
 
-async def check_ban_status(page):
-    """Проверяет, заблокирован ли доступ к сайту"""
-    return await page.evaluate('''() => {
-        const bodyText = document.body.innerText.toLowerCase();
-        const banMessages = [
+
+
+# JS-функция проверки бана: используется отдельно и внутри запросов к API,
+# чтобы не делать лишний page.evaluate до и после каждого запроса.
+# Регулярное выражение компилируется один раз на документ (window.__BAN_RE).
+# innerText оставлен намеренно: textContent включает текст <script>, где
+# "captcha"/"cloudflare" встречаются и на нормальных страницах.
+_IS_BANNED_JS = '''() => {
+        const banRe = window.__BAN_RE || (window.__BAN_RE = new RegExp([
             "нам очень жаль, но запросы с вашего устройства похожи на автоматические",
             "подтвердите, что вы не робот — потяните ползунок",
             "потяните ползунок, чтобы развернуть картинку",
@@ -94,16 +290,155 @@ async def check_ban_status(page):
             "cloudflare",
             "blocked",
             "captcha"
-        ];
-        
-        return banMessages.some(msg => bodyText.includes(msg));
-    }''')
+        ].join("|"), "i"));
+        return banRe.test(document.body ? document.body.innerText : "");
+    }'''
 
 
-async def extract_gallery_images(page):
-    """Собирает ссылки всех фото ЖК из верхней галереи."""
-    try:
-        images = await page.evaluate('''() => {
+# Страница объекта готова, когда отрисована карточка ЖК или показан бан
+_OBJECT_PAGE_READY_JS = (
+    '''() => !!document.querySelector('[class*="NewBuildingCard"], [class*="ConstructionProgressWrapper"]') || ('''
+    + _IS_BANNED_JS
+    + ''')()'''
+)
+
+
+async def check_ban_status(page):
+    """Проверяет, заблокирован ли доступ к сайту"""
+    return await page.evaluate(_IS_BANNED_JS)
+
+
+# Данные страницы объекта (характеристики, галерея, ход строительства) собираются
+# одним page.evaluate, чтобы не гонять три запроса через CDP на каждый объект
+_CHARACTERISTICS_JS = '''() => {
+            const result = {
+                'main_characteristics': {},
+                'yard_improvement': {},
+                'parking_space': {},
+                'accessible_environment': {},
+                'elevators': {},
+                'energy_efficiency': '',
+                'contractors': ''
+            };
+
+            // Ищет значение в следующих за лейблом соседних элементах
+            function findValueNextTo(span, labelText) {
+                const parent = span.parentElement;
+                if (!parent) return null;
+                const siblings = Array.from(parent.children);
+                const currentIndex = siblings.indexOf(span);
+
+                // Ищем следующий элемент с значением
+                for (let i = currentIndex + 1; i < siblings.length; i++) {
+                    const sibling = siblings[i];
+                    const siblingText = sibling.innerText || '';
+
+                    // Пропускаем пустые элементы и элементы с только пробелами
+                    if (siblingText.trim() && siblingText.trim() !== ',') {
+                        // Для числовых полей проверяем, что это число
+                        if (labelText.includes('Количество') || labelText.includes('площадь') || labelText.includes('потолков')) {
+                            if (/^[0-9\\s,.,]+$/.test(siblingText.trim())) {
+                                return siblingText.trim();
+                            }
+                        } else {
+                            // Для текстовых полей берем любое непустое значение
+                            return siblingText.trim();
+                        }
+                    }
+                }
+                return null;
+            }
+
+            // Лейблы по разделам результата
+            const sections = {
+                // Основные характеристики
+                'main_characteristics': [
+                    'Класс недвижимости',
+                    'Материал стен', 
+                    'Тип отделки',
+                    'Свободная планировка',
+                    'Количество этажей',
+                    'Жилая площадь',
+                    'Высота потолков'
+                ],
+                // Благоустройство двора
+                'yard_improvement': [
+                    'Велосипедные дорожки',
+                    'Количество детских площадок',
+                    'Количество спортивных площадок',
+                    'Количество площадок для сбора мусора'
+                ],
+                // Парковочное пространство
+                'parking_space': [
+                    'Количество мест в паркинге',
+                    'Гостевые места на придомовой территории',
+                    'Гостевые места вне придомовой территории'
+                ],
+                // Безбарьерная среда
+                'accessible_environment': [
+                    'Наличие пандуса',
+                    'Наличие понижающих площадок',
+                    'Количество инвалидных подъемников'
+                ],
+                // Лифты
+                'elevators': [
+                    'Количество подъездов',
+                    'Количество пассажирских лифтов',
+                    'Количество грузовых и грузопассажирских лифтов'
+                ]
+            };
+
+            // Один проход по всем span: для каждого лейбла берем первое найденное значение
+            const pending = new Set(Object.values(sections).flat());
+            const found = {};
+            for (const span of document.querySelectorAll('span')) {
+                if (!pending.size) break;
+                const text = span.innerText || '';
+                if (!text) continue;
+                for (const label of pending) {
+                    if (text.includes(label)) {
+                        const value = findValueNextTo(span, label);
+                        if (value) {
+                            found[label] = value;
+                            pending.delete(label);
+                        }
+                    }
+                }
+            }
+
+            for (const [section, fields] of Object.entries(sections)) {
+                for (const field of fields) {
+                    if (found[field]) {
+                        result[section][field] = found[field];
+                    }
+                }
+            }
+
+            // Извлекаем общую информацию
+            try {
+                const pageText = document.body.innerText;
+                
+                // Класс энергоэффективности
+                const energyMatch = pageText.match(/Класс энергоэффективности здания:\\s*([A-Z])/);
+                if (energyMatch) {
+                    result.energy_efficiency = energyMatch[1];
+                }
+                
+                // Генподрядчики
+                const contractorMatch = pageText.match(/Генподрядчики:\\s*([^\\n]+)/);
+                if (contractorMatch) {
+                    result.contractors = contractorMatch[1];
+                }
+            } catch (e) {
+                console.log('Ошибка при извлечении общей информации:', e);
+            }
+            
+
+            return result;
+        }'''
+
+# Ссылки всех фото ЖК из верхней галереи
+_GALLERY_JS = '''() => {
             const urls = new Set();
             try {
                 // Основной контейнер галереи карточки
@@ -127,205 +462,10 @@ async def extract_gallery_images(page):
                 }
             } catch (e) {}
             return Array.from(urls);
-        }''')
-        return images or []
-    except Exception as e:
-        print(f"Ошибка при извлечении галереи: {e}")
-        return []
+        }'''
 
-
-async def fetch_flats_api_in_browser(page, obj_id, flat_type, limit=100, offset=0):
-    """Выполняет API запрос для получения данных о квартирах (таймаут: 15 секунд)"""
-    
-    # Проверяем бан перед каждым API запросом
-    ban_detected = await check_ban_status(page)
-    
-    if ban_detected:
-        print(f"🚫 Обнаружен бан при API запросе квартир! Прерываем запрос.")
-        return "BAN_DETECTED"
-    
-    api_url = f"https://xn--80az8a.xn--d1aqf.xn--p1ai/portal-kn/api/kn/objects/{obj_id}/flats"
-    params = {
-        'flatGroupType': flat_type,
-        'limit': limit,
-        'offset': offset
-    }
-    
-    query = "&".join(f"{k}={v}" for k, v in params.items())
-    url = f"{api_url}?{query}"
-    
-    js_code = f'''
-        async () => {{
-            try {{
-                // Создаем AbortController для таймаута
-                const controller = new AbortController();
-                const timeoutId = setTimeout(() => controller.abort(), 15000); // 15 секунд
-                
-                const resp = await fetch("{url}", {{
-                    headers: {{
-                        'accept': 'application/json, text/plain, */*',
-                        'authorization': 'Basic MTpxd2U=',
-                        'sec-fetch-dest': 'empty',
-                        'sec-fetch-mode': 'cors',
-                        'sec-fetch-site': 'same-origin'
-                    }},
-                    method: 'GET',
-                    mode: 'cors',
-                    credentials: 'include',
-                    signal: controller.signal
-                }});
-                
-                clearTimeout(timeoutId); // Очищаем таймаут после успешного запроса
-                
-                if (!resp.ok) return null;
-                return await resp.json();
-            }} catch (e) {{
-                if (e.name === 'AbortError') {{
-                    console.log('Таймаут API запроса (15 секунд)');
-                }} else {{
-                    console.log('Ошибка при запросе API квартир:', e);
-                }}
-                return null;
-            }}
-        }}
-    '''
-    return await page.evaluate(js_code)
-
-
-async def get_all_flats_for_type(page, obj_id, flat_type):
-    """Получает все квартиры определенного типа с пагинацией"""
-    all_flats = []
-    offset = 0
-    limit = 100
-    page_num = 1
-    consecutive_errors = 0  # Счетчик последовательных ошибок
-    max_consecutive_errors = 3  # Максимальное количество последовательных ошибок
-
-    while True:
-        try:
-            # Проверяем бан перед каждым API запросом
-            ban_detected = await check_ban_status(page)
-            
-            if ban_detected:
-                print(f"  🚫 Обнаружен бан при получении квартир типа {flat_type} (страница {page_num}). Прерываем обработку.")
-                return {
-                    'flats': [],
-                    'total_count': 0,
-                    'consecutive_errors': 999  # Специальный код для бана
-                }
-            
-            print(f"  Получаем страницу {page_num} для {flat_type} (offset={offset}, limit={limit})")
-            flats_data = await fetch_flats_api_in_browser(page, obj_id, flat_type, limit, offset)
-            
-            # Проверяем бан после API запроса (на случай если бан появился в результате запроса)
-            ban_detected_after = await check_ban_status(page)
-            if ban_detected_after:
-                print(f"  🚫 Обнаружен бан после API запроса квартир типа {flat_type} (страница {page_num}). Прерываем обработку.")
-                return {
-                    'flats': [],
-                    'total_count': 0,
-                    'consecutive_errors': 999  # Специальный код для бана
-                }
-            
-            # Проверяем, обнаружен ли бан
-            if flats_data == "BAN_DETECTED":
-                print(f"  🚫 Обнаружен бан при получении квартир типа {flat_type}. Прерываем обработку.")
-                return {
-                    'flats': [],
-                    'total_count': 0,
-                    'consecutive_errors': 999  # Специальный код для бана
-                }
-            
-            if not flats_data:
-                consecutive_errors += 1
-                print(f"  ❌ Ошибка или пустой ответ для {flat_type} на offset={offset} (ошибка {consecutive_errors}/{max_consecutive_errors})")
-
-                if consecutive_errors >= max_consecutive_errors:
-                    print(f"  🛑 Превышено максимальное количество ошибок ({max_consecutive_errors}) для {flat_type}. Переходим к следующему типу.")
-                    break
-                else:
-                    # Пробуем увеличить offset и повторить запрос
-                    offset += limit
-                    page_num += 1
-                    await asyncio.sleep(0.5)  # Увеличенная задержка при ошибке
-                    continue
-
-            # Если получили данные, сбрасываем счетчик ошибок
-            consecutive_errors = 0
-
-            # Проверяем структуру ответа
-            if 'data' in flats_data and isinstance(flats_data['data'], list):
-                flats = flats_data['data']
-                if not flats:
-                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
-                    break
-
-                all_flats.extend(flats)
-                print(f"  📄 Получено {len(flats)} квартир, всего: {len(all_flats)}")
-
-                # Если получили меньше запрошенного количества, значит это последняя страница
-                if len(flats) < limit:
-                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
-                    break
-
-            elif isinstance(flats_data, list):
-                # Если ответ - это просто массив квартир
-                flats = flats_data
-                if not flats:
-                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
-                    break
-
-                all_flats.extend(flats)
-                print(f"  📄 Получено {len(flats)} квартир, всего: {len(all_flats)}")
-
-                # Если получили меньше запрошенного количества, значит это последняя страница
-                if len(flats) < limit:
-                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
-                    break
-            else:
-                consecutive_errors += 1
-                print(f"  ❌ Неожиданная структура ответа для {flat_type} (ошибка {consecutive_errors}/{max_consecutive_errors})")
-
-                if consecutive_errors >= max_consecutive_errors:
-                    print(f"  🛑 Превышено максимальное количество ошибок ({max_consecutive_errors}) для {flat_type}. Переходим к следующему типу.")
-                    break
-                else:
-                    offset += limit
-                    page_num += 1
-                    await asyncio.sleep(0.5)
-                    continue
-
-            # Переходим к следующей странице
-            offset += limit
-            page_num += 1
-
-            # Небольшая задержка между запросами
-            await asyncio.sleep(0.2)
-
-        except Exception as e:
-            consecutive_errors += 1
-            print(f"  ❌ Ошибка при получении страницы {page_num} для {flat_type}: {e} (ошибка {consecutive_errors}/{max_consecutive_errors})")
-
-            if consecutive_errors >= max_consecutive_errors:
-                print(f"  🛑 Превышено максимальное количество ошибок ({max_consecutive_errors}) для {flat_type}. Переходим к следующему типу.")
-                break
-            else:
-                # Пробуем продолжить с увеличенным offset
-                offset += limit
-                page_num += 1
-                await asyncio.sleep(0.5)  # Увеличенная задержка при ошибке
-
-    return {
-        'flats': all_flats,
-        'total_count': len(all_flats),
-        'consecutive_errors': consecutive_errors
-    }
-
-
-async def extract_construction_progress(page):
-    """Извлекает данные о ходе строительства и фотографиях"""
-    try:
-        construction_data = await page.evaluate('''() => {
+# Данные о ходе строительства и фотографиях
+_CONSTRUCTION_JS = '''() => {
             const result = {
                 'construction_stages': [],
                 'photos': []
@@ -422,9 +562,12 @@ async def extract_construction_progress(page):
                     // Ищем все фотографии в секции строительства и распределяем по этапам
                     const allImages = constructionSection.querySelectorAll('img[src]');
                     const generalPhotos = [];
+                    // Set вместо result.photos.includes: проверка за O(1) на каждое фото
+                    const seenPhotos = new Set(result.photos);
                     allImages.forEach(img => {
                         const src = img.src;
-                        if (src && !src.includes('data:') && !result.photos.includes(src)) {
+                        if (src && !src.includes('data:') && !seenPhotos.has(src)) {
+                            seenPhotos.add(src);
                             generalPhotos.push(src);
                         }
                     });
@@ -471,34 +614,295 @@ async def extract_construction_progress(page):
             }
             
             return result;
-        }''')
+        }'''
+
+_OBJECT_PAGE_DATA_JS = (
+    '''() => ({
+        characteristics: (''' + _CHARACTERISTICS_JS + ''')(),
+        gallery: (''' + _GALLERY_JS + ''')(),
+        construction: (''' + _CONSTRUCTION_JS + ''')()
+    })'''
+)
+
+# Галерея и ход строительства дорисовываются лениво, уже после карточки ЖК
+LAZY_SECTIONS_TIMEOUT_MS = 5000
+_LAZY_SECTIONS_READY_JS = '''() => !!document.querySelector('[class*="ConstructionProgressWrapper"]')
+    && !!document.querySelector('[class*="NewBuildingCard__GalleryContainer"], [class*="GalleryWrapper"], [data-testid*="gallery"], .swiper')'''
+_LAZY_SECTIONS_JS = (
+    '''() => ({
+        gallery: (''' + _GALLERY_JS + ''')(),
+        construction: (''' + _CONSTRUCTION_JS + ''')()
+    })'''
+)
+
+
+FLATS_API_URL = "https://xn--80az8a.xn--d1aqf.xn--p1ai/portal-kn/api/kn/objects/{obj_id}/flats"
+
+# Запрос квартир выполняется в браузере вместе с проверкой бана до и после запроса
+_FETCH_FLATS_JS = '''
+    async (url) => {
+        const isBanned = ''' + _IS_BANNED_JS + ''';
+        if (isBanned()) return "BAN_DETECTED";
+        try {
+            // Создаем AbortController для таймаута
+            const controller = new AbortController();
+            const timeoutId = setTimeout(() => controller.abort(), 15000); // 15 секунд
+            
+            const resp = await fetch(url, {
+                headers: {
+                    'accept': 'application/json, text/plain, */*',
+                    'authorization': 'Basic MTpxd2U=',
+                    'sec-fetch-dest': 'empty',
+                    'sec-fetch-mode': 'cors',
+                    'sec-fetch-site': 'same-origin'
+                },
+                method: 'GET',
+                mode: 'cors',
+                credentials: 'include',
+                signal: controller.signal
+            });
+            
+            clearTimeout(timeoutId); // Очищаем таймаут после успешного запроса
+            
+            // Проверяем бан после запроса (на случай если бан появился в результате запроса)
+            if (isBanned()) return "BAN_DETECTED";
+            if (!resp.ok) return null;
+            return await resp.json();
+        } catch (e) {
+            if (e.name === 'AbortError') {
+                console.log('Таймаут API запроса (15 секунд)');
+            } else {
+                console.log('Ошибка при запросе API квартир:', e);
+            }
+            return null;
+        }
+    }
+'''
 
-        return construction_data
 
-    except Exception as e:
-        print(f"Ошибка при извлечении данных о ходе строительства: {e}")
-        return {
-            'construction_stages': [],
-            'photos': []
-        }
+async def fetch_flats_api_in_browser(page, obj_id, flat_type, limit=100, offset=0):
+    """
+    Выполняет API запрос для получения данных о квартирах (таймаут: 15 секунд).
+    Возвращает "BAN_DETECTED", если страница показывает бан до или после запроса.
+    """
+    params = {
+        'flatGroupType': flat_type,
+        'limit': limit,
+        'offset': offset
+    }
+    url = f"{FLATS_API_URL.format(obj_id=obj_id)}?{urlencode(params)}"
+
+    result = await page.evaluate(_FETCH_FLATS_JS, url)
+    if result == "BAN_DETECTED":
+        print(f"🚫 Обнаружен бан при API запросе квартир! Прерываем запрос.")
+    return result
+
+
+async def get_all_flats_for_type(page, obj_id, flat_type):
+    """Получает все квартиры определенного типа с пагинацией"""
+    all_flats = []
+    offset = 0
+    limit = 100
+    page_num = 1
+    consecutive_errors = 0  # Счетчик последовательных ошибок
+    max_consecutive_errors = 3  # Максимальное количество последовательных ошибок
+
+    while True:
+        try:
+            print(f"  Получаем страницу {page_num} для {flat_type} (offset={offset}, limit={limit})")
+            # Бан проверяется в том же evaluate, что и запрос (до и после него)
+            flats_data = await fetch_flats_api_in_browser(page, obj_id, flat_type, limit, offset)
+            
+            # Проверяем, обнаружен ли бан
+            if flats_data == "BAN_DETECTED":
+                print(f"  🚫 Обнаружен бан при получении квартир типа {flat_type} (страница {page_num}). Прерываем обработку.")
+                return {
+                    'flats': [],
+                    'total_count': 0,
+                    'consecutive_errors': 999  # Специальный код для бана
+                }
+            
+            if not flats_data:
+                consecutive_errors += 1
+                print(f"  ❌ Ошибка или пустой ответ для {flat_type} на offset={offset} (ошибка {consecutive_errors}/{max_consecutive_errors})")
+
+                if consecutive_errors >= max_consecutive_errors:
+                    print(f"  🛑 Превышено максимальное количество ошибок ({max_consecutive_errors}) для {flat_type}. Переходим к следующему типу.")
+                    break
+                else:
+                    # Пробуем увеличить offset и повторить запрос
+                    offset += limit
+                    page_num += 1
+                    await asyncio.sleep(0.5)  # Увеличенная задержка при ошибке
+                    continue
+
+            # Если получили данные, сбрасываем счетчик ошибок
+            consecutive_errors = 0
+
+            # Проверяем структуру ответа
+            if 'data' in flats_data and isinstance(flats_data['data'], list):
+                flats = flats_data['data']
+                if not flats:
+                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
+                    break
+
+                all_flats.extend(flats)
+                print(f"  📄 Получено {len(flats)} квартир, всего: {len(all_flats)}")
+
+                # Если получили меньше запрошенного количества, значит это последняя страница
+                if len(flats) < limit:
+                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
+                    break
+
+            elif isinstance(flats_data, list):
+                # Если ответ - это просто массив квартир
+                flats = flats_data
+                if not flats:
+                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
+                    break
+
+                all_flats.extend(flats)
+                print(f"  📄 Получено {len(flats)} квартир, всего: {len(all_flats)}")
+
+                # Если получили меньше запрошенного количества, значит это последняя страница
+                if len(flats) < limit:
+                    print(f"  ✅ Получены все квартиры типа {flat_type}. Всего: {len(all_flats)}")
+                    break
+            else:
+                consecutive_errors += 1
+                print(f"  ❌ Неожиданная структура ответа для {flat_type} (ошибка {consecutive_errors}/{max_consecutive_errors})")
+
+                if consecutive_errors >= max_consecutive_errors:
+                    print(f"  🛑 Превышено максимальное количество ошибок ({max_consecutive_errors}) для {flat_type}. Переходим к следующему типу.")
+                    break
+                else:
+                    offset += limit
+                    page_num += 1
+                    await asyncio.sleep(0.5)
+                    continue
+
+            # Переходим к следующей странице
+            offset += limit
+            page_num += 1
+
+            # Небольшая задержка между запросами
+            await asyncio.sleep(0.2)
+
+        except Exception as e:
+            consecutive_errors += 1
+            print(f"  ❌ Ошибка при получении страницы {page_num} для {flat_type}: {e} (ошибка {consecutive_errors}/{max_consecutive_errors})")
+
+            if consecutive_errors >= max_consecutive_errors:
+                print(f"  🛑 Превышено максимальное количество ошибок ({max_consecutive_errors}) для {flat_type}. Переходим к следующему типу.")
+                break
+            else:
+                # Пробуем продолжить с увеличенным offset
+                offset += limit
+                page_num += 1
+                await asyncio.sleep(0.5)  # Увеличенная задержка при ошибке
+
+    return {
+        'flats': all_flats,
+        'total_count': len(all_flats),
+        'consecutive_errors': consecutive_errors
+    }
+
+
+def _load_json_file(path):
+    """Читает JSON-файл (через orjson, если доступен)"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _dump_json_file(path, data):
+    """Атомарно записывает данные в JSON-файл с отступами (через orjson, если доступен)"""
+    if orjson is not None:
+        raw = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        raw = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    # Пишем во временный файл и подменяем — при падении не останется недописанного JSON
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+    os.replace(tmp_path, path)
+
+
+def _load_processed_log():
+    """
+    Читает лог прогресса (пропуская недописанные строки).
+    Возвращает (обработанные id, ошибочные id): ошибочные записаны строками {"failed": id}.
+    """
+    ids, failed = [], []
+    if not os.path.exists(PROCESSED_LOG_FILE):
+        return ids, failed
+    with open(PROCESSED_LOG_FILE, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = orjson.loads(line) if orjson is not None else json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict):
+                if 'failed' in entry:
+                    failed.append(entry['failed'])
+            else:
+                ids.append(entry)
+    return ids, failed
+
+
+def _append_log_entries(entries):
+    """Дописывает записи в лог прогресса (одна строка на запись)"""
+    if orjson is not None:
+        data = b''.join(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in entries)
+    else:
+        data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+    with open(PROCESSED_LOG_FILE, 'ab') as f:
+        f.write(data)
 
 
 def load_progress():
-    """Загружает сохраненный прогресс из файла"""
+    """Загружает сохраненный прогресс из файла (id возвращаются множествами)"""
+    global _logged_failed_ids
+    processed_ids, failed_ids = set(), set()
     if os.path.exists(PROGRESS_FILE):
         try:
-            with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                progress = json.load(f)
-                print(f"Загружен прогресс: обработано {len(progress.get('processed_ids', []))} объектов")
-                return progress
+            progress = _load_json_file(PROGRESS_FILE)
+            processed_ids.update(progress.get('processed_ids', []))
+            failed_ids.update(progress.get('failed_ids', []))
         except Exception as e:
             print(f"Ошибка при загрузке прогресса: {e}")
-    return {'processed_ids': [], 'failed_ids': []}
-
-
-def save_progress(processed_ids, failed_ids):
-    """Сохраняет текущий прогресс в файл"""
     try:
+        # Снимок + id, дописанные в лог после него
+        logged_ids, logged_failed = _load_processed_log()
+        processed_ids.update(logged_ids)
+        failed_ids.update(logged_failed)
+    except Exception as e:
+        print(f"Ошибка при загрузке лога прогресса: {e}")
+    _logged_failed_ids = set(failed_ids)
+    if processed_ids or failed_ids:
+        print(f"Загружен прогресс: обработано {len(processed_ids)} объектов")
+    return {'processed_ids': processed_ids, 'failed_ids': failed_ids}
+
+
+def save_progress(processed_ids, failed_ids, obj_id=None):
+    """
+    Сохраняет текущий прогресс.
+    Если передан obj_id, он только дописывается в лог (вместе с новыми ошибочными id),
+    а полный снимок пишется раз в PROGRESS_SNAPSHOT_INTERVAL объектов; без obj_id снимок пишется сразу.
+    """
+    global _ids_since_snapshot, _logged_failed_ids
+    try:
+        if obj_id is not None:
+            new_failed = [failed_id for failed_id in failed_ids if failed_id not in _logged_failed_ids]
+            _append_log_entries([obj_id] + [{'failed': failed_id} for failed_id in new_failed])
+            _logged_failed_ids.update(new_failed)
+            _ids_since_snapshot += 1
+            if _ids_since_snapshot < PROGRESS_SNAPSHOT_INTERVAL:
+                return
+
         # json не умеет сериализовать set — конвертируем в списки
         if isinstance(processed_ids, set):
             processed_ids = list(processed_ids)
@@ -506,8 +910,12 @@ def save_progress(processed_ids, failed_ids):
             failed_ids = list(failed_ids)
 
         progress = {'processed_ids': processed_ids, 'failed_ids': failed_ids}
-        with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(progress, f, ensure_ascii=False, indent=2)
+        _dump_json_file(PROGRESS_FILE, progress)
+        # Всё из лога уже попало в снимок
+        with open(PROCESSED_LOG_FILE, 'wb'):
+            pass
+        _ids_since_snapshot = 0
+        _logged_failed_ids = set(failed_ids)
         print(f"Прогресс сохранен: обработано {len(processed_ids)}, ошибок {len(failed_ids)}")
     except Exception as e:
         print(f"Ошибка при сохранении прогресса: {e}")
@@ -517,10 +925,9 @@ def load_error_objects():
     """Загружает список ошибочных объектов из файла"""
     if os.path.exists(ERROR_OBJECTS_FILE):
         try:
-            with open(ERROR_OBJECTS_FILE, 'r', encoding='utf-8') as f:
-                error_objects = json.load(f)
-                print(f"📋 Загружено {len(error_objects)} ошибочных объектов для повторной обработки")
-                return error_objects
+            error_objects = _load_json_file(ERROR_OBJECTS_FILE)
+            print(f"📋 Загружено {len(error_objects)} ошибочных объектов для повторной обработки")
+            return error_objects
         except Exception as e:
             print(f"Ошибка при загрузке ошибочных объектов: {e}")
     return []
@@ -529,8 +936,7 @@ def load_error_objects():
 def save_error_objects(error_objects):
     """Сохраняет список ошибочных объектов в файл"""
     try:
-        with open(ERROR_OBJECTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(error_objects, f, ensure_ascii=False, indent=2)
+        _dump_json_file(ERROR_OBJECTS_FILE, error_objects)
         print(f"💾 Сохранено {len(error_objects)} ошибочных объектов в файл")
     except Exception as e:
         print(f"Ошибка при сохранении ошибочных объектов: {e}")
@@ -551,6 +957,31 @@ def add_error_object(error_objects, obj, error_reason):
     return error_objects
 
 
+async def reread_lazy_sections(page, gallery_photos_urls, construction_data):
+    """
+    Перечитывает галерею и ход строительства, если при первом чтении (сразу после появления карточки)
+    они оказались пустыми: эти разделы отрисовываются лениво. Их появления ждет не дольше LAZY_SECTIONS_TIMEOUT_MS.
+    """
+    construction_found = bool(construction_data and (construction_data.get('construction_stages') or construction_data.get('photos')))
+    if gallery_photos_urls and construction_found:
+        return gallery_photos_urls, construction_data
+    try:
+        await page.waitForFunction(_LAZY_SECTIONS_READY_JS, {'timeout': LAZY_SECTIONS_TIMEOUT_MS})
+    except Exception:
+        pass
+    try:
+        sections = await page.evaluate(_LAZY_SECTIONS_JS)
+    except Exception as e:
+        print(f"Не удалось перечитать галерею и ход строительства: {e}")
+        return gallery_photos_urls, construction_data
+    if not gallery_photos_urls and sections.get('gallery'):
+        gallery_photos_urls = sections['gallery']
+        print(f"📷 При повторном чтении найдено {len(gallery_photos_urls)} фото галереи")
+    if not construction_found and sections.get('construction'):
+        construction_data = sections['construction']
+    return gallery_photos_urls, construction_data
+
+
 async def extract_object_details(page, obj_id, on_partial=None):
     """Извлекает детальную информацию об объекте со страницы"""
     url = f'https://наш.дом.рф/сервисы/каталог-новостроек/объект/{obj_id}'
@@ -562,7 +993,12 @@ async def extract_object_details(page, obj_id, on_partial=None):
         # Переходим на страницу объекта
         await page.goto(url, timeout=30000)
         print("Страница загружена, ожидаем появления элементов...")
-        await asyncio.sleep(10)
+        # Ждем карточку объекта (или страницу бана) вместо фиксированной паузы
+        try:
+            await page.waitForFunction(_OBJECT_PAGE_READY_JS, {'timeout': 20000})
+        except Exception:
+            print("Карточка объекта не появилась за 20 секунд, продолжаем")
+            await asyncio.sleep(1)
 
         # Проверяем бан сразу после загрузки страницы
         ban_detected = await check_ban_status(page)
@@ -571,178 +1007,9 @@ async def extract_object_details(page, obj_id, on_partial=None):
             print(f"🚫 Обнаружен бан сразу после загрузки страницы объекта {obj_id}! Прерываем обработку.")
             return "BAN_DETECTED"
 
-        # Ждем загрузки основных элементов
-        await asyncio.sleep(5)
-
-        # Проверяем бан/капчу
-        try:
-            ban_detected = await page.evaluate('''() => {
-                const bodyText = document.body.innerText.toLowerCase();
-                const banMessages = [
-                    "нам очень жаль, но запросы с вашего устройства похожи на автоматические",
-                    "запросы похожи на автоматические",
-                    "автоматические запросы",
-                    "доступ ограничен",
-                    "проверка безопасности",
-                    "cloudflare",
-                    "blocked",
-                    "captcha"
-                ];
-                
-                return banMessages.some(msg => bodyText.includes(msg));
-            }''')
-
-            if ban_detected:
-                print("🚫 Обнаружен бан или капча!")
-                return "BAN_DETECTED"
-        except Exception as ban_error:
-            print(f"Ошибка при проверке бана: {ban_error}")
-
-        # Извлекаем основные характеристики через JavaScript
-        characteristics = await page.evaluate('''() => {
-            const result = {
-                'main_characteristics': {},
-                'yard_improvement': {},
-                'parking_space': {},
-                'accessible_environment': {},
-                'elevators': {},
-                'energy_efficiency': '',
-                'contractors': ''
-            };
-
-            // Функция для поиска значения рядом с лейблом
-            function findValueByLabel(labelText, section = 'main_characteristics') {
-                const spans = document.querySelectorAll('span');
-                for (const span of spans) {
-                    const text = span.innerText || '';
-                    if (text.includes(labelText)) {
-                        // Ищем следующий элемент с числом или значением
-                        const parent = span.parentElement;
-                        if (parent) {
-                            const siblings = Array.from(parent.children);
-                            const currentIndex = siblings.indexOf(span);
-
-                            // Ищем следующий элемент с значением
-                            for (let i = currentIndex + 1; i < siblings.length; i++) {
-                                const sibling = siblings[i];
-                                const siblingText = sibling.innerText || '';
-
-                                // Пропускаем пустые элементы и элементы с только пробелами
-                                if (siblingText.trim() && siblingText.trim() !== ',') {
-                                    // Для числовых полей проверяем, что это число
-                                    if (labelText.includes('Количество') || labelText.includes('площадь') || labelText.includes('потолков')) {
-                                        if (/^[0-9\\s,.,]+$/.test(siblingText.trim())) {
-                                            return siblingText.trim();
-                                        }
-                                    } else {
-                                        // Для текстовых полей берем любое непустое значение
-                                        return siblingText.trim();
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-                return null;
-            }
-
-            // Извлекаем основные характеристики
-            const mainFields = [
-                'Класс недвижимости',
-                'Материал стен', 
-                'Тип отделки',
-                'Свободная планировка',
-                'Количество этажей',
-                'Жилая площадь',
-                'Высота потолков'
-            ];
-
-            for (const field of mainFields) {
-                const value = findValueByLabel(field);
-                if (value) {
-                    result.main_characteristics[field] = value;
-                }
-            }
-
-            // Извлекаем благоустройство двора
-            const yardFields = [
-                'Велосипедные дорожки',
-                'Количество детских площадок',
-                'Количество спортивных площадок',
-                'Количество площадок для сбора мусора'
-            ];
-
-            for (const field of yardFields) {
-                const value = findValueByLabel(field);
-                if (value) {
-                    result.yard_improvement[field] = value;
-                }
-            }
-
-            // Извлекаем парковочное пространство
-            const parkingFields = [
-                'Количество мест в паркинге',
-                'Гостевые места на придомовой территории',
-                'Гостевые места вне придомовой территории'
-            ];
-
-            for (const field of parkingFields) {
-                const value = findValueByLabel(field);
-                if (value) {
-                    result.parking_space[field] = value;
-                }
-            }
-
-            // Извлекаем безбарьерную среду
-            const accessibleFields = [
-                'Наличие пандуса',
-                'Наличие понижающих площадок',
-                'Количество инвалидных подъемников'
-            ];
-
-            for (const field of accessibleFields) {
-                const value = findValueByLabel(field);
-                if (value) {
-                    result.accessible_environment[field] = value;
-                }
-            }
-
-            // Извлекаем лифты
-            const elevatorFields = [
-                'Количество подъездов',
-                'Количество пассажирских лифтов',
-                'Количество грузовых и грузопассажирских лифтов'
-            ];
-
-            for (const field of elevatorFields) {
-                const value = findValueByLabel(field);
-                if (value) {
-                    result.elevators[field] = value;
-                }
-            }
-
-            // Извлекаем общую информацию
-            try {
-                const pageText = document.body.innerText;
-                
-                // Класс энергоэффективности
-                const energyMatch = pageText.match(/Класс энергоэффективности здания:\\s*([A-Z])/);
-                if (energyMatch) {
-                    result.energy_efficiency = energyMatch[1];
-                }
-                
-                // Генподрядчики
-                const contractorMatch = pageText.match(/Генподрядчики:\\s*([^\\n]+)/);
-                if (contractorMatch) {
-                    result.contractors = contractorMatch[1];
-                }
-            } catch (e) {
-                console.log('Ошибка при извлечении общей информации:', e);
-            }
-            
-
-            return result;
-        }''')
+        # Характеристики, галерею и ход строительства забираем одним запросом к странице
+        page_data = await page.evaluate(_OBJECT_PAGE_DATA_JS)
+        characteristics = page_data['characteristics']
 
         details.update(characteristics)
         print(f"Извлечены характеристики для объекта {obj_id}")
@@ -760,71 +1027,63 @@ async def extract_object_details(page, obj_id, on_partial=None):
 
         # Сбор изображений из галереи ЖК
         print(f"📷 Извлекаем фото галереи для объекта {obj_id}")
-        gallery_photos_urls = await extract_gallery_images(page)
+        gallery_photos_urls = page_data.get('gallery') or []
         if gallery_photos_urls:
-            # Загружаем фото в S3
-            s3_key_prefix = f"objects/{obj_id}/gallery"
-            saved_gallery = await process_photo_list(gallery_photos_urls, s3_key_prefix, 'photo', limit=12)
-            details['gallery_photos'] = saved_gallery
-            print(f"📸 Галерея загружена в S3: {len(saved_gallery)} файлов")
+            # В S3 загружаем вместе с фото хода строительства, одним набором задач
+            print(f"📷 Найдено {len(gallery_photos_urls)} фото галереи")
         else:
             print("ℹ️ Фото галереи не найдены")
 
         # Получаем данные о квартирах через отдельные API запросы с пагинацией
         flat_types = ['oneRoom', 'twoRoom', 'threeRoom', 'fourRoom']
-        flats_data = {}
-        
-        for flat_type in flat_types:
-            try:
-                # Проверяем бан перед обработкой каждого типа квартир
-                ban_detected = await check_ban_status(page)
-                
-                if ban_detected:
-                    print(f"🚫 Обнаружен бан перед обработкой квартир типа {flat_type}! Прерываем обработку объекта {obj_id}")
-                    return "BAN_DETECTED"
-                
+        flats_by_type = {}
+        # Типы квартир запрашиваются параллельно (запросы идут через fetch в той же странице),
+        # семафор ограничивает одновременные запросы, чтобы не провоцировать бан
+        flats_sem = asyncio.Semaphore(FLATS_CONCURRENCY)
+
+        async def fetch_flat_type(flat_type):
+            async with flats_sem:
+                # Бан проверяется внутри каждого запроса квартир (до и после него)
                 print(f"🏠 Получаем ВСЕ квартиры типа {flat_type} для объекта {obj_id}")
                 flats_result = await get_all_flats_for_type(page, obj_id, flat_type)
-                
-                # Проверяем, был ли обнаружен бан
-                if flats_result.get('consecutive_errors') == 999:
-                    print(f"🚫 Обнаружен бан при получении квартир! Прерываем обработку объекта {obj_id}")
-                    return "BAN_DETECTED"
-                
-                if flats_result['total_count'] > 0:
-                    flats_data[flat_type] = {
-                        'flats': flats_result['flats'],
-                        'total_count': flats_result['total_count']
-                    }
-                    print(f"✅ Получено {flats_result['total_count']} квартир типа {flat_type}")
+
+            # Проверяем, был ли обнаружен бан
+            if flats_result.get('consecutive_errors') == 999:
+                return "BAN_DETECTED"
+
+            if flats_result['total_count'] > 0:
+                flats_by_type[flat_type] = {
+                    'flats': flats_result['flats'],
+                    'total_count': flats_result['total_count']
+                }
+                print(f"✅ Получено {flats_result['total_count']} квартир типа {flat_type}")
+            else:
+                if flats_result.get('consecutive_errors', 0) >= 3:
+                    print(f"⚠️  Квартир типа {flat_type} не найдено (превышено количество ошибок)")
                 else:
-                    if flats_result.get('consecutive_errors', 0) >= 3:
-                        print(f"⚠️  Квартир типа {flat_type} не найдено (превышено количество ошибок)")
-                    else:
-                        print(f"ℹ️  Квартир типа {flat_type} не найдено")
-
-                # Проверяем бан после обработки каждого типа квартир
-                ban_detected_after_type = await check_ban_status(page)
-                if ban_detected_after_type:
-                    print(f"🚫 Обнаружен бан после обработки квартир типа {flat_type}! Прерываем обработку объекта {obj_id}")
-                    return "BAN_DETECTED"
-
-                # Промежуточное сохранение после каждого типа квартир
-                if callable(on_partial):
-                    try:
-                        details_partial = dict(details)
-                        if flats_data:
-                            details_partial['flats_data'] = dict(flats_data)
-                        on_partial(details_partial)
-                    except Exception as cb_err:
-                        print(f"Ошибка при промежуточном сохранении (квартиры {flat_type}): {cb_err}")
-
-                # Пауза между запросами разных типов квартир
-                if flat_type != 'fourRoom':  # Не делаем паузу после последнего типа
-                    await asyncio.sleep(1)
-
-            except Exception as e:
-                print(f"❌ Критическая ошибка при получении данных о {flat_type} квартирах: {e}")
+                    print(f"ℹ️  Квартир типа {flat_type} не найдено")
+
+            # Промежуточное сохранение после каждого типа квартир
+            if callable(on_partial):
+                try:
+                    details_partial = dict(details)
+                    if flats_by_type:
+                        details_partial['flats_data'] = {ft: flats_by_type[ft] for ft in flat_types if ft in flats_by_type}
+                    on_partial(details_partial)
+                except Exception as cb_err:
+                    print(f"Ошибка при промежуточном сохранении (квартиры {flat_type}): {cb_err}")
+            return None
+
+        flat_results = await asyncio.gather(*(fetch_flat_type(ft) for ft in flat_types), return_exceptions=True)
+        for flat_type, flat_result in zip(flat_types, flat_results):
+            if isinstance(flat_result, Exception):
+                print(f"❌ Критическая ошибка при получении данных о {flat_type} квартирах: {flat_result}")
+            elif flat_result == "BAN_DETECTED":
+                print(f"🚫 Обнаружен бан при получении квартир! Прерываем обработку объекта {obj_id}")
+                return "BAN_DETECTED"
+
+        # Порядок типов в результате тот же, что и в flat_types
+        flats_data = {ft: flats_by_type[ft] for ft in flat_types if ft in flats_by_type}
 
         # Добавляем данные о квартирах к общим данным
         if flats_data:
@@ -841,8 +1100,17 @@ async def extract_object_details(page, obj_id, on_partial=None):
 
         # Получаем данные о ходе строительства и фотографиях
         print(f"🏗️  Извлекаем данные о ходе строительства для объекта {obj_id}")
-        construction_data = await extract_construction_progress(page)
-        # Загружаем фото хода строительства в S3 (если есть)
+        # К этому моменту ленивые разделы обычно уже отрисованы: пустые перечитываем
+        gallery_photos_urls, construction_data = await reread_lazy_sections(
+            page, gallery_photos_urls, page_data.get('construction')
+        )
+
+        # Фото галереи и всех этапов строительства загружаем в S3 параллельно с общим лимитом
+        photo_jobs = []
+        photo_targets = []  # None — галерея, иначе этап строительства
+        if gallery_photos_urls:
+            photo_jobs.append((gallery_photos_urls, f"objects/{obj_id}/gallery", 12))
+            photo_targets.append(None)
         if construction_data:
             # Фото по этапам
             stages = construction_data.get('construction_stages') or []
@@ -851,10 +1119,19 @@ async def extract_object_details(page, obj_id, on_partial=None):
                 if not photos:
                     continue
                 stage_num = stage.get('stage_number') or (idx + 1)
-                s3_key_prefix = f"objects/{obj_id}/construction/stage_{stage_num}"
-                saved_stage = await process_photo_list(photos, s3_key_prefix, 'photo', limit=10)
-                stage['photos'] = saved_stage
-            
+                photo_jobs.append((photos, f"objects/{obj_id}/construction/stage_{stage_num}", 10))
+                photo_targets.append(stage)
+
+        if photo_jobs:
+            uploaded = await process_photo_lists(photo_jobs)
+            for target, saved in zip(photo_targets, uploaded):
+                if target is None:
+                    details['gallery_photos'] = saved
+                    print(f"📸 Галерея загружена в S3: {len(saved)} файлов")
+                else:
+                    target['photos'] = saved
+
+        if construction_data:
             # Убираем общий массив photos, оставляем только по этапам
             if 'photos' in construction_data:
                 del construction_data['photos']
@@ -881,22 +1158,7 @@ async def extract_object_details(page, obj_id, on_partial=None):
         print(f"Ошибка при извлечении данных объекта {obj_id}: {e}")
 
         # Проверяем, является ли это ошибкой прокси или соединения
-        connection_errors = [
-            "ERR_PROXY_CONNECTION_FAILED",
-            "ERR_CONNECTION_CLOSED", 
-            "ERR_CONNECTION_REFUSED",
-            "ERR_CONNECTION_RESET",
-            "ERR_CONNECTION_ABORTED",
-            "ERR_TUNNEL_CONNECTION_FAILED",
-            "ERR_EMPTY_RESPONSE",
-            "net::ERR_",
-            "PROXY",
-            "CONNECTION_CLOSED",
-            "timeout",
-            "Navigation"
-        ]
-        
-        is_network_error = any(err in error_message for err in connection_errors)
+        is_network_error = _PAGE_NETWORK_ERROR_RE.search(error_message) is not None
         if is_network_error:
             print("🔄 Обнаружена сетевая/прокси ошибка!")
             return "PROXY_ERROR"
@@ -906,8 +1168,62 @@ async def extract_object_details(page, obj_id, on_partial=None):
     return details
 
 
+def load_input_objects():
+    """Читает объекты из INPUT_JSON (NDJSON: по одному объекту на строку)"""
+    with open(INPUT_JSON, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def iterate_objects(objects):
+    """Перебирает объекты из списка или из асинхронного итератора (объекты из очереди этапа 1)."""
+    if hasattr(objects, '__aiter__'):
+        async for obj in objects:
+            yield obj
+    else:
+        for obj in objects:
+            yield obj
+
+
+async def queued_objects(objects_queue, received, processed_ids, failed_ids):
+    """
+    Отдает объекты из очереди этапа 1 по мере поступления (до маркера None),
+    пропуская уже обработанные и повторы. Все полученные объекты добавляются в received.
+    """
+    seen_ids = set()
+    while True:
+        obj = await objects_queue.get()
+        if obj is None:
+            return
+        received.append(obj)
+        obj_id = obj.get('objId')
+        if obj_id and obj_id not in processed_ids and obj_id not in failed_ids and obj_id not in seen_ids:
+            seen_ids.add(obj_id)
+            yield obj
+
+
+async def restart_browser(browser, delay):
+    """
+    Перезапускает браузер с новым прокси. Старый браузер закрывается параллельно
+    с паузой и запуском нового, так что перезапуск занимает max(закрытие, пауза + запуск).
+    """
+    async def close_old():
+        try:
+            await browser.close()
+        except Exception:
+            pass
+
+    async def launch_new():
+        await asyncio.sleep(delay)
+        return await setup_stealth_browser()
+
+    _, (new_browser, new_page) = await asyncio.gather(close_old(), launch_new())
+    return new_browser, new_page
+
+
 async def process_objects_batch(objects_to_process, collection, processed_ids, failed_ids, is_retry=False):
-    """Обрабатывает пакет объектов. Возвращает список ошибочных объектов."""
+    """
+    Обрабатывает пакет объектов (список или асинхронный итератор). Возвращает список ошибочных объектов.
+    """
     # Список для сохранения ошибочных объектов
     error_objects = []
     
@@ -923,17 +1239,21 @@ async def process_objects_batch(objects_to_process, collection, processed_ids, f
 
         # Обрабатываем объекты
         retry_suffix = " (ПОВТОРНАЯ ПОПЫТКА)" if is_retry else ""
-        for i, obj in enumerate(objects_to_process):
+        # Для очереди общее число объектов заранее неизвестно
+        total_suffix = f"/{len(objects_to_process)}" if isinstance(objects_to_process, list) else ""
+        i = 0
+        async for obj in iterate_objects(objects_to_process):
+            i += 1
             obj_id = obj.get('objId')
             obj_commerc_nm = obj.get('objCommercNm')
-            print(f"\n🔄 Обрабатываем объект {i + 1}/{len(objects_to_process)} (ID: {obj_id}){retry_suffix}")
+            print(f"\n🔄 Обрабатываем объект {i}{total_suffix} (ID: {obj_id}){retry_suffix}")
 
             # Проверяем дубликат в самом начале
             if check_duplicate_by_name(collection, obj_id, obj_commerc_nm):
                 print(f"⏭️  Пропускаем объект {obj_id} из-за дубликата")
                 # Сохраняем прогресс
                 processed_ids.add(obj_id)
-                save_progress(processed_ids, failed_ids)
+                save_progress(processed_ids, failed_ids, obj_id)
                 continue
 
             # Цикл повторных попыток для одного объекта
@@ -965,12 +1285,7 @@ async def process_objects_batch(objects_to_process, collection, processed_ids, f
 
                         if retry_obj < max_retries_obj:
                             # Перезапускаем браузер при ошибке прокси
-                            try:
-                                await browser.close()
-                            except:
-                                pass
-                            await asyncio.sleep(2)
-                            browser, page = await setup_stealth_browser()
+                            browser, page = await restart_browser(browser, 2)
                             print(f"🔄 Браузер перезапущен с новым прокси, повторяем объект {obj_id}")
                             continue  # Повторяем while для того же объекта
                         else:
@@ -987,12 +1302,7 @@ async def process_objects_batch(objects_to_process, collection, processed_ids, f
 
                         if retry_obj < max_retries_obj:
                             # Перезапускаем браузер при бане/капче
-                            try:
-                                await browser.close()
-                            except:
-                                pass
-                            await asyncio.sleep(5)  # Увеличиваем задержку при бане
-                            browser, page = await setup_stealth_browser()
+                            browser, page = await restart_browser(browser, 5)  # Увеличиваем задержку при бане
                             print(f"🔄 Браузер перезапущен после обнаружения бана, повторяем объект {obj_id}")
                             continue  # Повторяем while для того же объекта
                         else:
@@ -1007,14 +1317,16 @@ async def process_objects_batch(objects_to_process, collection, processed_ids, f
                         obj_copy['object_details'] = details
                         obj_copy['details_extracted_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
 
-                        # Обновляем запись в MongoDB используя умное сохранение
+                        # Обновляем запись в MongoDB используя умное сохранение. Обычно данные уже записаны
+                        # последним промежуточным сохранением, и вызов завершается по хэшу содержимого
+                        # без обращения к базе; если оно не удалось, запись выполняется здесь
                         try:
                             if upsert_object_smart(collection, obj_id, obj_copy):
                                 print(f"✅ Данные объекта {obj_id} сохранены в MongoDB (коллекция domrf)")
                                 processed_ids.add(obj_id)
 
                                 # Сохраняем прогресс после каждого успешного объекта
-                                save_progress(processed_ids, failed_ids)
+                                save_progress(processed_ids, failed_ids, obj_id)
 
                                 # Сбрасываем счетчик ошибок при успехе
                                 error_count = 0
@@ -1053,25 +1365,10 @@ async def process_objects_batch(objects_to_process, collection, processed_ids, f
                     print(f"Ошибка при работе с объектом {obj_id}: {e} (попытка {retry_obj}/{max_retries_obj})")
 
                     # Проверяем, является ли это ошибкой прокси или соединения
-                    connection_errors = [
-                        "ERR_PROXY_CONNECTION_FAILED",
-                        "ERR_CONNECTION_CLOSED", 
-                        "ERR_CONNECTION_REFUSED",
-                        "ERR_CONNECTION_RESET",
-                        "ERR_CONNECTION_ABORTED",
-                        "PROXY",
-                        "CONNECTION_CLOSED"
-                    ]
-                    
-                    if any(err in error_message for err in connection_errors):
+                    if _CONNECTION_ERROR_RE.search(error_message) is not None:
                         if retry_obj < max_retries_obj:
                             print(f"🔌 Обнаружена ошибка подключения/прокси! Перезапускаем браузер...")
-                            try:
-                                await browser.close()
-                            except:
-                                pass
-                            await asyncio.sleep(2)
-                            browser, page = await setup_stealth_browser()
+                            browser, page = await restart_browser(browser, 2)
                             print(f"🔄 Браузер перезапущен с новым прокси, повторяем объект {obj_id}")
                             error_count += 1
                             continue  # Повторяем while для того же объекта
@@ -1089,12 +1386,7 @@ async def process_objects_batch(objects_to_process, collection, processed_ids, f
             # Перезапускаем браузер при накоплении ошибок
             if error_count >= 10:
                 print(f"🚨 Накоплено {error_count} ошибок, перезапускаем браузер...")
-                try:
-                    await browser.close()
-                except:
-                    pass
-                await asyncio.sleep(3)
-                browser, page = await setup_stealth_browser()
+                browser, page = await restart_browser(browser, 3)
                 print("Браузер перезапущен из-за накопления ошибок")
                 error_count = 0
 
@@ -1118,39 +1410,62 @@ async def process_objects_batch(objects_to_process, collection, processed_ids, f
     return error_objects
 
 
-async def process_objects():
-    """Основная функция обработки объектов"""
+async def process_objects(objects_queue=None):
+    """
+    Основная функция обработки объектов (см. run_objects_processing).
+    Общая HTTP-сессия, пул сжатия фото и пул загрузки в S3 закрываются по завершении в любом случае.
+    """
+    try:
+        await run_objects_processing(objects_queue)
+    finally:
+        await close_http_session()
+        shutdown_resize_pool()
+        shutdown_upload_pool()
+
+
+async def run_objects_processing(objects_queue=None):
+    """
+    Обработка объектов.
+    Без objects_queue объекты читаются из INPUT_JSON; с очередью — обрабатываются по мере того,
+    как их присылает этап 1 (маркер конца — None).
+    """
     # Загружаем JSON файл с объектами
-    if not os.path.exists(INPUT_JSON):
+    if objects_queue is None and not os.path.exists(INPUT_JSON):
         print(f"Файл {INPUT_JSON} не найден!")
         return
 
     try:
         collection = get_collection()
-        with open(INPUT_JSON, 'r', encoding='utf-8') as f:
-            objects = json.load(f)
-        print(f"Загружено {len(objects)} объектов из JSON файла")
+        objects = []
+        if objects_queue is None:
+            objects = load_input_objects()
+            print(f"Загружено {len(objects)} объектов из JSON файла")
     except Exception as e:
         print(f"Ошибка при загрузке JSON файла: {e}")
         return
 
     # Загружаем прогресс
     progress = load_progress()
-    processed_ids = set(progress.get('processed_ids', []))
-    failed_ids = set(progress.get('failed_ids', []))
+    processed_ids = progress['processed_ids']
+    failed_ids = progress['failed_ids']
 
-    # Получаем список объектов для обработки
-    objects_to_process = []
-    for obj in objects:
-        obj_id = obj.get('objId')
-        if obj_id and obj_id not in processed_ids and obj_id not in failed_ids:
-            objects_to_process.append(obj)
+    if objects_queue is not None:
+        # Объекты приходят из очереди этапа 1; objects пополняется по мере поступления
+        objects_to_process = queued_objects(objects_queue, objects, processed_ids, failed_ids)
+        print("Объекты для обработки поступают от этапа сбора списка домов")
+    else:
+        # Получаем список объектов для обработки
+        objects_to_process = []
+        for obj in objects:
+            obj_id = obj.get('objId')
+            if obj_id and obj_id not in processed_ids and obj_id not in failed_ids:
+                objects_to_process.append(obj)
 
-    print(f"Найдено {len(objects_to_process)} объектов для обработки")
+        print(f"Найдено {len(objects_to_process)} объектов для обработки")
 
-    if not objects_to_process:
-        print("Все объекты уже обработаны")
-        return
+        if not objects_to_process:
+            print("Все объекты уже обработаны")
+            return
 
     # Первый проход - обработка основного списка объектов
     print("\n" + "="*80)
@@ -1159,7 +1474,7 @@ async def process_objects():
     error_objects = await process_objects_batch(objects_to_process, collection, processed_ids, failed_ids, is_retry=False)
 
     # Финальное сохранение прогресса после первого прохода
-    save_progress(list(processed_ids), list(failed_ids))
+    save_progress(processed_ids, failed_ids)
 
     # Второй проход - повторная обработка ошибочных объектов
     if error_objects:
@@ -1187,7 +1502,7 @@ async def process_objects():
         print("\n✅ Ошибочных объектов не обнаружено!")
 
     # Финальное сохранение прогресса
-    save_progress(list(processed_ids), list(failed_ids))
+    save_progress(processed_ids, failed_ids)
 
     print(f"\n" + "="*80)
     print(f"✅ ОБРАБОТКА ЗАВЕРШЕНА!")
@@ -1200,7 +1515,7 @@ async def process_objects():
 def main():
     """Главная функция"""
     print("🚀 Запуск скрипта извлечения деталей объектов...")
-    asyncio.get_event_loop().run_until_complete(process_objects())
+    asyncio.run(process_objects())
 
 
 if __name__ == '__main__':
@@ -48,16 +48,35 @@ class ImageProcessor:
 
         img.thumbnail(self.max_size)
 
-        quality = 95
-        while quality >= 10:
-            buffer = BytesIO()
+        # Один буфер на все попытки сжатия: перед каждой попыткой очищаем его
+        buffer = BytesIO()
+
+        def fits(quality):
+            buffer.seek(0)
+            buffer.truncate()
             img.save(buffer, format='JPEG', quality=quality)
-            size_kb = buffer.tell() / 1024
-            if size_kb <= self.max_kb:
-                # print(f"\n✅ Сжатие успешно ({size_kb:.2f} КБ, качество: {quality})")
-                buffer.seek(0)
-                return buffer
-            quality -= 5
+            return buffer.tell() / 1024 <= self.max_kb
+
+        # Чаще всего фото укладывается в лимит уже при максимальном качестве
+        if fits(95):
+            buffer.seek(0)
+            return buffer
+
+        # Размер JPEG растет с качеством, поэтому наибольшее подходящее качество из
+        # 90, 85, ..., 10 ищем бинарным поиском (до 5 сжатий вместо 17)
+        qualities = list(range(90, 9, -5))
+        best = None
+        lo, hi = 0, len(qualities) - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if fits(qualities[mid]):
+                best = buffer.getvalue()
+                hi = mid - 1
+            else:
+                lo = mid + 1
+        if best is not None:
+            # print(f"\n✅ Сжатие успешно ({len(best) / 1024:.2f} КБ)")
+            return BytesIO(best)
 
         self.logger.warning("\n❌ Не удалось сжать до нужного размера")
         return None
@@ -82,7 +101,9 @@ class ImageProcessor:
                 exif_dict["0th"][piexif.ImageIFD.Artist] = 'century21-mir-v-kvadratah'
                 exif_dict["0th"][piexif.ImageIFD.DateTime] = random_date_str
                 exif_bytes = piexif.dump(exif_dict)
-                img.save(output_bytes, "jpeg", exif=exif_bytes)
+                # Вставляем EXIF-сегмент в готовый JPEG без повторного декодирования и сжатия
+                # (img.save пережал бы фото с качеством по умолчанию)
+                piexif.insert(exif_bytes, img_bytes.getvalue(), output_bytes)
                 # print("✅ Обновлены метаданные для JPEG")
             except Exception as e:
                 self.logger.warning(f"❌ Неудачное обновление метаданных для JPEG: {e}")
@@ -1,8 +1,9 @@
 import os
-from typing import Optional
+from typing import BinaryIO, Optional
 from pathlib import Path
 from dotenv import load_dotenv
 import boto3
+from botocore.config import Config
 
 # Загружаем .env из корня проекта
 PROJECT_ROOT = Path(__file__).resolve().parent
@@ -27,7 +28,9 @@ class S3Service:
         region_name = os.getenv("AWS_S3_REGION_NAME")
         self.bucket_name = os.getenv("AWS_STORAGE_BUCKET_NAME")
 
-        # Инициализация клиента S3
+        # Инициализация клиента S3. Клиент потокобезопасен; пул соединений должен
+        # покрывать число одновременных загрузок из потоков, иначе они ждут соединение
+        max_pool_connections = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
         self.s3_client = boto3.client(
             "s3",
             endpoint_url=endpoint_url,
@@ -35,6 +38,7 @@ class S3Service:
             aws_secret_access_key=secret_access_key,
             region_name=region_name,
             use_ssl=False,
+            config=Config(max_pool_connections=max_pool_connections),
         )
 
         # Базовый публичный URL (если требуется строить абсолютные ссылки)
@@ -52,3 +56,18 @@ class S3Service:
 
         self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=data, **extra_args)
         return self.build_url(key)
+
+    def upload_fileobj(self, fileobj: BinaryIO, key: str, content_type: Optional[str] = "image/jpeg",
+                       length: Optional[int] = None) -> str:
+        """Загружает содержимое файлового объекта (например, BytesIO) с текущей позиции и возвращает публичный URL.
+        Данные не копируются в bytes; длина передается явно, чтобы SDK не вычислял ее сам.
+        """
+        key = key.lstrip("/")
+        if length is None:
+            start = fileobj.tell()
+            length = fileobj.seek(0, os.SEEK_END) - start
+            fileobj.seek(start)
+        extra_args = {"ContentType": content_type, "ContentLength": length}
+
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=fileobj, **extra_args)
+        return self.build_url(key)
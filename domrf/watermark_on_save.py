@@ -1,7 +1,7 @@
 import io
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional, Union
 
 from PIL import Image
 
@@ -30,9 +30,9 @@ def ensure_svg_to_png(svg_path: Path, scale_width_px: int) -> Image.Image:
 
 
 def apply_watermark(
-        photo_path: Path,
+        photo_path: Union[Path, BinaryIO],
         svg_logo_path: Path,
-        output_path: Path,
+        output_path: Union[Path, BinaryIO],
         relative_width: float = 0.2,
         opacity: float = 0.6,
         margin_px: int = 24,
@@ -73,7 +73,9 @@ def apply_watermark(
     composed.alpha_composite(logo_rgba, dest=(max(0, x), max(0, y)))
 
     rgb = composed.convert("RGB")
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Вместо путей можно передать файловые объекты (например, BytesIO) — тогда все идет в памяти
+    if isinstance(output_path, Path):
+        output_path.parent.mkdir(parents=True, exist_ok=True)
     rgb.save(output_path, format="JPEG", quality=92)
 
 
@@ -85,27 +87,21 @@ def _watermark_bytes(
         rel_width: float = 0.2,
         position: str = "center",
         margin: int = 24,
-) -> bytes:
-    with Image.open(io.BytesIO(image_bytes)) as img:
-        tmp_in = Path("/tmp/domrf_wm_in.jpg")
-        tmp_out = Path("/tmp/domrf_wm_out.jpg")
-        tmp_in.parent.mkdir(parents=True, exist_ok=True)
-        fmt = "PNG" if img.mode in ("RGBA", "LA") else "JPEG"
-        img.convert("RGBA" if fmt == "PNG" else "RGB").save(tmp_in, format=fmt)
-
+) -> io.BytesIO:
+    """Накладывает водяной знак в памяти и возвращает JPEG в BytesIO (позиция в начале)."""
+    output = io.BytesIO()
     apply_watermark(
-        photo_path=tmp_in,
+        photo_path=io.BytesIO(image_bytes),
         svg_logo_path=logo_path,
-        output_path=tmp_out,
+        output_path=output,
         relative_width=rel_width,
         opacity=opacity,
         margin_px=margin,
         position=position,
         full_coverage=full,
     )
-
-    with open(tmp_out, "rb") as f:
-        return f.read()
+    output.seek(0)
+    return output
 
 
 def upload_with_watermark(
@@ -131,4 +127,4 @@ def upload_with_watermark(
         rel_width=0.2,
         position="center",
     )
-    return s3.upload_bytes(watermarked, key=key, content_type=overwrite_content_type)
+    return s3.upload_fileobj(watermarked, key=key, content_type=overwrite_content_type)